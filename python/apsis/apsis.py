@@ -1,6 +1,7 @@
 import asyncio
 import logging
 from   ora import now, Time
+import resource
 import sys
 import traceback
 
@@ -12,10 +13,12 @@ from   .jobs import Jobs, load_jobs_dir, diff_jobs_dirs
 from   .lib.asyn import cancel_task
 from   .program import ProgramError, ProgramFailure, Output, OutputMetadata
 from   . import runs
-from   .runs import Run, RunStore, MissingArgumentError, ExtraArgumentError
+from   .runs import Run, ExpectedRun, RunStore
+from   .runs import MissingArgumentError, ExtraArgumentError
 from   .runs import get_bind_args
 from   .scheduled import ScheduledRuns
 from   .scheduler import Scheduler, get_runs_to_schedule
+from   .starter import Starter
 from   .waiter import Waiter
 
 log = logging.getLogger(__name__)
@@ -61,11 +64,23 @@ class Apsis:
             min_timestamp = None
         else:
             min_timestamp = now() - runs_lookback
-        self.run_store = RunStore(db, min_timestamp=min_timestamp)
+        self.run_store = RunStore(
+            db,
+            min_timestamp   =min_timestamp,
+            max_age         =cfg.get("runs_evict_age"),
+            cache_size      =cfg.get("runs_cache_size", RunStore.CACHE_SIZE),
+        )
 
         log.info("scheduling runs")
-        self.scheduled = ScheduledRuns(db.clock_db, self.__wait)
-        self.__waiter = Waiter(self.run_store, self.__start, self.run_history)
+        self.scheduled = ScheduledRuns(
+            db.clock_db, self.__wait,
+            queue=cfg.get("scheduled_queue", "heap"),
+            clock_interval=cfg.get(
+                "clock_interval", ScheduledRuns.CLOCK_INTERVAL),
+        )
+        self.__starter = Starter(self.__start, cfg.get("start_limit", {}))
+        self.__waiter = Waiter(
+            self.run_store, self.__starter.start, self.run_history)
         # For now, expose the output database directly.
         self.outputs = db.output_db
         # Tasks for running jobs currently awaited.
@@ -76,7 +91,10 @@ class Apsis:
         stop_time = db.clock_db.get_time()
         log.info(f"scheduling runs from {stop_time}")
 
-        self.scheduler = Scheduler(cfg, self.jobs, self.schedule, stop_time)
+        self.scheduler = Scheduler(
+            cfg, self.jobs, self.run_store.add_expected, self.schedule,
+            stop_time
+        )
 
 
     async def restore(self):
@@ -140,6 +158,10 @@ class Apsis:
         log.info("scheduling waiter loop")
         self.__waiter_task = asyncio.ensure_future(self.__waiter.loop())
 
+        # Set up the starter for limiting run starts.
+        log.info("starting starter loop")
+        self.__starter_task = asyncio.ensure_future(self.__starter.loop())
+
 
     async def __wait(self, run):
         """
@@ -164,6 +186,11 @@ class Apsis:
                 outputs =exc.outputs,
             )
 
+        except Exception:
+            # Unexpected; the run stays waiting, but is no longer starting.
+            self.run_store.set_starting(run, False)
+            raise
+
         else:
             # Program started successfully.
             self.run_history.info(run, "program started")
@@ -267,10 +294,15 @@ class Apsis:
         if run.meta.get("labels") is None:
             run.meta["labels"] = job.meta.get("labels", [])
 
+        # Attach job priority and weight to the run.
+        for key in "priority", "weight":
+            if key in job.meta:
+                run.meta.setdefault(key, job.meta[key])
+
         return True
 
 
-    def __rerun(self, run):
+    async def __rerun(self, run):
         """
         Reruns a failed run, if indicated by the job's rerun policy.
         """
@@ -279,8 +311,9 @@ class Apsis:
             # No reruns.
             return
 
-        # Collect all reruns of this run, including the original run.
-        _, runs = self.run_store.query(rerun=run.rerun)
+        # Collect all reruns of this run, including the original run.  Earlier
+        # runs may have been evicted, so fetch them off the event loop.
+        _, runs = await self.run_store.query_async(rerun=run.rerun)
 
         if len(runs) > job.reruns.count:
             # No further reruns.
@@ -297,7 +330,7 @@ class Apsis:
 
         # OK, we can rerun.
         rerun_time = time + job.reruns.delay
-        asyncio.ensure_future(self.rerun(run, time=rerun_time))
+        await self.rerun(run, time=rerun_time)
 
 
     def __do_actions(self, run):
@@ -384,7 +417,7 @@ class Apsis:
         self.run_store.update(run, time)
 
         if state == run.STATE.failure:
-            self.__rerun(run)
+            asyncio.ensure_future(self.__rerun(run))
 
         self.__do_actions(run)
 
@@ -425,12 +458,21 @@ class Apsis:
         :param time:
           The schedule time at which to run the run.  If `None`, the run
           is run now, instead of scheduled.
+        :param run:
+          A new run, or an expected run placeholder to promote.
         :return:
-          The run, either scheduled or error.
+          The run, either scheduled or error, or `None` if `run` is an
+          expected run that has already been removed or promoted.
         """
         time = None if time is None else Time(time)
 
-        self.run_store.add(run)
+        if isinstance(run, ExpectedRun):
+            run = self.run_store.promote(run)
+            if run is None:
+                return None
+        else:
+            self.run_store.add(run)
+
         if not self.__prepare_run(run):
             return run
 
@@ -445,12 +487,59 @@ class Apsis:
             return run
 
 
+    async def promote(self, run):
+        """
+        Promotes `run` to a full run, if it's an expected run placeholder.
+
+        :return:
+          The full run, or `None` if the placeholder has been removed.
+        """
+        if isinstance(run, ExpectedRun):
+            run = await self.schedule(run.time, run)
+        return run
+
+
+    def preview(self, run):
+        """
+        Returns a full run for viewing, without side effects.
+
+        For an expected run placeholder, returns a transient full run with its
+        program and conditions bound from the job.  The placeholder is not
+        promoted, and the transient run is not in the run store.  Otherwise,
+        returns `run`.
+        """
+        if not isinstance(run, ExpectedRun):
+            return run
+
+        full = Run(run.inst, expected=True)
+        full.run_id = full.rerun = run.run_id
+        full.timestamp = run.timestamp
+        full.state = run.state
+        full.times = dict(run.times)
+        full.meta = run.meta
+        try:
+            job = self._validate_run(full)
+            full.program = job.program.bind(get_bind_args(full))
+            full.conds = [ c.bind(full, self.jobs) for c in job.conds ]
+        except Exception as exc:
+            # The run will error when it's promoted.
+            full.message = str(exc)
+        else:
+            for key in "priority", "weight":
+                if key in job.meta:
+                    full.meta[key] = job.meta[key]
+        return full
+
+
     async def cancel(self, run):
         """
         Cancels a scheduled run.
 
         Unschedules the run and sets it to the error state.
         """
+        run = await self.promote(run)
+        if run is None:
+            return
         self.scheduled.unschedule(run)
         self.run_history.info(run, "cancelled")
         self._transition(run, run.STATE.error, message="cancelled")
@@ -461,17 +550,44 @@ class Apsis:
         Starts immediately a scheduled run.
         """
         # FIXME: Race conditions?
+        run = await self.promote(run)
+        if run is None:
+            return
         self.scheduled.unschedule(run)
         await self.__wait(run)
 
 
+    def get_stats(self):
+        """
+        Returns internal statistics, for monitoring.
+        """
+        return {
+            "memory": {
+                # Peak resident set size.
+                "max_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            },
+            "db": self.__db.get_stats(),
+            "run_store": self.run_store.get_stats(),
+            "scheduled": self.scheduled.get_stats(),
+            "starter": self.__starter.get_stats(),
+            "waiter": self.__waiter.get_stats(),
+        }
+
+
+    def get_blocked_by(self, run):
+        """
+        Returns waiting runs whose blocking condition watches `run`'s instance.
+        """
+        return self.__waiter.get_blocked_by(run.inst)
+
+
     async def get_run_history(self, run_id):
         """
         Returns history log for a run.
         """
         # Make sure the run ID is valid.
-        self.run_store.get(run_id)
-        return self.__db.run_history_db.query(run_id=run_id)
+        await self.run_store.get_async(run_id)
+        return await self.__db.run_history_db.query_async(run_id=run_id)
 
 
     async def rerun(self, run, *, time=None):
@@ -495,6 +611,7 @@ class Apsis:
         await cancel_task(self.__scheduler_task, "scheduler", log)
         await cancel_task(self.__scheduled_task, "scheduled", log)
         await cancel_task(self.__waiter_task, "waiter", log)
+        await cancel_task(self.__starter_task, "starter", log)
         for run_id, task in self.__running_tasks.items():
             await cancel_task(task, f"run {run_id}", log)
         await self.run_store.shut_down()
@@ -521,7 +638,7 @@ async def reschedule_runs(apsis, job_id):
     """
     Reschedules runs of `job_id`.
 
-    Unschedules and deletes existing scheduled runs.  Thenq rebuilds and
+    Unschedules and deletes existing scheduled runs.  Then rebuilds and
     reschedules runs according to the current job schedules.
     """
     scheduler = apsis.scheduler
@@ -540,7 +657,7 @@ async def reschedule_runs(apsis, job_id):
     job = apsis.jobs.get_job(job_id)
     schedule = list(get_runs_to_schedule(job, scheduled_time, scheduler_time))
     for time, run in schedule:
-        await apsis.schedule(time, run)
+        await scheduler.expect(time, run)
 
 
 async def reload_jobs(apsis, *, dry_run=False):
@@ -28,11 +28,58 @@ class Condition(TypedJso):
         """
         Checks whether all run conditions are met.
 
+        Considers only runs in memory.
+
         :return:
           True if dependencies are met.
         """
 
 
+    async def check_runs_async(self, run_store):
+        """
+        Like `check_runs()`, but may also check evicted runs in the run DB.
+
+        The waiter checks conds with this.  Overrides must not read the run DB
+        on the event loop.
+        """
+        return self.check_runs(run_store)
+
+
+    def watch(self):
+        """
+        Returns instances whose runs' transitions may change this condition.
+
+        :return:
+          An iterable of `(job_id, args)` pairs, where `args` is `None` to
+          watch all runs of the job; or `None` if a transition of any run may
+          change the condition.
+        """
+        return None
+
+
+    def is_satisfied_by(self, run):
+        """
+        Returns true if `run`, in its current state, satisfies the condition.
+
+        Used to avoid a full check when a watched run changes.  A false result
+        means only that a full check is required.
+        """
+        return False
+
+
+    def get_block_key(self):
+        """
+        Returns a key shared by conds that are satisfied or not together.
+
+        Waiting runs are rechecked in order; once a cond is found blocking,
+        later runs blocked by a cond with the same key are not rechecked.
+
+        :return:
+          A hashable key, or `None` if the cond doesn't share its result.
+        """
+        return None
+
+
 
 #-------------------------------------------------------------------------------
 
@@ -58,6 +58,18 @@ class Dependency(Condition):
         return type(self)(self.job_id, args, self.states)
 
 
+    def watch(self):
+        return ((self.job_id, self.args), )
+
+
+    def is_satisfied_by(self, run):
+        return (
+                run.state in self.states
+            and run.inst.job_id == self.job_id
+            and run.inst.args == self.args
+        )
+
+
     # FIXME: Handle exceptions when checking.
 
     def check_runs(self, run_store):
@@ -75,4 +87,14 @@ class Dependency(Condition):
             return True
 
 
+    async def check_runs_async(self, run_store):
+        # The dependency may be satisfied by an evicted run.
+        satisfied = await run_store.exists_async(
+            job_id=self.job_id, args=self.args, state=self.states)
+        if not satisfied:
+            inst = Instance(self.job_id, self.args)
+            log.debug(f"dep not satisified: {inst}")
+        return satisfied
+
+
 
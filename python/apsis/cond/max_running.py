@@ -1,7 +1,7 @@
 import logging
 
 from   apsis.lib.py import format_ctor
-from   apsis.runs import Run, get_bind_args, template_expand
+from   apsis.runs import get_bind_args, template_expand
 from   .base import Condition
 
 log = logging.getLogger(__name__)
@@ -67,17 +67,18 @@ class MaxRunning(Condition):
         return type(self)(count, job_id, run.inst.args)
 
 
+    def watch(self):
+        return None if self.__job_id is None else ((self.__job_id, None), )
+
+
+    def get_block_key(self):
+        args = None if self.__args is None else frozenset(self.__args.items())
+        return type(self), self.__count, self.__job_id, args
+
+
     def check_runs(self, run_store):
         max_count = int(self.__count)
-
-        # FIXME: Support query by args.
-        _, running = run_store.query(
-            job_id=self.__job_id, 
-            state=Run.STATE.running,
-        )
-        for name, val in self.__args.items():
-            running = ( r for r in running if r.inst.args.get(name) == val )
-        count = len(list(running))
+        count = run_store.count_running(self.__job_id, self.__args)
         log.debug(f"count matching {self.__job_id} {self.__args}: {count}")
         return count < max_count
 
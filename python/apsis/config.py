@@ -30,6 +30,10 @@ def check(cfg, base_path: Path):
         log.error(f"missing database: {database}")
     cfg["database"] = database
 
+    output_dir = cfg.get("output_dir")
+    if output_dir is not None:
+        cfg["output_dir"] = normalize_path(output_dir, base_path)
+
     cfg["actions"] = to_array(cfg.get("action", []))
 
     return cfg
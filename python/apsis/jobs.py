@@ -87,6 +87,13 @@ class Job:
 
 
 
+def is_scheduled(job):
+    """
+    Returns true if `job` has any enabled schedules.
+    """
+    return any( s.enabled for s in job.schedules )
+
+
 #-------------------------------------------------------------------------------
 
 class JobErrors(Exception):
@@ -158,6 +165,12 @@ def jso_to_job(jso, job_id):
             str(l)
             for l in tupleize(metadata.get("labels", []))
         ]
+        if "priority" in metadata:
+            metadata["priority"] = int(metadata["priority"])
+        if "weight" in metadata:
+            metadata["weight"] = float(metadata["weight"])
+            if not metadata["weight"] > 0:
+                raise SchemaError(f"weight not positive: {metadata['weight']}")
 
         ad_hoc      = pop("ad_hoc", bool, default=False)
 
@@ -233,10 +246,12 @@ class JobsDir:
             raise LookupError(f"no job {job_id}")
 
 
-    def get_jobs(self, *, ad_hoc=None):
+    def get_jobs(self, *, ad_hoc=None, scheduled=None):
         jobs = self.__jobs.values()
         if ad_hoc is not None:
             jobs = ( j for j in jobs if j.ad_hoc == ad_hoc )
+        if scheduled is not None:
+            jobs = ( j for j in jobs if is_scheduled(j) == scheduled )
         return jobs
 
 
@@ -347,16 +362,28 @@ class Jobs:
     __getitem__ = get_job
 
 
-    def get_jobs(self, *, ad_hoc=None):
+    async def get_job_async(self, job_id) -> Job:
+        """
+        Like `get_job()`, but reads the job DB in a reader thread.
+        """
+        with suppress(LookupError):
+            return self.__jobs_dir.get_job(job_id)
+        return await self.__job_db.get_async(job_id)
+
+
+    def get_jobs(self, *, ad_hoc=None, scheduled=None):
         """
         :param ad_hoc:
           If true, return ad hoc jobs only; if false, return normal jobs only;
           if none, return all jobs.
+        :param scheduled:
+          If true, return only jobs with enabled schedules; if false, return
+          only jobs without; if none, return all jobs.
         """
         if ad_hoc is None or not ad_hoc:
-            yield from self.__jobs_dir.get_jobs()
+            yield from self.__jobs_dir.get_jobs(scheduled=scheduled)
         # FIXME: Yield only job ids we haven't seen.
-        yield from self.__job_db.query(ad_hoc=ad_hoc)
+        yield from self.__job_db.query(ad_hoc=ad_hoc, scheduled=scheduled)
 
 
     def __get_job_id(self):
@@ -0,0 +1,128 @@
+"""
+Content-addressed file storage.
+"""
+
+import hashlib
+import mmap
+import os
+from   pathlib import Path
+import tempfile
+
+#-------------------------------------------------------------------------------
+
+class BlobStore:
+    """
+    Stores blobs of bytes as files under a directory, keyed by content.
+
+    The key of a blob is the hex SHA-256 of its contents.  Blobs are stored
+    in subdirectories by the first two key digits.  Storing the same contents
+    twice stores one file.
+    """
+
+    def __init__(self, path):
+        self.__path = Path(path).absolute()
+        self.__path.mkdir(parents=True, exist_ok=True)
+
+
+    @property
+    def path(self):
+        return self.__path
+
+
+    def get_path(self, key) -> Path:
+        return self.__path / key[: 2] / key
+
+
+    def __contains__(self, key):
+        return self.get_path(key).is_file()
+
+
+    def keys(self):
+        """
+        Returns keys of all stored blobs.
+        """
+        return (
+            p.name
+            for d in self.__path.iterdir() if d.is_dir()
+            for p in d.iterdir() if not p.name.startswith(".")
+        )
+
+
+    def put(self, data) -> str:
+        """
+        Stores `data`, and returns its key.
+
+        The blob is written to a temporary file, synced, and then moved into
+        place, so a stored blob is always complete.
+        """
+        key = hashlib.sha256(data).hexdigest()
+        path = self.get_path(key)
+        if path.is_file():
+            return key
+
+        path.parent.mkdir(exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=".")
+        try:
+            with os.fdopen(fd, "wb") as file:
+                file.write(data)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+        # Sync the directory too, so the new name is durable.
+        dir_fd = os.open(path.parent, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+        return key
+
+
+    def get(self, key):
+        """
+        Returns a blob's contents, memory-mapped.
+
+        :return:
+          A read-only `mmap.mmap`, or `bytes` if the blob is empty.
+        :raise LookupError:
+          No such blob.
+        """
+        try:
+            file = open(self.get_path(key), "rb")
+        except FileNotFoundError:
+            raise LookupError(f"no blob {key}") from None
+        with file:
+            if os.fstat(file.fileno()).st_size == 0:
+                return b""
+            return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+    def check(self, key):
+        """
+        Returns true if the blob exists and matches its key.
+        """
+        digest = hashlib.sha256()
+        try:
+            with open(self.get_path(key), "rb") as file:
+                for chunk in iter(lambda: file.read(1 << 20), b""):
+                    digest.update(chunk)
+        except FileNotFoundError:
+            return False
+        return digest.hexdigest() == key
+
+
+    def remove(self, key):
+        """
+        Removes a blob, if it exists.
+        """
+        try:
+            self.get_path(key).unlink()
+        except FileNotFoundError:
+            pass
+
+
+
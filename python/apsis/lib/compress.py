@@ -0,0 +1,107 @@
+"""
+Data compression, by name.
+
+A compression is an object with methods,
+
+- `compress(data)`, which returns compressed bytes;
+- `decompress_chunks(data, chunk_size)`, which decompresses bytes and yields
+  them in chunks of at most `chunk_size` bytes.
+
+Register other compressions with `register()`.
+"""
+
+import zlib
+
+#-------------------------------------------------------------------------------
+
+# Default chunk size for decompressing.
+CHUNK_SIZE = 1024 * 1024
+
+class Zlib:
+    """
+    zlib compression, from the standard library.
+    """
+
+    def __init__(self, level=6):
+        self.__level = int(level)
+
+
+    def compress(self, data):
+        return zlib.compress(data, self.__level)
+
+
+    def decompress_chunks(self, data, chunk_size):
+        decompressor = zlib.decompressobj()
+        # Feed the input a piece at a time, so that the unconsumed tail, which
+        # is copied, stays small.
+        for i in range(0, len(data), chunk_size):
+            piece = data[i : i + chunk_size]
+            while len(piece) > 0:
+                chunk = decompressor.decompress(piece, chunk_size)
+                if len(chunk) > 0:
+                    yield chunk
+                piece = decompressor.unconsumed_tail
+        chunk = decompressor.flush()
+        if len(chunk) > 0:
+            yield chunk
+
+
+
+COMPRESSIONS = {
+    "zlib": Zlib(),
+}
+
+def register(name, compression):
+    """
+    Registers `compression` as `name`.
+    """
+    COMPRESSIONS[str(name)] = compression
+
+
+def get(name):
+    """
+    Returns the compression registered as `name`.
+
+    :raise LookupError:
+      No such compression.
+    """
+    try:
+        return COMPRESSIONS[name]
+    except KeyError:
+        raise LookupError(f"unknown compression: {name}") from None
+
+
+def compress(name, data):
+    return get(name).compress(data)
+
+
+def decompress_chunks(name, data, chunk_size=CHUNK_SIZE):
+    """
+    Decompresses `data`, and yields it in chunks.
+
+    :param name:
+      The compression name, or `None` if `data` is not compressed.
+    """
+    if name is None:
+        for i in range(0, len(data), chunk_size):
+            yield data[i : i + chunk_size]
+    else:
+        yield from get(name).decompress_chunks(data, chunk_size)
+
+
+def decompress(name, data):
+    """
+    Decompresses `data`.
+
+    :param name:
+      The compression name, or `None` if `data` is not compressed.
+    :param data:
+      Bytes, or another object that supports `len()` and slicing to bytes,
+      such as a memory map.
+    """
+    if name is None:
+        return data if isinstance(data, bytes) else data[:]
+    else:
+        return b"".join(decompress_chunks(name, data))
+
+
@@ -0,0 +1,46 @@
+import bisect
+
+#-------------------------------------------------------------------------------
+
+class Histogram:
+    """
+    Counts of values in buckets, with fixed bucket upper bounds.
+
+      >>> h = Histogram([1, 10])
+      >>> for x in (0.5, 2, 3, 100):
+      ...     h.add(x)
+      >>> h.to_jso()["buckets"]
+      [['1', 1], ['10', 2], ['inf', 1]]
+
+    """
+
+    # Default bucket bounds, in seconds.
+    SECONDS = (0.001, 0.01, 0.1, 1, 10, 60, 600, 3600)
+
+    def __init__(self, bounds=SECONDS):
+        self.bounds = tuple(sorted(bounds))
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count  = 0
+        self.sum    = 0
+        self.max    = None
+
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if self.max is None or value > self.max:
+            self.max = value
+
+
+    def to_jso(self):
+        bounds = [ format(b, "g") for b in self.bounds ] + ["inf"]
+        return {
+            "count"     : self.count,
+            "mean"      : None if self.count == 0 else self.sum / self.count,
+            "max"       : self.max,
+            "buckets"   : [ [b, c] for b, c in zip(bounds, self.counts) ],
+        }
+
+
+
@@ -49,7 +49,7 @@ class Output:
         """
         self.metadata       = metadata
         self.data           = data
-        self.compression    = None
+        self.compression    = compression
     
 
 
@@ -310,6 +310,14 @@ class AgentProgram(Program):
         return join_args(self.__argv)
 
 
+    @property
+    def host(self):
+        """
+        The host or host group name to run on, or `None` for localhost.
+        """
+        return self.__host
+
+
     def bind(self, args):
         argv = tuple( template_expand(a, args) for a in self.__argv )
         host = or_none(template_expand)(self.__host, args)
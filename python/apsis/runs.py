@@ -1,11 +1,13 @@
 import asyncio
-from   contextlib import contextmanager
+from   collections import Counter, OrderedDict
+from   contextlib import contextmanager, suppress
 import enum
 import itertools
 import jinja2
 import logging
 from   ora import now, Time
 import shlex
+import sys
 
 from   .lib.memo import memoize
 from   .lib.py import format_ctor, iterize
@@ -45,14 +47,25 @@ class ExtraArgumentError(RunError):
 
 #-------------------------------------------------------------------------------
 
+def _intern(s):
+    """
+    Interns string `s`, so that runs share job IDs and args.
+    """
+    return sys.intern(s if type(s) is str else str(s))
+
+
 class Instance:
     """
     A job with bound parameters.  Not user-visible.
     """
 
+    __slots__ = ("job_id", "args", "__hash")
+
     def __init__(self, job_id, args):
-        self.job_id = job_id
-        self.args   = dict(sorted( (str(k), str(v)) for k, v in args.items() ))
+        self.job_id = _intern(job_id)
+        self.args   = dict(sorted(
+            (_intern(k), _intern(v)) for k, v in args.items() ))
+        self.__hash = None
 
 
     def __repr__(self):
@@ -67,7 +80,10 @@ class Instance:
 
 
     def __hash__(self):
-        return hash(self.job_id) ^ hash(tuple(sorted(self.args.items())))
+        if self.__hash is None:
+            # Args are already sorted.
+            self.__hash = hash(self.job_id) ^ hash(tuple(self.args.items()))
+        return self.__hash
 
 
     def __eq__(self, other):
@@ -149,6 +165,13 @@ class Run:
 
     # FIXME: Make the attributes read-only.
 
+    # Runs are numerous, so we use slots.  `_rowid` is set by the run DB.
+    __slots__ = (
+        "inst", "run_id", "timestamp", "state", "expected", "conds",
+        "program", "times", "meta", "message", "run_state", "rerun",
+        "_jso_cache", "_rowid",
+    )
+
     def __init__(self, inst, *, rerun=None, expected=False):
         """
         :param rerun:
@@ -232,6 +255,76 @@ class Run:
 
 
 
+class ExpectedRun:
+    """
+    A lightweight placeholder for a run expected from a job schedule.
+
+    The scheduler creates these, rather than full runs, for the runs it expects
+    over its horizon.  An expected run has a run ID and looks enough like a
+    `Run` in the scheduled state for queries and run summaries, but it has no
+    bound program or conditions, and no run history.  It is promoted to a full
+    run when it is close to its schedule time, or when it is acted on.
+    """
+
+    __slots__ = (
+        "inst", "time", "labels", "run_id", "timestamp", "state", "_jso_cache")
+
+    STATE       = Run.STATE
+
+    expected    = True
+    conds       = None
+    program     = None
+    message     = None
+    run_state   = None
+
+    def __init__(self, inst, time, *, labels=()):
+        """
+        :param time:
+          The schedule time.
+        :param labels:
+          Labels of the job.
+        """
+        self.inst       = inst
+        self.time       = time
+        self.labels     = labels
+        self.run_id     = None
+        self.timestamp  = None
+        self.state      = Run.STATE.scheduled
+        self._jso_cache = None
+
+
+    def __hash__(self):
+        return hash(self.run_id)
+
+
+    def __lt__(self, other):
+        return self.time < other.time
+
+
+    def __repr__(self):
+        return format_ctor(self, self.inst, self.time, run_id=self.run_id)
+
+
+    def __str__(self):
+        return f"{self.run_id} expected {self.inst}"
+
+
+    @property
+    def rerun(self):
+        return self.run_id
+
+
+    @property
+    def times(self):
+        return {"schedule": self.time}
+
+
+    @property
+    def meta(self):
+        return {"labels": list(self.labels)}
+
+
+
 #-------------------------------------------------------------------------------
 
 def get_bind_args(run):
@@ -245,8 +338,122 @@ def get_bind_args(run):
     }    
 
 
+def _get_latest_time(run):
+    """
+    Returns the time of `run`'s most recent event; orders runs in a rerun group.
+    """
+    return max(run.times.values(), default=Time.EPOCH)
+
+
+def get_priority(run):
+    """
+    Returns the start priority of `run`.  Higher priority runs start first.
+    """
+    return int(run.meta.get("priority", 0))
+
+
+def get_weight(run):
+    """
+    Returns the start weight of `run`.  Among runs of the same priority, jobs
+    start runs in proportion to their weights.
+    """
+    return float(run.meta.get("weight", 1))
+
+
 #-------------------------------------------------------------------------------
 
+class LiveQueue:
+    """
+    Buffer of run changes for one live subscriber.
+
+    Changes to the same run are coalesced; the subscriber gets only the run's
+    latest state.  If more than `max_size` runs are pending, the subscriber is
+    too slow: the pending runs are discarded, and it gets `RESYNC` instead, and
+    should query the runs it is interested in again.
+    """
+
+    # Marker returned by `get()` when the subscriber must resync.
+    RESYNC = "resync"
+
+    def __init__(self, max_size):
+        self.__max_size = max_size
+        self.__when = None
+        # Pending runs by run ID.
+        self.__runs = {}
+        self.__resync = False
+        self.__closed = False
+        self.__event = asyncio.Event()
+
+
+    def __len__(self):
+        return len(self.__runs)
+
+
+    @property
+    def closed(self):
+        return self.__closed
+
+
+    def put(self, when, runs, *, bounded=True):
+        """
+        Adds changes to `runs`.
+
+        :param bounded:
+          If false, don't resync if this exceeds the max size.
+        :return:
+          True if this overflowed the queue, which will resync.
+        """
+        if self.__closed:
+            return False
+        self.__when = when
+        self.__event.set()
+        if self.__resync:
+            # Already resyncing; no need to hold on to changes.
+            return False
+
+        pending = self.__runs
+        for run in runs:
+            pending[run.run_id] = run
+        if bounded and len(pending) > self.__max_size:
+            log.warning("live queue overflow; resyncing")
+            pending.clear()
+            self.__resync = True
+            return True
+        else:
+            return False
+
+
+    def close(self):
+        """
+        Indicates that the store is shutting down.
+        """
+        self.__closed = True
+        self.__event.set()
+
+
+    async def get(self):
+        """
+        Waits for and returns changes.
+
+        :return:
+          `(when, runs)` for pending changes; `RESYNC` if changes were
+          discarded; or `None` if the store is shutting down.
+        """
+        while True:
+            if self.__closed:
+                return None
+            if self.__resync:
+                self.__resync = False
+                return self.RESYNC
+            if len(self.__runs) > 0:
+                runs = list(self.__runs.values())
+                self.__runs.clear()
+                return self.__when, runs
+            self.__event.clear()
+            await self.__event.wait()
+
+
+
 class RunStore:
     """
     Stores run state.
@@ -258,11 +465,43 @@ class RunStore:
     1. Serving live queries of runs.
     """
 
-    # FIXME: For now, we cache all runs in memory.  At some point, we'll need
-    # to start retiring older runs.
+    # Runs in memory include all runs that are not finished.  Finished runs
+    # older than `max_age` are evicted from memory.  A query that names run
+    # IDs, a job ID, or a rerun group also fetches matching evicted runs from
+    # the run DB.  Recently fetched runs are kept in an LRU cache.
+
+    FINISHED = frozenset({
+        Run.STATE.success, Run.STATE.failure, Run.STATE.error})
+
+    # Default max number of evicted runs cached.
+    CACHE_SIZE = 10000
 
-    def __init__(self, db, *, min_timestamp):
+    # Min interval between eviction passes.
+    EVICT_INTERVAL = 60
+
+    # Max number of runs pending for a live subscriber, before it resyncs.
+    LIVE_QUEUE_SIZE = 10000
+
+    def __init__(self, db, *, min_timestamp, max_age=None,
+                 cache_size=CACHE_SIZE):
+        """
+        :param min_timestamp:
+          Runs older than this are neither loaded nor fetched from the run DB.
+        :param max_age:
+          Finished runs older than this are evicted from memory, or `None` to
+          keep all runs in memory.
+        :param cache_size:
+          Max number of runs fetched from the run DB to keep cached.
+        """
         self.__run_db = db.run_db
+        self.__min_timestamp = min_timestamp
+        self.__max_age = None if max_age is None else float(max_age)
+        self.__cache_size = int(cache_size)
+        # LRU cache of evicted runs fetched from the run DB.
+        self.__cache = OrderedDict()
+        # Keys of `exists_async()` checks that found no evicted runs.  Valid
+        # until more runs are evicted.
+        self.__evicted_misses = set()
 
         # Populate cache from database.  
         self.__runs = { 
@@ -275,16 +514,352 @@ class RunStore:
         log.debug(f"next run_id: {next_run_id}")
         self.__run_ids = ( "r" + str(i) for i in itertools.count(next_run_id) )
 
+        # Secondary indexes, each a mapping from key to a dict of runs by run
+        # ID, and the indexed state of each run.
+        self.__by_job = {}
+        self.__by_state = {}
+        self.__by_rerun = {}
+        self.__states = {}
+        # Mapping from rerun group to its latest run.
+        self.__heads = {}
+        # Runs in timestamp order.  If timestamps ever go backward, we stop
+        # trusting the order.
+        self.__by_time = OrderedDict()
+        self.__max_timestamp = None
+        self.__time_ordered = True
+        for run in sorted(self.__runs.values(), key=lambda r: r.timestamp):
+            self.__index(run)
+
+        # Running runs, by run ID, and counts of running runs by job ID.  For
+        # each job ID, also counts by args and by arg names.  Waiting runs
+        # that are starting count as running.
+        self.__running = set()
+        self.__running_counts = {}
+        # IDs of waiting runs that are starting.
+        self.__starting = set()
+        for run in self.__runs.values():
+            if run.state == Run.STATE.running:
+                self.__count_running(run, 1)
+
         # For live notification.
         self.__queues = set()
 
+        # Metrics.
+        self.__num_evicted = 0
+        self.__num_fetched = 0
+        self.__num_cache_hits = 0
+        self.__num_resyncs = 0
+        self.__num_exists_checks = 0
+
+        self.__evict_time = None
+        self.__evict(now())
+
+
+    def get_stats(self):
+        return {
+            "num_runs"      : len(self.__runs),
+            "num_runs_by_state": {
+                s.name: len(r) for s, r in self.__by_state.items() },
+            "num_evicted"   : self.__num_evicted,
+            "num_cached"    : len(self.__cache),
+            "num_starting"  : len(self.__starting),
+            "num_fetched"   : self.__num_fetched,
+            "num_cache_hits": self.__num_cache_hits,
+            "num_subscribers": len(self.__queues),
+            "num_resyncs"   : self.__num_resyncs,
+            "num_exists_checks": self.__num_exists_checks,
+        }
+
+
+    def __evict(self, time):
+        """
+        Evicts finished runs older than `max_age` from memory.
+        """
+        if self.__max_age is None:
+            return
+        self.__evict_time = time + self.EVICT_INTERVAL
+
+        cutoff = time - self.__max_age
+        old = []
+        for run in self.__by_time.values():
+            if run.timestamp >= cutoff:
+                if self.__time_ordered:
+                    break
+            elif run.state in self.FINISHED and not run.expected:
+                old.append(run)
+
+        for run in old:
+            self.__unindex(run)
+            del self.__runs[run.run_id]
+        self.__num_evicted += len(old)
+        if len(old) > 0:
+            log.info(f"evicted {len(old)} runs")
+            self.__evicted_misses.clear()
+
+
+    def __cache_run(self, run):
+        """
+        Returns the cached run for `run` fetched from the run DB, caching it.
+        """
+        try:
+            run = self.__cache[run.run_id]
+        except KeyError:
+            self.__cache[run.run_id] = run
+            if len(self.__cache) > self.__cache_size:
+                self.__cache.popitem(last=False)
+        else:
+            self.__cache.move_to_end(run.run_id)
+        return run
+
+
+    def __get_by_id(self, run_id):
+        """
+        Returns run `run_id` from memory or the cache, or `None` if none.
+        """
+        try:
+            return self.__runs[run_id]
+        except KeyError:
+            return self.__get_cached(run_id)
+
+
+    def __get_evicted_query(self, run_ids, job_id, state, rerun, since, args,
+                            with_args):
+        """
+        Returns run DB query args for evicted runs that may match a query, or
+        `None` if none should be fetched.
+        """
+        if (
+                run_ids is not None
+            or self.__num_evicted == 0
+            or (state is not None and state.isdisjoint(self.FINISHED))
+        ):
+            return None
+        if job_id is None and rerun is None:
+            # Too broad; don't fetch the whole run DB.
+            return None
+
+        min_timestamp = self.__min_timestamp
+        if since is not None and (
+                min_timestamp is None or since > min_timestamp):
+            min_timestamp = since
+        # Only finished runs are evicted.
+        state = self.FINISHED if state is None else state & self.FINISHED
+        if args is not None or with_args is not None:
+            args = { **(args or {}), **(with_args or {}) }
+        return dict(
+            job_id=job_id, state=state, rerun=rerun, args=args,
+            min_timestamp=min_timestamp)
+
+
+    def __get_evicted(self, runs):
+        """
+        Caches and returns fetched evicted runs.
+        """
+        self.__num_fetched += len(runs)
+        for run in runs:
+            if run.run_id not in self.__runs:
+                yield self.__cache_run(run)
+
+
+    def __get_cached(self, run_id):
+        """
+        Returns evicted run `run_id` from the cache, or `None`.
+        """
+        run = self.__cache.get(run_id)
+        if run is not None:
+            self.__num_cache_hits += 1
+            self.__cache.move_to_end(run_id)
+        return run
+
+
+    def __cache_fetched(self, run):
+        self.__num_fetched += 1
+        if (
+                self.__min_timestamp is not None
+            and run.timestamp < self.__min_timestamp
+        ):
+            raise KeyError(run.run_id)
+        return self.__cache_run(run)
+
+
+    async def __fetch_async(self, run_id):
+        """
+        Returns evicted run `run_id` from the cache, or from the run DB in a
+        reader thread.
+
+        :raise KeyError:
+          No such run.
+        """
+        run = self.__get_cached(run_id)
+        if run is None:
+            run = self.__cache_fetched(
+                await self.__run_db.get_async(run_id))
+        return run
+
+
+    def __index(self, run):
+        """
+        Adds `run` to secondary indexes.
+        """
+        run_id = run.run_id
+        self.__by_job.setdefault(run.inst.job_id, {})[run_id] = run
+        self.__by_state.setdefault(run.state, {})[run_id] = run
+        self.__by_rerun.setdefault(run.rerun, {})[run_id] = run
+        self.__states[run_id] = run.state
+        self.__by_time[run_id] = run
+        self.__index_time(run)
+        self.__update_head(run)
+
+
+    def __update_head(self, run):
+        """
+        Makes `run` its rerun group's head, if it is the latest run.
+        """
+        head = self.__heads.get(run.rerun)
+        if (
+                head is None
+            or head is run
+            or _get_latest_time(run) >= _get_latest_time(head)
+        ):
+            self.__heads[run.rerun] = run
+
+
+    def __index_time(self, run):
+        timestamp = run.timestamp
+        if self.__max_timestamp is None or timestamp >= self.__max_timestamp:
+            self.__max_timestamp = timestamp
+        else:
+            log.warning("run timestamps out of order")
+            self.__time_ordered = False
+
+
+    @staticmethod
+    def __discard(index, key, run_id):
+        runs = index[key]
+        del runs[run_id]
+        if len(runs) == 0:
+            del index[key]
+
+
+    def __unindex(self, run):
+        """
+        Removes `run` from secondary indexes.
+        """
+        run_id = run.run_id
+        self.__discard(self.__by_job, run.inst.job_id, run_id)
+        self.__discard(self.__by_state, self.__states.pop(run_id), run_id)
+        self.__discard(self.__by_rerun, run.rerun, run_id)
+        del self.__by_time[run_id]
+
+        if self.__heads.get(run.rerun) is run:
+            # Choose a new head from the rest of the group.
+            group = self.__by_rerun.get(run.rerun)
+            if group is None:
+                del self.__heads[run.rerun]
+            else:
+                self.__heads[run.rerun] = max(
+                    group.values(), key=_get_latest_time)
+
+
+    def __reindex(self, run):
+        """
+        Updates secondary indexes for a change to `run`'s state and timestamp.
+        """
+        run_id = run.run_id
+        state = self.__states[run_id]
+        if run.state != state:
+            self.__discard(self.__by_state, state, run_id)
+            self.__by_state.setdefault(run.state, {})[run_id] = run
+            self.__states[run_id] = run.state
+        self.__by_time.move_to_end(run_id)
+        self.__index_time(run)
+        self.__update_head(run)
+
+
+    def __count_running(self, run, delta):
+        job_id = run.inst.job_id
+        try:
+            counts = self.__running_counts[job_id]
+        except KeyError:
+            counts = self.__running_counts[job_id] = [0, Counter(), Counter()]
+
+        counts[0] += delta
+        if counts[0] == 0:
+            del self.__running_counts[job_id]
+        else:
+            args = run.inst.args
+            for counter, key in (
+                    (counts[1], frozenset(args.items())),
+                    (counts[2], frozenset(args)),
+            ):
+                counter[key] += delta
+                if counter[key] == 0:
+                    del counter[key]
+
+        if delta > 0:
+            self.__running.add(run.run_id)
+        else:
+            self.__running.discard(run.run_id)
+
+
+    def __recount_running(self, run):
+        if run.state != Run.STATE.waiting:
+            self.__starting.discard(run.run_id)
+        running = (
+               run.state == Run.STATE.running
+            or run.run_id in self.__starting
+        )
+        if running != (run.run_id in self.__running):
+            self.__count_running(run, 1 if running else -1)
+
+
+    def set_starting(self, run, starting=True):
+        """
+        Marks waiting `run` as starting, or not.
+
+        A starting run counts as running, until it leaves the waiting state,
+        so that runs queued to start hold their place toward limits on
+        running runs.
+        """
+        assert self.__runs[run.run_id] is run
+        if starting and run.state == Run.STATE.waiting:
+            self.__starting.add(run.run_id)
+        else:
+            self.__starting.discard(run.run_id)
+        self.__recount_running(run)
+
+
+    def count_running(self, job_id, args=None):
+        """
+        Returns the number of running runs of `job_id`, including waiting runs
+        that are starting.
+
+        :param args:
+          If not none, counts only runs with these args.  Runs may include
+          other args not explicitly given.
+        """
+        try:
+            num, by_args, by_names = self.__running_counts[job_id]
+        except KeyError:
+            return 0
+        if args is None:
+            return num
+
+        items = frozenset(args.items())
+        if len(by_names) == 1 and frozenset(args) in by_names:
+            # All running runs of the job have exactly these arg names.
+            return by_args[items]
+        else:
+            return sum( n for a, n in by_args.items() if items <= a )
+
 
     def __send(self, when, run):
         """
         Sends live notification of changes to `run`.
         """
         for queue in self.__queues:
-            queue.put_nowait((when, [run]))
+            if queue.put(when, (run, )):
+                self.__num_resyncs += 1
 
 
     def add(self, run):
@@ -303,9 +878,50 @@ class RunStore:
 
         log.info(f"new run: {run}")
         self.__runs[run.run_id] = run
+        self.__index(run)
         self.update(run, timestamp)
 
 
+    def add_expected(self, run):
+        """
+        Adds an expected run placeholder.
+        """
+        assert run.run_id is None
+        timestamp = now()
+        run.run_id = next(self.__run_ids)
+        run.timestamp = timestamp
+
+        log.debug(f"new expected run: {run}")
+        self.__runs[run.run_id] = run
+        self.__index(run)
+        self.__send(timestamp, run)
+
+
+    def promote(self, expected):
+        """
+        Replaces an expected run placeholder with a new full run.
+
+        The new run has the same run ID, and is in the new state.  The caller
+        is responsible for transitioning it.
+
+        :return:
+          The new run, or `None` if `expected` is no longer in the store,
+          because it has been removed or already promoted.
+        """
+        if self.__runs.get(expected.run_id) is not expected:
+            return None
+
+        run = Run(expected.inst, expected=True)
+        run.run_id = run.rerun = expected.run_id
+        run.timestamp = now()
+
+        log.info(f"promoted run: {run}")
+        self.__unindex(expected)
+        self.__runs[run.run_id] = run
+        self.__index(run)
+        return run
+
+
     def update(self, run, timestamp):
         """
         Called when `run` is changed.
@@ -317,11 +933,18 @@ class RunStore:
         """
         # Make sure we know about this run.
         assert self.__runs[run.run_id] is run
+        self.__reindex(run)
+
+        # Update running counts.
+        self.__recount_running(run)
 
         # Persist the changes, but not for expected runs.
         if not run.expected:
             self.__run_db.upsert(run)
 
+        if self.__evict_time is not None and timestamp >= self.__evict_time:
+            self.__evict(timestamp)
+
         self.__send(timestamp, run)
 
 
@@ -334,6 +957,7 @@ class RunStore:
         run = self.__runs[run_id]
         assert run.expected, f"can't remove run {run_id}; not expected"
 
+        self.__unindex(run)
         del self.__runs[run_id]
         # Indicate deletion with none state.
         # FIXME: What a horrible hack.
@@ -343,35 +967,225 @@ class RunStore:
 
 
     def get(self, run_id):
-        run = self.__runs[run_id]
+        """
+        Returns run `run_id` from memory, or from evicted runs already cached.
+
+        Doesn't read the run DB; use `get_async()` to fetch an evicted run.
+
+        :raise KeyError:
+          No such run in memory.
+        """
+        try:
+            run = self.__runs[run_id]
+        except KeyError:
+            run = self.__get_cached(run_id)
+            if run is None:
+                raise
+        return now(), run
+
+
+    async def get_async(self, run_id):
+        """
+        Like `get()`, but fetches an evicted run in a reader thread.
+        """
+        try:
+            run = self.__runs[run_id]
+        except KeyError:
+            if self.__num_evicted == 0:
+                raise
+            run = await self.__fetch_async(run_id)
         return now(), run
 
 
+    def __get_since(self, since, limit=None):
+        """
+        Returns runs with timestamp not before `since`, most recent first.
+
+        :param limit:
+          If not none, returns `None` if there are more than this many.
+        """
+        if not self.__time_ordered:
+            runs = [
+                r for r in self.__by_time.values() if r.timestamp >= since ]
+            return None if limit is not None and len(runs) > limit else runs
+
+        runs = []
+        for run in reversed(self.__by_time.values()):
+            if run.timestamp < since:
+                break
+            if limit is not None and len(runs) == limit:
+                return None
+            runs.append(run)
+        return runs
+
+
+    def __get_candidates(self, job_id, states, rerun, since, reruns):
+        """
+        Returns candidate runs for a query, using the most selective index.
+        """
+        runs = self.__runs if reruns else self.__heads
+        if job_id is not None:
+            by_job = self.__by_job.get(job_id, {})
+            if len(by_job) < len(runs):
+                runs = by_job
+        if rerun is not None:
+            by_rerun = self.__by_rerun.get(rerun, {})
+            if len(by_rerun) < len(runs):
+                runs = by_rerun
+        if states is not None:
+            by_state = [ self.__by_state.get(s, {}) for s in states ]
+            if sum( len(r) for r in by_state ) < len(runs):
+                runs = {}
+                for r in by_state:
+                    runs.update(r)
+        runs = runs.values()
+
+        if since is not None:
+            # Scan recent runs, but stop if there are more than candidates.
+            recent = self.__get_since(since, len(runs))
+            if recent is not None:
+                runs = reversed(recent)
+
+        return runs
+
+
     def query(self, *, run_ids=None, job_id=None, state=None, rerun=None, 
               since=None, reruns=True, args=None, with_args=None):
         """
+        Returns runs in memory that match a query.
+
+        Doesn't read the run DB, so omits evicted runs, except any already
+        cached when querying by `run_ids`.  Use `query_async()` to include
+        evicted runs.
+
         :param state:
           Limits results to runs in the specified state(s).
         :param reruns:
           If true, include all reruns; otherwise, includes only the latest run
-          in each rerun group.
+          in each rerun group, if it matches the other filters.
         :param args:
           Limits results to runs with exactly the specified args.
         :param with_args:
           Limits results to runs with the specified args.  Runs may include
           other args not explicitly given.
         """
+        if state is not None:
+            state = set(iterize(state))
+        return self.__query(
+            None, run_ids, job_id, state, rerun, since, reruns, args,
+            with_args)
+
+
+    async def query_async(self, *, run_ids=None, job_id=None, state=None,
+                          rerun=None, since=None, reruns=True, args=None,
+                          with_args=None):
+        """
+        Like `query()`, but fetches evicted runs in a reader thread.
+        """
+        if state is not None:
+            state = set(iterize(state))
+
+        # Fetch evicted runs, if the query is narrow enough.
+        query = self.__get_evicted_query(
+            run_ids, job_id, state, rerun, since, args, with_args)
+        if query is None:
+            evicted = None
+        else:
+            evicted = await self.__run_db.query_async(**query)
+        if run_ids is not None and self.__num_evicted > 0:
+            # Fetch evicted runs by ID into the cache.
+            for run_id in set(run_ids):
+                if run_id not in self.__runs:
+                    with suppress(KeyError):
+                        await self.__fetch_async(run_id)
+
+        return self.__query(
+            evicted, run_ids, job_id, state, rerun, since, reruns, args,
+            with_args)
+
+
+    async def exists_async(self, *, job_id, args, state):
+        """
+        Returns true if a run of `job_id` with exactly `args` is in `state`.
+
+        Checks runs in memory first.  If none match, checks evicted runs in
+        the run DB with a bounded query in a reader thread.
+
+        :param state:
+          A state or states.
+        """
+        state = set(iterize(state))
+        _, runs = self.query(job_id=job_id, args=args, state=state)
+        if len(runs) > 0:
+            return True
+
+        state &= self.FINISHED
+        if self.__num_evicted == 0 or len(state) == 0:
+            return False
+        key = job_id, frozenset(args.items()), frozenset(state)
+        if key in self.__evicted_misses:
+            return False
+
+        self.__num_exists_checks += 1
+        num_evicted = self.__num_evicted
+        exists = await self.__run_db.exists_async(
+            job_id=job_id, args=args, state=state,
+            min_timestamp=self.__min_timestamp)
+        if not exists and self.__num_evicted == num_evicted:
+            # Don't record the miss if runs were evicted meanwhile.
+            self.__evicted_misses.add(key)
+        return exists
+
+
+    def __query(self, evicted, run_ids, job_id, state, rerun, since, reruns,
+                args, with_args):
+        """
+        :param evicted:
+          Evicted runs fetched for the query, or none.
+        """
         if run_ids is None:
-            runs = self.__runs.values()
+            runs = self.__get_candidates(job_id, state, rerun, since, reruns)
         else:
             run_ids = sorted(set(run_ids))
-            runs = ( self.__runs.get(i, None) for i in run_ids )
+            runs = ( self.__get_by_id(i) for i in run_ids )
             runs = ( r for r in runs if r is not None )
+
+        if not reruns:
+            # Only the latest run in each rerun group.
+            runs = ( r for r in runs if self.__heads.get(r.rerun, r) is r )
+
+        if evicted is not None:
+            evicted = self.__get_evicted(evicted)
+            if not reruns:
+                evicted = self.__get_evicted_heads(evicted)
+            runs = itertools.chain(runs, evicted)
+
+        runs = self.__filter(
+            runs, job_id, state, rerun, since, args, with_args)
+        return now(), list(runs)
+
+
+    def __get_evicted_heads(self, runs):
+        """
+        Returns the latest run in each rerun group of evicted `runs`, for
+        groups with no runs in memory.
+        """
+        groups = {}
+        for run in runs:
+            if run.rerun not in self.__heads:
+                groups.setdefault(run.rerun, []).append(run)
+        return ( max(g, key=_get_latest_time) for g in groups.values() )
+
+
+    @staticmethod
+    def __filter(runs, job_id, state, rerun, since, args, with_args):
+        """
+        Applies query filters to `runs`.
+        """
         if job_id is not None:
             runs = ( r for r in runs if r.inst.job_id == job_id )
         if state is not None:
-            states = set(iterize(state))
-            runs = ( r for r in runs if r.state in states )
+            runs = ( r for r in runs if r.state in state )
         if rerun is not None:
             runs = ( r for r in runs if r.rerun == rerun )
         if since is not None:
@@ -386,63 +1200,56 @@ class RunStore:
                         for k, v in with_args.items()
                 )
             )
-
-        if not reruns:
-            # FIXME: Make this more efficient.
-            groups = {}
-            for run in runs:
-                groups.setdefault(run.rerun, []).append(run)
-            runs = ( 
-                max(g, key=lambda r: max(r.times.values(), default=Time.EPOCH))
-                for g in groups.values()
-            )
-
-        return now(), list(runs)
+        return runs
 
 
     @contextmanager
-    def query_live(self, *, since=None):
-        queue = asyncio.Queue()
-        self.__queues.add(queue)
-
-        when, runs = self.query(since=since)
-        queue.put_nowait((when, runs))
+    def subscribe(self, *, max_size=None):
+        """
+        Subscribes to live notification of run changes.
 
+        Yields a `LiveQueue` of changed runs.
+        """
+        queue = LiveQueue(
+            self.LIVE_QUEUE_SIZE if max_size is None else max_size)
+        self.__queues.add(queue)
         try:
             yield queue
         finally:
             self.__queues.remove(queue)
 
 
+    @contextmanager
+    def query_live(self, *, since=None):
+        with self.subscribe() as queue:
+            when, runs = self.query(since=since)
+            queue.put(when, runs, bounded=False)
+            yield queue
+
+
     # FIXME: Remove this.
     def remove_expected(self):
         """
         Discards all expected runs.
         """
-        self.__runs = {
-            run_id: r
-            for run_id, r in self.__runs.items()
-            if not r.expected
-        }
+        for run in [ r for r in self.__runs.values() if r.expected ]:
+            self.__unindex(run)
+            del self.__runs[run.run_id]
 
 
     async def shut_down(self):
         """
         Terminates any live queries.
         """
-        while True:
-            try:
-                queue = next(iter(self.__queues))
-            except StopIteration:
+        log.info(f"shutting down {len(self.__queues)} live query queues")
+        for queue in self.__queues:
+            queue.close()
+        # Give subscribers a chance to clean up.
+        for _ in range(50):
+            if len(self.__queues) == 0:
                 break
-
-            log.info("shutting down live query queue")
-            # Indicate that this queue is shutting down.
-            queue.put_nowait(None)
-            # FIXME: Join doesn't seem to work.
-            # await queue.join()
-            await asyncio.sleep(0.5)
-            log.info("live query queue shut down")
+            await asyncio.sleep(0.01)
+        log.info("live query queues shut down")
 
 
 
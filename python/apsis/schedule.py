@@ -1,7 +1,10 @@
 import bisect
+import itertools
 import logging
+import math
 import ora
-from   ora import Daytime, Time, TimeZone
+from   ora import Date, Daytime, Sun, Time, TimeZone
+import weakref
 
 from   .lib.exc import SchemaError
 from   .lib.json import TypedJso, check_schema
@@ -19,15 +22,232 @@ class Schedule(TypedJso):
         self.enabled = bool(enabled)
 
 
+    def times_between(self, start: Time, stop: Time):
+        """
+        Returns scheduled times not before `start` and before `stop`.
+
+        Subclasses may override this to compute the times in a batch, rather
+        than by generating them one at a time.
+
+        :return:
+          A list of `time, args` pairs.
+        """
+        return list(itertools.takewhile(lambda t: t[0] < stop, self(start)))
+
+
     def __call__(self, start: Time):
         raise NotImplementedError
 
 
 
+# Calendars whose dates are determined by their names, by name.
+_NAMED_CALENDARS = {}
+
+def _get_calendar(name):
+    """
+    Returns the calendar `name`.
+
+    Calendars aren't singletons, and shared tables are keyed by calendar
+    identity.  So that schedules can share tables, we reuse calendars whose
+    dates are determined by their names: "all", "none", and weekday
+    expressions.  Other calendars, such as from calendar files, are loaded
+    each time.
+    """
+    try:
+        return _NAMED_CALENDARS[name]
+    except KeyError:
+        pass
+    calendar = ora.get_calendar(name)
+    if name in ("all", "none"):
+        named = True
+    else:
+        try:
+            ora.parse_weekdays(name)
+        except ValueError:
+            named = False
+        else:
+            named = True
+    if named:
+        _NAMED_CALENDARS[name] = calendar
+    return calendar
+
+
+class _CalendarDates:
+    """
+    Dates of a calendar, precomputed for a window of dates.
+
+    The window is extended as needed, in blocks of several years.
+    """
+
+    # Number of days by which to extend the window.
+    DAYS = 4 * 366
+
+    def __init__(self, calendar):
+        self.calendar   = calendar
+        self.__lo       = None
+        self.__hi       = None
+        self.__dates    = []
+
+
+    def __extend(self, lo, hi):
+        cal_lo, cal_hi = self.calendar.range
+        if self.__lo is None or lo < self.__lo:
+            # Rebuild, starting at the new low end.
+            hi = max(hi, self.__hi or hi)
+            dates = []
+        else:
+            # Extend the high end.
+            lo = self.__hi
+            dates = self.__dates
+        hi = max(hi, lo + self.DAYS if cal_hi - lo > self.DAYS else cal_hi)
+        log.debug(f"extending calendar dates: {self.calendar} {lo} to {hi}")
+
+        try:
+            date = self.calendar.after(max(lo, cal_lo))
+            while date < hi:
+                dates.append(date)
+                date = self.calendar.after(date + 1)
+        except ora.CalendarRangeError:
+            # No more dates in the calendar.
+            pass
+
+        if self.__lo is None or lo < self.__lo:
+            self.__lo = lo
+        self.__hi = hi
+        self.__dates = dates
+
+
+    def __call__(self, lo: Date, hi: Date):
+        """
+        Returns calendar dates not before `lo` and before `hi`.
+        """
+        if self.__lo is None or lo < self.__lo or self.__hi < hi:
+            self.__extend(lo, hi)
+        dates = self.__dates
+        i = bisect.bisect_left(dates, lo)
+        j = bisect.bisect_left(dates, hi, i)
+        return dates[i : j]
+
+
+
+class _DailyTable:
+    """
+    Scheduled times of a daily schedule, precomputed for a rolling window of
+    dates.
+
+    A table is shared by all daily schedules with the same time zone,
+    calendar, daytimes, and date shift.  The window is extended forward as
+    needed, and dates before the requested range are dropped when it is.
+    """
+
+    # Number of days by which to extend the window.  This should be longer
+    # than the scheduler horizon.
+    DAYS = 14
+
+    def __init__(self, tz, calendar, daytimes, date_shift):
+        self.tz         = tz
+        self.calendar   = calendar
+        self.daytimes   = daytimes
+        self.date_shift = date_shift
+
+        self.__cal_dates = _get_calendar_dates(calendar)
+        # The window of nominal dates, before the date shift.
+        self.__lo       = None
+        self.__hi       = None
+        # Sorted scheduled times, and corresponding nominal dates as strings.
+        self.__times    = []
+        self.__dates    = []
+
+
+    def __extend(self, lo, hi):
+        if self.__lo is None or lo < self.__lo or self.__hi < lo:
+            # Rebuild.
+            start = lo
+            times = []
+            dates = []
+        else:
+            # Drop dates before `lo`, and extend from the high end.
+            start = self.__hi
+            i = bisect.bisect_left(self.__dates, str(lo))
+            times = self.__times[i :]
+            dates = self.__dates[i :]
+        hi = max(hi, start + self.DAYS)
+
+        tz = self.tz
+        shift = self.date_shift
+        daytimes = self.daytimes
+        for date in self.__cal_dates(start, hi):
+            sched_date = date + shift
+            date_str = str(date)
+            for daytime in daytimes:
+                times.append((sched_date, daytime) @ tz)
+                dates.append(date_str)
+
+        self.__lo       = lo
+        self.__hi       = hi
+        self.__times    = times
+        self.__dates    = dates
+
+
+    def __call__(self, start: Time, stop: Time):
+        """
+        Returns scheduled times not before `start` and before `stop`.
+
+        :return:
+          Sequences of times and corresponding nominal dates, as strings.
+        """
+        lo = (start @ self.tz).date - self.date_shift
+        hi = (stop @ self.tz).date - self.date_shift + 1
+        if self.__lo is None or lo < self.__lo or self.__hi < hi:
+            self.__extend(lo, hi)
+
+        times = self.__times
+        i = bisect.bisect_left(times, start)
+        j = bisect.bisect_left(times, stop, i)
+        return times[i : j], self.__dates[i : j]
+
+
+    def is_done(self, time: Time):
+        """
+        True if the calendar has no dates for times at or after `time`.
+        """
+        date = (time @ self.tz).date - self.date_shift
+        return self.calendar.range[1] <= date
+
+
+
+# Process-wide tables, shared among schedules.  A table is dropped when no
+# schedule uses it.
+_CALENDAR_DATES = weakref.WeakValueDictionary()
+_DAILY_TABLES = weakref.WeakValueDictionary()
+
+def _get_calendar_dates(calendar):
+    # Calendars are keyed by identity.  The table refers to the calendar, so
+    # the calendar lives as long as the entry.
+    try:
+        return _CALENDAR_DATES[calendar]
+    except KeyError:
+        dates = _CALENDAR_DATES[calendar] = _CalendarDates(calendar)
+        return dates
+
+
+def _get_daily_table(tz, calendar, daytimes, date_shift):
+    key = (str(tz), calendar, daytimes, date_shift)
+    try:
+        return _DAILY_TABLES[key]
+    except KeyError:
+        table = _DAILY_TABLES[key] = _DailyTable(
+            tz, calendar, daytimes, date_shift)
+        return table
+
+
 class DailySchedule(Schedule):
 
     TYPE_NAME = "daily"
 
+    # Times are generated from the daily table in chunks of this many seconds.
+    CHUNK = 7 * 86400
+
     def __init__(
             self, tz, calendar, daytimes, args, *, enabled=True, date_shift=0):
         super().__init__(enabled=enabled)
@@ -36,6 +256,8 @@ class DailySchedule(Schedule):
         self.daytimes   = tuple(sorted( Daytime(t) for t in daytimes ))
         self.args       = { str(k): str(v) for k, v in args.items() }
         self.date_shift = int(date_shift)
+        self.__table    = _get_daily_table(
+            self.tz, self.calendar, self.daytimes, self.date_shift)
 
 
     def __str__(self):
@@ -49,48 +271,40 @@ class DailySchedule(Schedule):
         return res
 
 
+    def __common_args(self):
+        return {
+            "calendar": str(self.calendar),
+            "tz": str(self.tz),
+            **self.args,
+        }
+
+
     def __call__(self, start: Time):
         """
         Generates scheduled times starting not before `start`.
         """
         start = Time(start)
+        common_args = self.__common_args()
+        while not self.__table.is_done(start):
+            stop = start + self.CHUNK
+            times, dates = self.__table(start, stop)
+            for time, date in zip(times, dates):
+                yield time, {"date": date, "time": time, **common_args}
+            start = stop
 
-        start_date, start_daytime = start @ self.tz
-        start_date -= self.date_shift
 
-        if start_date in self.calendar:
-            date = start_date
-            # Find the next daytime.
-            for i, daytime in enumerate(self.daytimes):
-                if start_daytime <= daytime:
-                    break
-            else:
-                # All daytimes have passed for this date.
-                date = self.calendar.after(date + 1)
-                i = 0
-        else:
-            # Start at the beginning of the next date.
-            date = self.calendar.after(start_date)
-            i = 0
+    def times_between(self, start: Time, stop: Time):
+        start = Time(start)
+        stop = Time(stop)
+        if not start < stop:
+            return []
 
-        # Now generate.
-        common_args = {
-            "calendar": str(self.calendar),
-            "tz": str(self.tz),
-            **self.args,
-        }
-        while True:
-            sched_date = date + self.date_shift
-            time = (sched_date, self.daytimes[i]) @ self.tz
-            assert time >= start
-            args = {"date": str(date), "time": time, **common_args}
-            yield time, args
-
-            i += 1
-            if i == len(self.daytimes):
-                # On to the next day.
-                date = self.calendar.after(date + 1)
-                i = 0
+        times, dates = self.__table(start, stop)
+        common_args = self.__common_args()
+        return [
+            (time, {"date": date, "time": time, **common_args})
+            for time, date in zip(times, dates)
+        ]
 
 
     def to_jso(self):
@@ -111,7 +325,7 @@ class DailySchedule(Schedule):
             enabled     = pop("enabled", bool, default=True)
             args        = pop("args", default={})
             tz          = pop("tz", TimeZone)
-            calendar    = ora.get_calendar(pop("calendar", default="all"))
+            calendar    = _get_calendar(pop("calendar", default="all"))
             daytimes    = pop("daytime")
             daytimes    = [daytimes] if isinstance(daytimes, (str, int)) else daytimes
             daytimes    = [ Daytime(d) for d in daytimes ]
@@ -149,6 +363,12 @@ class ExplicitSchedule(Schedule):
         )
 
 
+    def times_between(self, start: Time, stop: Time):
+        i = bisect.bisect_left(self.times, start)
+        j = bisect.bisect_left(self.times, stop)
+        return [ (t, {"time": t, **self.args}) for t in self.times[i : j] ]
+
+
     def to_jso(self):
         return {
             **super().to_jso(),
@@ -195,20 +415,40 @@ class IntervalSchedule(Schedule):
         return res
 
 
-    def __call__(self, start: Time):
+    def __first(self, start: Time):
+        """
+        Returns the first scheduled time not before `start`.
+        """
         # Round to the next interval.
         start -= self.phase
         off = start - Time.EPOCH
-        time = (
+        return (
             start if off % self.interval == 0
             else Time.EPOCH + (off // self.interval + 1) * self.interval
         ) + self.phase
 
+
+    def __call__(self, start: Time):
+        time = self.__first(start)
         while True:
             yield time, {"time": str(time), **self.args}
             time += self.interval
 
 
+    def times_between(self, start: Time, stop: Time):
+        time = self.__first(start)
+        interval = self.interval
+        args = self.args
+        # Number of intervals before stop.
+        num = max(0, math.ceil((stop - time) / interval))
+        times = []
+        append = times.append
+        for _ in range(num):
+            append((time, {"time": str(time), **args}))
+            time += interval
+        return times
+
+
     def to_jso(self):
         return {
             **super().to_jso(),
@@ -233,6 +473,272 @@ class IntervalSchedule(Schedule):
 
 #-------------------------------------------------------------------------------
 
+MONTH_NAMES = {
+    "jan":  1, "feb":  2, "mar":  3, "apr":  4, "may":  5, "jun":  6,
+    "jul":  7, "aug":  8, "sep":  9, "oct": 10, "nov": 11, "dec": 12,
+}
+
+WEEKDAY_NAMES = {
+    "sun": 0, "mon": 1, "tue": 2, "wed": 3, "thu": 4, "fri": 5, "sat": 6,
+}
+
+def _parse(string, min, max, names={}):
+    for part in string.split(","):
+        try:
+            part, step = part.split("/", 1)
+        except ValueError:
+            step    = 1
+        else:
+            step    = int(step)
+        if part == "*":
+            start   = min
+            end     = max
+        else:
+            try:
+                start, end = part.split("-", 1)
+            except ValueError:
+                start   = int(names.get(part.lower(), part))
+                end     = start
+            else:
+                start   = int(names.get(start.lower(), start))
+                end     = int(names.get(end.lower(), end))
+        yield start, end + 1, step
+
+
+def _values(string, min, max, names={}):
+    """
+    Returns the sorted values between `min` and `max` matched by a crontab
+    field `string`.
+
+    :raise ValueError:
+      The field is invalid, or contains values out of range.
+    """
+    values = set()
+    for start, stop, step in _parse(string, min, max, names):
+        if not min <= start < stop <= max + 1:
+            raise ValueError(
+                f"crontab field not in range {min}-{max}: {string}")
+        if step < 1:
+            raise ValueError(f"crontab field step not positive: {string}")
+        values.update(range(start, stop, step))
+    return tuple(sorted(values))
+
+
+class Fields:
+    """
+    The five time and date fields of a crontab line.
+    """
+
+    def __init__(self, minute="*", hour="*", day="*", month="*", weekday="*"):
+        self.minute     = minute
+        self.hour       = hour
+        self.day        = day
+        self.month      = month
+        self.weekday    = weekday
+
+        self.minutes    = _values(minute, 0, 59)
+        self.hours      = _values(hour  , 0, 23)
+        self.days       = _values(day   , 1, 31)
+        self.months     = _values(month , 1, 12, MONTH_NAMES)
+        # Both 0 and 7 are Sunday.
+        self.weekdays   = tuple(sorted({
+            w % 7 for w in _values(weekday, 0, 7, WEEKDAY_NAMES) }))
+
+        # As in cron, if both the day and weekday fields are restricted, a
+        # date matching either matches.
+        self.__day_any      = day.startswith("*")
+        self.__weekday_any  = weekday.startswith("*")
+
+
+    @classmethod
+    def from_str(cls, string):
+        fields = string.split()
+        if len(fields) != 5:
+            raise ValueError(f"not five crontab fields: {string}")
+        return cls(*fields)
+
+
+    def __repr__(self):
+        return format_ctor(
+            self, self.minute, self.hour, self.day, self.month, self.weekday)
+
+
+    def __str__(self):
+        return " ".join(
+            (self.minute, self.hour, self.day, self.month, self.weekday))
+
+
+    def __match_day(self, day, weekday):
+        day_match = day in self.days
+        weekday_match = (weekday - Sun + 7) % 7 in self.weekdays
+        return (
+            weekday_match if self.__day_any
+            else day_match if self.__weekday_any
+            else day_match or weekday_match
+        )
+
+
+    def match(self, minute, hour, day, month, weekday):
+        """
+        :param weekday:
+          An ora weekday, e.g. `ora.Mon`.
+        """
+        return (
+                minute in self.minutes
+            and hour in self.hours
+            and month in self.months
+            and self.__match_day(day, weekday)
+        )
+
+
+    def match_date(self, date):
+        return (
+                date.month in self.months
+            and self.__match_day(date.day, date.weekday)
+        )
+
+
+    # Give up looking for a matching date after this many years.
+    MAX_YEARS = 400
+
+    def dates(self, date, end=None):
+        """
+        Generates dates matching the day, month, and weekday fields, starting
+        at `date`.
+
+        :param end:
+          Date before which to stop, or `None` to stop after `MAX_YEARS`.
+        """
+        months = self.months
+        max_end = Date(min(date.year + self.MAX_YEARS, Date.MAX.year), 1, 1)
+        end = max_end if end is None else min(end, max_end)
+        while date < end:
+            if date.month not in months:
+                # Skip to the first day of the next matching month.
+                i = bisect.bisect_right(months, date.month)
+                date = (
+                    Date(date.year, months[i], 1) if i < len(months)
+                    else Date(date.year + 1, months[0], 1)
+                )
+            else:
+                if self.match_date(date):
+                    yield date
+                date += 1
+
+
+
+def _from_local(date, daytime, tz):
+    """
+    Returns the time corresponding to a local time in `tz`.
+
+    :return:
+      The time, or the first of two if it's ambiguous because of a DST
+      transition, or `None` if it doesn't exist.
+    """
+    try:
+        return ora.from_local((date, daytime), tz, first=True)
+    except RuntimeError:
+        # Nonexistent local time.
+        return None
+
+
+class CrontabSchedule(Schedule):
+    """
+    A schedule specified with crontab fields, in a time zone.
+
+    Times are local times in `tz`.  A local time skipped by a DST transition
+    never occurs; an ambiguous local time occurs once, at its first
+    occurrence, as in cron.
+    """
+
+    def __init__(self, tz, fields, args={}, *, enabled=True):
+        """
+        :param fields:
+          A `Fields`, or the five crontab fields as a string.
+        """
+        super().__init__(enabled=enabled)
+        self.tz     = TimeZone(tz)
+        self.fields = (
+            fields if isinstance(fields, Fields) else Fields.from_str(fields))
+        self.args   = { str(k): str(v) for k, v in args.items() }
+
+
+    def __repr__(self):
+        return format_ctor(self, self.tz, self.fields, self.args)
+
+
+    def __str__(self):
+        res = f"crontab {self.fields} {self.tz}"
+        if len(self.args) > 0:
+            args = ", ".join( f"{k}={v}" for k, v in self.args.items() )
+            res = "(" + args + ") " + res
+        return res
+
+
+    def __times(self, start, end=None):
+        """
+        Generates scheduled times not before `start`, on local dates before
+        `end`.
+        """
+        # Rather than stepping through each minute, we find matching dates,
+        # then the matching hours and minutes on each.
+        tz = self.tz
+        fields = self.fields
+        daytimes = [ Daytime(h, m, 0) for h in fields.hours for m in fields.minutes ]
+        common_args = {"tz": str(tz), **self.args}
+
+        for date in fields.dates((start @ tz).date, end):
+            times = sorted(
+                t
+                for t in ( _from_local(date, y, tz) for y in daytimes )
+                if t is not None and t >= start
+            )
+            for time in times:
+                yield time, {"date": str(date), "time": time, **common_args}
+
+
+    def __call__(self, start: Time):
+        """
+        Generates scheduled times starting not before `start`.
+        """
+        return self.__times(Time(start))
+
+
+    def times_between(self, start: Time, stop: Time):
+        start = Time(start)
+        stop = Time(stop)
+        if not start < stop:
+            return []
+        # Only walk dates up to the stop date, so that a schedule that rarely
+        # or never matches doesn't search years ahead.
+        end = (stop @ self.tz).date + 1
+        return [ t for t in self.__times(start, end) if t[0] < stop ]
+
+
+    def to_jso(self):
+        return {
+            **super().to_jso(),
+            "enabled"   : self.enabled,
+            "tz"        : str(self.tz),
+            "fields"    : str(self.fields),
+            "args"      : self.args,
+        }
+
+
+    @classmethod
+    def from_jso(cls, jso):
+        with check_schema(jso) as pop:
+            enabled     = pop("enabled", bool, default=True)
+            tz          = pop("tz", TimeZone)
+            fields      = pop("fields", Fields.from_str)
+            args        = pop("args", default={})
+        return cls(tz, fields, args, enabled=enabled)
+
+
+
+#-------------------------------------------------------------------------------
+
+Schedule.TYPE_NAMES.set(CrontabSchedule, "crontab")
 Schedule.TYPE_NAMES.set(DailySchedule, "daily")
 Schedule.TYPE_NAMES.set(ExplicitSchedule, "explicit")
 Schedule.TYPE_NAMES.set(IntervalSchedule, "interval")
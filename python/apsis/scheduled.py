@@ -1,49 +1,20 @@
 import asyncio
 import heapq
 import logging
+import math
 from   ora import now, Time
 
+from   .lib.stats import Histogram
 from   .runs import Run
 
 log = logging.getLogger(__name__)
 
 #-------------------------------------------------------------------------------
 
-async def sleep_until(time):
+class HeapQueue:
     """
-    Sleep until `time`, or do our best at least.
+    Queue of scheduled runs, as a heap ordered by schedule time.
     """
-    delay = time - now()
-
-    # FIXME: These thresholds are rather ad hoc.
-
-    if delay <= 0:
-        # Nothing to do.
-        if delay < 0.1:
-            log.debug(f"sleep to past time: {time}")
-
-    else:
-        await asyncio.sleep(delay)
-        late = now() - time
-        if late < -0.005:
-            log.error(f"woke up early: {-late:.3f} s")
-        elif late > 0.1:
-            log.error(f"woke up late: {late:.1f} s")
-
-
-class ScheduledRuns:
-    """
-    Scheduled runs waiting to start.
-    """
-
-    # We maintain an explicit run schedule, rather than using the event loop, to
-    # guarantee that we are scheduling to the real time clock, rather than the
-    # event loop's clock.
-
-    # Max delay time.  Generally, a run is started very close to its scheduled
-    # time, but in some cases the run may be delayed as much as this time.
-
-    LOOP_TIME = 1
 
     # Entry is the data structure stored in __heap.  It represents a scheduled
     # run.  We also maintain __scheduled, a map from Run to Entry, to find an
@@ -53,9 +24,22 @@ class ScheduledRuns:
     # unschedule a job by setting scheduled=False.  It stays in the heap, but
     # we ignore it when it comes to to top.  However, __scheduled only includes
     # entries for which scheduled==True.
+    #
+    # Unscheduled entries ("tombstones") would otherwise accumulate, for
+    # example when jobs are reloaded and their runs rescheduled repeatedly.  We
+    # count them, and rebuild the heap without them when they make up more
+    # than COMPACT_FRACTION of it.  We also drop the tombstone's reference to
+    # its run, so that the run may be freed.
+
+    COMPACT_FRACTION = 0.5
+
+    # Don't bother compacting a heap with fewer tombstones than this.
+    COMPACT_MIN = 64
 
     class Entry:
 
+        __slots__ = ("time", "run", "scheduled")
+
         def __init__(self, time, run):
             self.time = time
             self.run = run
@@ -72,26 +56,408 @@ class ScheduledRuns:
 
 
 
-    def __init__(self, clock_db, start_run):
+    def __init__(self, loop_time):
+        # Heap of Entry, ordered by schedule time.  The top entry is the next
+        # scheduled run.
+        self.__heap         = []
+
+        # Mapping from Run to Entry.  Values satisfy entry.scheduled==True.
+        self.__scheduled    = {}
+
+        # Number of entries in the heap with scheduled==False.
+        self.__num_dead     = 0
+        # Number of times the heap has been compacted.
+        self.__num_compact  = 0
+
+
+    def __len__(self):
+        return len(self.__scheduled)
+
+
+    def get_stats(self):
+        return {
+            "num_scheduled" : len(self.__scheduled),
+            "num_dead"      : self.__num_dead,
+            "num_compact"   : self.__num_compact,
+            "heap_size"     : len(self.__heap),
+        }
+
+
+    def __compact(self):
+        """
+        Rebuilds the heap without unscheduled entries.
+        """
+        log.debug(
+            f"compacting: {len(self.__heap)} entries, "
+            f"{self.__num_dead} unscheduled"
+        )
+        self.__heap = [ e for e in self.__heap if e.scheduled ]
+        heapq.heapify(self.__heap)
+        self.__num_dead = 0
+        self.__num_compact += 1
+
+
+    def push(self, time: Time, run: Run):
+        entry = self.Entry(time, run)
+        heapq.heappush(self.__heap, entry)
+        self.__scheduled[run] = entry
+
+
+    def remove(self, run: Run) -> bool:
+        try:
+            # Remove it from the scheduled dict.
+            entry = self.__scheduled.pop(run)
+        except KeyError:
+            # Wasn't scheduled.
+            return False
+        else:
+            # Mark it as unscheduled, so the start loop will ignore it.  Note
+            # that we don't remove it from the heap; there's no constant-time
+            # way to do this.
+            assert entry.scheduled
+            entry.scheduled = False
+            entry.run = None
+            self.__num_dead += 1
+            if (
+                    self.__num_dead >= self.COMPACT_MIN
+                and self.__num_dead > len(self.__heap) * self.COMPACT_FRACTION
+            ):
+                self.__compact()
+            return True
+
+
+    def pop(self, time: Time):
+        """
+        Removes runs scheduled at or before `time`.
+
+        :return:
+          A list of schedule time, run pairs.
+        """
+        ready = []
+        heap = self.__heap
+        while len(heap) > 0 and heap[0].time <= time:
+            # The next run is ready.
+            entry = heapq.heappop(heap)
+            if entry.scheduled:
+                # Take it out of the entries dict.
+                assert self.__scheduled.pop(entry.run) is entry
+                ready.append((entry.time, entry.run))
+            else:
+                self.__num_dead -= 1
+        return ready
+
+
+    def wake_time(self, stop: Time):
+        """
+        Returns the time by which to pop the next runs, if before `stop`.
+
+        :return:
+          The next schedule time, or `None` if there is none before `stop`.
+        """
+        heap = self.__heap
+        # Skip over tombstones.
+        while len(heap) > 0 and not heap[0].scheduled:
+            heapq.heappop(heap)
+            self.__num_dead -= 1
+        if len(heap) > 0 and heap[0].time < stop:
+            return heap[0].time
+        else:
+            return None
+
+
+
+class WheelQueue:
+    """
+    Queue of scheduled runs, as a hierarchical timing wheel.
+
+    Time is divided into ticks of `loop_time`.  Runs are placed into buckets
+    by tick for the current minute, by minute for the current hour, by hour
+    for the current day, and by day beyond that.  As the current tick
+    advances into a new minute, hour, or day, that bucket's runs are moved
+    down into finer buckets.
+
+    Inserting and removing a run are constant time.
+    """
+
+    # Each bucket is a dict from run to schedule time, so that a run can be
+    # removed from it directly.  Buckets are stored in dicts keyed by absolute
+    # tick, minute, hour, or day number, rather than in circular arrays, so
+    # there is no wraparound to handle.
+
+    def __init__(self, loop_time):
+        self.__loop_time    = float(loop_time)
+        # Ticks per minute, hour, day.
+        self.__minute       = max(1, round(60 / self.__loop_time))
+        self.__hour         = self.__minute * 60
+        self.__day          = self.__hour * 24
+
+        # The current tick; runs in earlier ticks have been popped.
+        self.__cur          = self.__tick(now())
+
+        self.__ticks        = {}
+        self.__minutes      = {}
+        self.__hours        = {}
+        self.__days         = {}
+
+        # Mapping from Run to the bucket containing it.
+        self.__buckets      = {}
+
+        self.__num_cascade  = 0
+
+
+    def __tick(self, time):
+        return math.floor((time - Time.EPOCH) / self.__loop_time)
+
+
+    def __len__(self):
+        return len(self.__buckets)
+
+
+    def get_stats(self):
+        return {
+            "num_scheduled" : len(self.__buckets),
+            "num_buckets"   : (
+                  len(self.__ticks) + len(self.__minutes)
+                + len(self.__hours) + len(self.__days)
+            ),
+            "num_cascade"   : self.__num_cascade,
+        }
+
+
+    def __insert(self, time, run):
+        cur = self.__cur
+        tick = max(self.__tick(time), cur)
+        minute, hour, day = self.__minute, self.__hour, self.__day
+        if tick // minute == cur // minute:
+            buckets, key = self.__ticks, tick
+        elif tick // hour == cur // hour:
+            buckets, key = self.__minutes, tick // minute
+        elif tick // day == cur // day:
+            buckets, key = self.__hours, tick // hour
+        else:
+            buckets, key = self.__days, tick // day
+        try:
+            bucket = buckets[key]
+        except KeyError:
+            bucket = buckets[key] = {}
+        bucket[run] = time
+        self.__buckets[run] = bucket
+
+
+    def __cascade(self, buckets, key):
+        """
+        Moves runs in bucket `key` of `buckets` into finer buckets.
+        """
+        bucket = buckets.pop(key, None)
+        if bucket is not None:
+            self.__num_cascade += 1
+            for run, time in bucket.items():
+                self.__insert(time, run)
+
+
+    def push(self, time: Time, run: Run):
+        self.__insert(time, run)
+
+
+    def remove(self, run: Run) -> bool:
+        try:
+            bucket = self.__buckets.pop(run)
+        except KeyError:
+            return False
+        else:
+            del bucket[run]
+            return True
+
+
+    def __advance(self, tick):
+        """
+        Advances the current tick to `tick`, cascading as we go.
+        """
+        minute, hour, day = self.__minute, self.__hour, self.__day
+        cur = self.__cur
+        while cur < tick:
+            if len(self.__ticks.get(cur, ())) > 0:
+                # Runs in a tick before `tick` should have been popped.
+                break
+            self.__ticks.pop(cur, None)
+            if (
+                    len(self.__ticks) == 0 and len(self.__minutes) == 0
+                and len(self.__hours) == 0
+            ):
+                # Nothing in this day; skip to the next day.
+                cur = min(tick, (cur // day + 1) * day)
+            elif len(self.__ticks) == 0 and len(self.__minutes) == 0:
+                # Nothing in this hour; skip to the next hour.
+                cur = min(tick, (cur // hour + 1) * hour)
+            elif len(self.__ticks) == 0:
+                # Nothing in this minute; skip to the next minute.
+                cur = min(tick, (cur // minute + 1) * minute)
+            else:
+                cur += 1
+            self.__cur = cur
+            if cur % minute == 0:
+                if cur % hour == 0:
+                    if cur % day == 0:
+                        self.__cascade(self.__days, cur // day)
+                    self.__cascade(self.__hours, cur // hour)
+                self.__cascade(self.__minutes, cur // minute)
+        self.__cur = cur
+
+
+    def pop(self, time: Time):
+        """
+        Removes runs scheduled at or before `time`.
+
+        :return:
+          A list of schedule time, run pairs.
+        """
+        ready = []
+        end = self.__tick(time)
+        while True:
+            cur = self.__cur
+            bucket = self.__ticks.get(cur)
+            if bucket is not None:
+                if cur < end:
+                    # The whole tick is ready.
+                    runs = list(bucket.items())
+                else:
+                    # The current tick; some runs may not be ready.
+                    runs = [ (r, t) for r, t in bucket.items() if t <= time ]
+                for run, run_time in runs:
+                    del bucket[run]
+                    del self.__buckets[run]
+                    ready.append((run_time, run))
+                if len(bucket) == 0:
+                    del self.__ticks[cur]
+            if cur >= end:
+                break
+            self.__advance(end)
+        return ready
+
+
+    def wake_time(self, stop: Time):
+        """
+        Returns the time by which to pop the next runs, if before `stop`.
+
+        :return:
+          The next schedule time, if in the current minute.  Otherwise, the
+          start of the next minute, when runs are cascaded into ticks, if
+          any runs remain.  `None` if this is not before `stop`.
+        """
+        minute = self.__minute
+        cur = self.__cur
+        end = (cur // minute + 1) * minute
+        times = (
+            t
+            for k in range(cur, min(self.__tick(stop) + 1, end))
+            for t in self.__ticks.get(k, {}).values()
+        )
+        time = min(times, default=None)
+        if time is None and (
+               len(self.__minutes) > 0
+            or len(self.__hours) > 0
+            or len(self.__days) > 0
+        ):
+            # Runs in later minutes; wake up to cascade them.  Buckets may be
+            # empty, if runs were removed, but this costs just one wakeup.
+            time = Time.EPOCH + end * self.__loop_time
+        return time if time is not None and time < stop else None
+
+
+
+QUEUES = {
+    "heap"  : HeapQueue,
+    "wheel" : WheelQueue,
+}
+
+#-------------------------------------------------------------------------------
+
+class ScheduledRuns:
+    """
+    Scheduled runs waiting to start.
+    """
+
+    # We maintain an explicit run schedule, rather than using the event loop, to
+    # guarantee that we are scheduling to the real time clock, rather than the
+    # event loop's clock.
+    #
+    # The start loop arms a single event loop timer for the next schedule
+    # time.  The timer is rearmed if a run is scheduled before it.  Since the
+    # event loop's clock may drift from the real time clock, if the timer
+    # fires early, the loop rearms it for the remaining time.
+
+    # Tick size for the timing wheel queue.
+    LOOP_TIME = 1
+
+    # We don't write the clock time on every loop iteration.  When runs start,
+    # the clock is written in the same transaction as their state changes, so
+    # that on restart they are not scheduled again.  Otherwise, the clock is
+    # written at most this often, and on shut down.  After a crash, runs
+    # scheduled after the last written clock time, that never started, may be
+    # scheduled again.
+
+    CLOCK_INTERVAL = 60
+
+    # Ready runs are started in batches of at most this many, yielding to
+    # other tasks in between, so that many runs scheduled at once don't
+    # transition, write, and notify all in one burst.
+
+    START_BATCH = 256
+
+    def __init__(self, clock_db, start_run, *, queue="heap",
+                 clock_interval=CLOCK_INTERVAL):
         """
         :param clock_db:
           Persistence for most recent scheduled time.
         :param start_run:
           Async function that starts a run.
+        :param queue:
+          Name of the queue implementation: "heap" or "wheel".
+        :param clock_interval:
+          Max interval in seconds between clock writes.
         """
         self.__clock_db     = clock_db
         self.__start_run    = start_run
+        self.__clock_interval = float(clock_interval)
+        # When we last wrote the clock.
+        self.__clock_time   = now()
 
-        # Heap of Entry, ordered by schedule time.  The top entry is the next
-        # scheduled run.
-        self.__heap         = []
+        try:
+            queue_type = QUEUES[queue]
+        except KeyError:
+            raise ValueError(f"unknown scheduled queue: {queue}") from None
+        self.__queue_name   = queue
+        self.__queue        = queue_type(self.LOOP_TIME)
 
-        # Mapping from Run to Entry.  Values satisfy entry.scheduled==True.
-        self.__scheduled    = {}
+        # The time to which the start loop is sleeping, and a future to wake
+        # it early.
+        self.__wake_time    = None
+        self.__waker        = None
+
+        # Metrics.
+        # How late runs start, relative to schedule time.
+        self.__late         = Histogram()
+        self.__num_wakeups  = 0
+        self.__num_rearm    = 0
+        self.__num_early    = 0
 
 
     def __len__(self):
-        return len(self.__heap)
+        """
+        Returns the number of scheduled runs.
+        """
+        return len(self.__queue)
+
+
+    def get_stats(self):
+        return {
+            "queue"         : self.__queue_name,
+            **self.__queue.get_stats(),
+            "late"          : self.__late.to_jso(),
+            "num_wakeups"   : self.__num_wakeups,
+            "num_rearm"     : self.__num_rearm,
+            "num_early"     : self.__num_early,
+        }
 
 
     def get_scheduled_time(self):
@@ -101,50 +467,101 @@ class ScheduledRuns:
         return self.__clock_db.get_time()
 
 
+    async def __sleep_until(self, time):
+        """
+        Sleeps until `time` by the real time clock, or until woken because a
+        run was scheduled before it.
+        """
+        loop = asyncio.get_event_loop()
+
+        def wake(waker, rearm):
+            if not waker.done():
+                waker.set_result(rearm)
+
+        self.__wake_time = time
+        try:
+            while True:
+                delay = time - now()
+                if delay <= 0:
+                    break
+                self.__waker = waker = loop.create_future()
+                handle = loop.call_later(delay, wake, waker, False)
+                try:
+                    rearm = await waker
+                finally:
+                    handle.cancel()
+                if rearm:
+                    break
+                if now() < time:
+                    # The event loop clock is ahead of the real time clock.
+                    self.__num_early += 1
+
+        finally:
+            self.__wake_time = None
+            self.__waker = None
+
+
     async def loop(self):
-        # The start loop sleeps until the time to start the next scheduled job,
-        # or for LOOP_TIME, whichever comes first.  LOOP_TIME comes in to play
-        # when the event loop clock wanders from the real time clock, or if a
-        # run is scheduled in the very near future after the start loop has
-        # already gone to sleep.
+        # The start loop sleeps until the time to start the next scheduled
+        # run, or to write the clock.
+        queue = self.__queue
         try:
-            log_next_time = None
+            log_count = None
 
             while True:
                 time = now()
 
                 if log.isEnabledFor(logging.DEBUG):
-                    count = len(self.__heap)
-                    next_time = None if count == 0 else self.__heap[0].time
-                    if next_time != log_next_time:
-                        next_run = "none" if count == 0 else self.__heap[0].run.run_id
-                        log.debug(f"loop: {count} scheduled runs; next {next_run} at {next_time}")
-                        log_next_time = next_time
-
-                ready = set()
-                while len(self.__heap) > 0 and self.__heap[0].time <= time:
-                    # The next run is ready.
-                    entry = heapq.heappop(self.__heap)
-                    if entry.scheduled:
-                        # Take it out of the entries dict.
-                        assert self.__scheduled.pop(entry.run) is entry
-                        ready.add(entry.run)
-                self.__clock_db.set_time(time)
+                    count = len(queue)
+                    if count != log_count:
+                        log.debug(f"loop: {count} scheduled runs")
+                        log_count = count
+
+                ready = queue.pop(time)
 
                 if len(ready) > 0:
                     log.debug(f"{len(ready)} runs ready")
-                    # Start the runs.
-                    # FIXME: Return exceptions?
-                    await asyncio.gather(*( self.__start_run(r) for r in ready ))
-
-                next_time = time + self.LOOP_TIME
-                if len(self.__heap) > 0:
-                    next_time = min(next_time, self.__heap[0].time)
-
-                await sleep_until(next_time)
+                    ready.sort(key=lambda r: r[0])
+                    for sched_time, _ in ready:
+                        self.__late.add(max(0, time - sched_time))
+                    # Start the runs in batches.  The first run state write
+                    # of each batch also writes the clock.  Until the last
+                    # batch, the clock is only advanced to the next run not
+                    # yet started, so that after a crash, that run and later
+                    # ones are scheduled again.
+                    for i in range(0, len(ready), self.START_BATCH):
+                        batch = ready[i : i + self.START_BATCH]
+                        j = i + self.START_BATCH
+                        self.__clock_db.set_time(
+                            time if j >= len(ready) else ready[j][0])
+                        # FIXME: Return exceptions?
+                        await asyncio.gather(
+                            *( self.__start_run(r) for _, r in batch ))
+                        if j < len(ready):
+                            # Let other tasks run.
+                            await asyncio.sleep(0)
+                else:
+                    self.__clock_db.set_time(time)
+
+                if self.__clock_db.dirty and (
+                       len(ready) > 0
+                    or time - self.__clock_time >= self.__clock_interval
+                ):
+                    self.__clock_db.flush()
+                if not self.__clock_db.dirty:
+                    self.__clock_time = time
+
+                next_time = time + self.__clock_interval
+                queue_time = queue.wake_time(next_time)
+                if queue_time is not None:
+                    next_time = queue_time
+
+                await self.__sleep_until(next_time)
+                self.__num_wakeups += 1
 
         except asyncio.CancelledError:
-            # Let this through.
+            # Write the clock, and let this through.
+            self.__clock_db.flush()
             raise
 
         except Exception:
@@ -157,11 +574,17 @@ class ScheduledRuns:
         """
         Schedules `run` to start at `time`.
         """
-        # Put it onto the schedule heap.
         log.debug(f"schedule: {time} {run.run_id}")
-        entry = self.Entry(time, run)
-        heapq.heappush(self.__heap, entry)
-        self.__scheduled[run] = entry
+        self.__queue.push(time, run)
+
+        if (
+                self.__waker is not None
+            and time < self.__wake_time
+            and not self.__waker.done()
+        ):
+            # Wake the start loop, to rearm its timer.
+            self.__num_rearm += 1
+            self.__waker.set_result(True)
 
 
     async def schedule(self, time: Time, run: Run):
@@ -188,19 +611,7 @@ class ScheduledRuns:
           started yet, and hasn't already been unscheduled.
         """
         log.info(f"unschedule: {run}")
-        try:
-            # Remove it from the scheduled dict.
-            entry = self.__scheduled.pop(run)
-        except KeyError:
-            # Wasn't scheduled.
-            return False
-        else:
-            # Mark it as unscheduled, so the start loop will ignore it.  Note
-            # that we don't remove it from the heap; there's no constant-time
-            # way to do this.
-            assert entry.scheduled
-            entry.scheduled = False
-            return True
- 
+        return self.__queue.remove(run)
+
 
 
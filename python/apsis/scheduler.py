@@ -1,9 +1,10 @@
 import asyncio
-import itertools
+from   contextlib import suppress
+import heapq
 import logging
 from   ora import Time, now
 
-from   .runs import Instance, Run
+from   .runs import ExpectedRun, Instance
 
 log = logging.getLogger(__name__)
 
@@ -14,12 +15,15 @@ def get_runs_to_schedule(job, start, stop):
     Builds runs to schedule for `job` between `start` and `stop`.
 
     :return:
-      Iterable of (time, run).
+      Iterable of (time, run), where each run is an `ExpectedRun`.
     """
+    labels = job.meta.get("labels", ())
     for schedule in job.schedules:
-        times = itertools.takewhile(lambda t: t[0] < stop, schedule(start))
+        if not schedule.enabled:
+            # Runs instantiated from a disabled schedule are never scheduled.
+            continue
 
-        for sched_time, args in times:
+        for sched_time, args in schedule.times_between(start, stop):
             args = {**args, "schedule_time": sched_time}
             args = { 
                 a: str(v) 
@@ -30,10 +34,26 @@ def get_runs_to_schedule(job, start, stop):
             # FIXME: Store additional args for later expansion.
             inst = Instance(job.job_id, args)
 
-            if schedule.enabled:
-                # Runs instantiated by the scheduler are only expected; the job
-                # schedule may change before the run is started.
-                yield sched_time, Run(inst, expected=True)
+            # Runs instantiated by the scheduler are only expected; the job
+            # schedule may change before the run is started.
+            yield sched_time, ExpectedRun(inst, sched_time, labels=labels)
+
+
+def get_next_time(job, start):
+    """
+    Returns the earliest schedule time of `job` not before `start`.
+
+    :return:
+      The next schedule time, or `None` if the job has no further runs to
+      schedule.
+    """
+    times = []
+    for schedule in job.schedules:
+        if schedule.enabled:
+            with suppress(StopIteration):
+                time, _ = next(iter(schedule(start)))
+                times.append(time)
+    return min(times, default=None)
 
 
 class Scheduler:
@@ -41,21 +61,37 @@ class Scheduler:
     Agent that creates and schedules new runs according to job schedules, up
     to a future time (the "scheduler time").
 
+    Runs up to the scheduler time are created as lightweight expected runs.
+    These are promoted to full scheduled runs shortly before their schedule
+    times (the "promote time").
+
     Does not own any runs.
     """
 
+    # We keep a heap of the next schedule time of each job, so that advancing
+    # the scheduler time only touches jobs that actually have runs in the new
+    # interval, rather than walking all jobs.
+
     HORIZON = 86400
 
-    def __init__(self, cfg, jobs, schedule, stop):
+    # Expected runs are promoted to full runs this long before their schedule
+    # times.  Must be longer than the scheduler loop's sleep.
+    PROMOTE_HORIZON = 300
+
+    def __init__(self, cfg, jobs, expect, schedule, stop):
         """
         :param jobs:
           Jobs object.
+        :param expect:
+          Function of `run` that adds an expected run.
         :param schedule:
-          Function of `time, run` that schedules a run.
+          Function of `time, run` that promotes an expected run and schedules
+          it.
         """
         self.__cfg = cfg
         self.__jobs = jobs
         self.__stop = stop
+        self.__expect = expect
         self.__schedule = schedule
 
         since = self.__cfg.get("schedule_since")
@@ -64,12 +100,51 @@ class Scheduler:
             if since > self.__stop:
                 self.__stop = since
 
+        # Heap of (time, job ID) for the next schedule time of each job, not
+        # before the scheduler time.  Jobs without further schedule times are
+        # not included.
+        self.__heap = []
+        self.__build_heap()
+
+        # Heap of expected runs that have not yet been promoted, by schedule
+        # time.  May contain runs that have since been removed.
+        self.__expected = []
+        # The time up to which expected runs have been promoted.
+        self.__promote_stop = self.__stop
+
+
+    def __push(self, job, start):
+        """
+        Adds `job` to the heap at its next schedule time not before `start`.
+        """
+        time = get_next_time(job, start)
+        if time is not None:
+            heapq.heappush(self.__heap, (time, job.job_id))
+
+
+    def __build_heap(self):
+        """
+        Rebuilds the heap from all jobs.
+        """
+        self.__heap = []
+        for job in self.__jobs.get_jobs(scheduled=True):
+            self.__push(job, self.__stop)
+        log.debug(f"{len(self.__heap)} jobs with runs to schedule")
+
 
     def set_jobs(self, jobs):
         """
         Replaces the jobs object.
         """
         self.__jobs = jobs
+        self.__build_heap()
+
+
+    def add_job(self, job):
+        """
+        Adds a new job, for example an ad hoc job, to schedule.
+        """
+        self.__push(job, self.__stop)
 
 
     def get_scheduler_time(self):
@@ -88,13 +163,49 @@ class Scheduler:
             return
 
         log.debug(f"scheduling runs until {stop}")
-        for job in self.__jobs.get_jobs():
-            for time, run in get_runs_to_schedule(job, self.__stop, stop):
-                await self.__schedule(time, run)
+        heap = self.__heap
+        while len(heap) > 0 and heap[0][0] < stop:
+            start, job_id = heapq.heappop(heap)
+            try:
+                job = self.__jobs.get_job(job_id)
+            except LookupError:
+                # The job has been removed.
+                log.debug(f"not scheduling removed job: {job_id}")
+                continue
+
+            # No runs of this job between the scheduler time and `start`.
+            for time, run in get_runs_to_schedule(job, start, stop):
+                await self.expect(time, run)
+            self.__push(job, stop)
 
         self.__stop = stop
 
 
+    async def expect(self, time, run):
+        """
+        Adds expected run `run` at `time`.
+
+        If `time` is before the promote time, promotes the run immediately.
+        """
+        self.__expect(run)
+        if time < self.__promote_stop:
+            await self.__schedule(time, run)
+        else:
+            heapq.heappush(self.__expected, run)
+
+
+    async def promote(self, stop):
+        """
+        Advances the promote time to `stop` by promoting expected runs.
+        """
+        heap = self.__expected
+        while len(heap) > 0 and heap[0].time < stop:
+            run = heapq.heappop(heap)
+            await self.__schedule(run.time, run)
+
+        self.__promote_stop = max(self.__promote_stop, stop)
+
+
     async def loop(self):
         """
         Infinite loop that periodically schedules runs.
@@ -116,6 +227,7 @@ class Scheduler:
                         )
 
                 await self.schedule(time + self.HORIZON)
+                await self.promote(time + self.PROMOTE_HORIZON)
                 await asyncio.sleep(60)
 
         except asyncio.CancelledError:
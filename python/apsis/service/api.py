@@ -9,6 +9,7 @@ import websockets
 
 from   apsis.apsis import reschedule_runs
 from   apsis.lib.api import response_json, error, time_to_jso, to_bool
+import apsis.lib.compress
 import apsis.lib.itr
 from   apsis.lib.timing import Timer
 from   ..jobs import jso_to_job, reruns_to_jso
@@ -207,15 +208,15 @@ def match(choices, target):
         raise AmbiguousJobError("ambiguous job id: " + choices)
 
 
-def match_job_id(jobs, job_id):
+async def match_job_id(jobs, job_id):
     """
     Matches `job_id` as an exact or fuzzy match.
     """
     logging.info(f"match_job_id {job_id}")
 
-    # Try for an exact match first.a
+    # Try for an exact match first.
     try:
-        jobs.get_job(job_id)
+        await jobs.get_job_async(job_id)
     except LookupError:
         pass
     else:
@@ -230,17 +231,17 @@ def match_job_id(jobs, job_id):
 async def job(request, job_id):
     jobs = request.app.apsis.jobs
     try:
-        job_id = match_job_id(jobs, unquote(job_id))
+        job_id = await match_job_id(jobs, unquote(job_id))
     except LookupError:
         return error(f"no job_id {job_id}", status=404)
-    job = jobs.get_job(job_id)
+    job = await jobs.get_job_async(job_id)
     return response_json(job_to_jso(request.app, job))
 
 
 @API.route("/jobs/<job_id:path>/runs")
 async def job_runs(request, job_id):
-    job_id = match_job_id(request.app.apsis.jobs, unquote(job_id))
-    when, runs = request.app.apsis.run_store.query(job_id=job_id)
+    job_id = await match_job_id(request.app.apsis.jobs, unquote(job_id))
+    when, runs = await request.app.apsis.run_store.query_async(job_id=job_id)
     jso = runs_to_jso(request.app, when, runs)
     return response_json(jso)
 
@@ -262,11 +263,16 @@ async def jobs(request):
 
 @API.route("/runs/<run_id>", methods={"GET"})
 async def run(request, run_id):
+    apsis = request.app.apsis
     try:
-        when, run = request.app.apsis.run_store.get(run_id)
+        when, run = await apsis.run_store.get_async(run_id)
     except KeyError:
         return error(f"unknown run {run_id}", 404)
-            
+
+    # Show the full run, with its program and conditions, but don't promote
+    # an expected run; this is a read.
+    run = apsis.preview(run)
+
     jso = runs_to_jso(request.app, when, [run])
     return response_json(jso)
 
@@ -290,10 +296,22 @@ async def run_history(request, run_id):
     })
 
 
+@API.route("/runs/<run_id>/blocking", methods={"GET"})
+async def run_blocking(request, run_id):
+    apsis = request.app.apsis
+    try:
+        when, run = await apsis.run_store.get_async(run_id)
+    except KeyError:
+        return error(f"unknown run {run_id}", 404)
+
+    runs = apsis.get_blocked_by(run)
+    return response_json(runs_to_jso(request.app, when, runs, summary=True))
+
+
 @API.route("/runs/<run_id>/output", methods={"GET"})
 async def run_output_meta(request, run_id):
     try:
-        outputs = request.app.apsis.outputs.get_metadata(run_id)
+        outputs = await request.app.apsis.outputs.get_metadata_async(run_id)
     except KeyError:
         return error(f"unknown run {run_id}", 404)
 
@@ -304,23 +322,39 @@ async def run_output_meta(request, run_id):
 @API.route("/runs/<run_id>/output/<output_id>", methods={"GET"})
 async def run_output(request, run_id, output_id):
     try:
-        data = request.app.apsis.outputs.get_data(run_id, output_id)
+        compression, data = \
+            await request.app.apsis.outputs.get_compressed_async(
+                run_id, output_id)
     except LookupError as exc:
         return error(exc, 404)
-    else:
+
+    if compression is None and isinstance(data, bytes):
         return sanic.response.raw(data)
 
+    # Decompress and send a chunk at a time, rather than decompressing the
+    # whole output in memory.  Data from the blob store is a memory map, so
+    # it is paged in only as it is sent.
+    try:
+        response = await request.respond(
+            content_type="application/octet-stream")
+        for chunk in apsis.lib.compress.decompress_chunks(compression, data):
+            await response.send(chunk)
+        await response.eof()
+    finally:
+        if not isinstance(data, bytes):
+            data.close()
+
 
 @API.route("/runs/<run_id>/state", methods={"GET"})
 async def run_state_get(request, run_id):
-    _, run = request.app.apsis.run_store.get(run_id)
+    _, run = await request.app.apsis.run_store.get_async(run_id)
     return response_json({"state": run.state})
 
 
 @API.route("/runs/<run_id>/cancel", methods={"POST"})
 async def run_cancel(request, run_id):
     state = request.app.apsis
-    _, run = state.run_store.get(run_id)
+    _, run = await state.run_store.get_async(run_id)
     if run.state == run.STATE.scheduled:
         await state.cancel(run)
         return response_json({})
@@ -331,7 +365,7 @@ async def run_cancel(request, run_id):
 @API.route("/runs/<run_id>/start", methods={"POST"})
 async def run_start(request, run_id):
     state = request.app.apsis
-    _, run = state.run_store.get(run_id)
+    _, run = await state.run_store.get_async(run_id)
     if run.state == run.STATE.scheduled:
         await state.start(run)
         return response_json({})
@@ -342,7 +376,7 @@ async def run_start(request, run_id):
 @API.route("/runs/<run_id>/rerun", methods={"POST"})
 async def run_rerun(request, run_id):
     state = request.app.apsis
-    _, run = state.run_store.get(run_id)
+    _, run = await state.run_store.get_async(run_id)
     if run.state not in {run.STATE.failure, run.STATE.error, run.STATE.success}:
         return error("invalid run state for rerun", 409, state=run.state)
     else:
@@ -357,7 +391,7 @@ async def run_rerun(request, run_id):
 @API.route("/runs/<run_id>/signal/<signal>", methods={"PUT", "POST"})
 async def run_signal(request, run_id, signal):
     apsis = request.app.apsis
-    _, run = apsis.run_store.get(run_id)
+    _, run = await apsis.run_store.get_async(run_id)
 
     if run.state not in {run.STATE.running}:
         return error("invalid run state for signal", 409, state=run.state.name)
@@ -403,12 +437,12 @@ async def runs(request):
     run_ids     = args.pop("run_id", None)
     job_id,     = args.pop("job_id", (None, ))
     if job_id is not None:
-        job_id  = match_job_id(apsis.jobs, job_id)
+        job_id  = await match_job_id(apsis.jobs, job_id)
     state,      = args.pop("state", (None, ))
     since,      = args.pop("since", (None, ))
     reruns,     = args.pop("reruns", ("False", ))
 
-    when, runs = apsis.run_store.query(
+    when, runs = await apsis.run_store.query_async(
         run_ids =run_ids, 
         job_id  =job_id,
         state   =to_state(state),
@@ -423,47 +457,74 @@ async def runs(request):
 async def websocket_runs(request, ws):
     since, = request.args.pop("since", (None, ))
 
+    run_store = request.app.apsis.run_store
     log.info("live runs connect")
-    with request.app.apsis.run_store.query_live(since=since) as queue:
-        while True:
-            # FIXME: If the socket closes, clean up instead of blocking until
-            # the next run is available.  Not sure how to do this.  ws.ping()
-            # with a timeout doesn't appear to work.
-            next_runs = [await queue.get()]
-            # Drain the queue.
+    with run_store.query_live(since=since) as queue:
+        # Receive from the socket concurrently, to notice when it closes.
+        recv = asyncio.ensure_future(ws.recv())
+        try:
             while True:
+                get = asyncio.ensure_future(queue.get())
+                try:
+                    await asyncio.wait(
+                        (get, recv), return_when=asyncio.FIRST_COMPLETED)
+                finally:
+                    get.cancel()
+
+                if recv.done():
+                    if recv.cancelled() or recv.exception() is not None:
+                        # The socket closed.
+                        break
+                    # Ignore messages from the client.
+                    recv = asyncio.ensure_future(ws.recv())
+                if not get.done() or get.cancelled():
+                    continue
+
+                msg = get.result()
+                if msg is None:
+                    # Signalled to shut down.
+                    await ws.close()
+                    break
+                elif msg is queue.RESYNC:
+                    # We fell behind and changes were dropped; send everything
+                    # again.  The client discards runs it doesn't receive
+                    # again, including runs removed while we were behind.
+                    log.info(f"live runs resync: {request.socket}")
+                    reset = True
+                    when, runs = await run_store.query_async(since=since)
+                else:
+                    reset = False
+                    when, runs = msg
+                runs = _filter_runs(runs, request.args)
+
+                # Break large sets into chunks, to avoid block for too long.
+                chunks = list(apsis.lib.itr.chunks(runs, WS_RUN_CHUNK))
+                if len(chunks) == 0:
+                    if not reset:
+                        continue
+                    # Send the reset anyway.
+                    chunks = [[]]
+
                 try:
-                    next_runs.append(queue.get_nowait())
-                except asyncio.QueueEmpty:
+                    for i, chunk in enumerate(chunks):
+                        with Timer() as timer:
+                            jso = runs_to_jso(
+                                request.app, when, chunk, summary=True)
+                            if reset and i == 0:
+                                # Replace all runs with this and the
+                                # following chunks.
+                                jso["reset"] = True
+                            # FIXME: JSOs are cached but ujson.dumps() still
+                            # takes real time.
+                            json = ujson.dumps(jso)
+                        log.debug(f"sending {len(chunk)} runs, {len(json)} bytes {timer.elapsed:.3f} s: {request.socket}")
+                        await ws.send(json)
+                        await asyncio.sleep(WS_RUN_CHUNK_SLEEP)
+                except websockets.ConnectionClosed:
                     break
 
-            if any( r is None for r in next_runs ):
-                # Signalled to shut down.
-                await ws.close()
-                break
-
-            when = next_runs[-1][0]
-            assert all( w <= when for w, _ in next_runs )
-            runs = apsis.lib.itr.chain.from_iterable( r for _, r in next_runs )
-            runs = _filter_runs(runs, request.args)
-
-            # Break large sets into chunks, to avoid block for too long.
-            chunks = list(apsis.lib.itr.chunks(runs, WS_RUN_CHUNK))
-            if len(chunks) == 0:
-                continue
-
-            try:
-                for chunk in chunks:
-                    with Timer() as timer:
-                        jso = runs_to_jso(request.app, when, chunk, summary=True)
-                        # FIXME: JSOs are cached but ujson.dumps() still takes real
-                        # time.
-                        json = ujson.dumps(jso)
-                    log.debug(f"sending {len(chunk)} runs, {len(json)} bytes {timer.elapsed:.3f} s: {request.socket}")
-                    await ws.send(json)
-                    await asyncio.sleep(WS_RUN_CHUNK_SLEEP)
-            except websockets.ConnectionClosed:
-                break
+        finally:
+            recv.cancel()
 
     log.info("live runs disconnect")
 
@@ -478,12 +539,13 @@ async def run_post(request):
         # A complete job.
         job = jso_to_job(jso["job"], None)
         job.ad_hoc = True
-        request.app.apsis.jobs.add(job)
+        apsis.jobs.add(job)
+        apsis.scheduler.add_job(job)
         job_id = job.job_id
 
     elif "job_id" in jso:
         # Just a job ID.
-        job_id = match_job_id(apsis.jobs, jso["job_id"])
+        job_id = await match_job_id(apsis.jobs, jso["job_id"])
 
     else:
         return error("missing job_id or job")
@@ -61,6 +61,11 @@ async def on_shut_down(request):
     return response_json({})
 
 
+@API.route("/stats")
+async def on_stats(request):
+    return response_json(request.app.apsis.get_stats())
+
+
 @API.route("/version")
 async def on_version(request):
     return response_json({"version": apsis.__version__})
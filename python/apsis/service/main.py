@@ -15,7 +15,7 @@ from   . import DEFAULT_PORT
 from   ..apsis import Apsis
 from   ..jobs import load_jobs_dir, JobErrors
 from   ..lib.asyn import cancel_task
-from   ..sqlite import SqliteDB
+from   ..sqlite import SqliteDB, OutputDB
 
 log = logging.getLogger(__name__)
 
@@ -110,7 +110,16 @@ def serve(cfg, host="127.0.0.1", port=DEFAULT_PORT, debug=False):
 
     db_path = cfg["database"]
     log.info(f"opening state file {db_path}")
-    db      = SqliteDB.open(db_path)
+    compression = cfg.get("output_compression", OutputDB.COMPRESSION)
+    db      = SqliteDB.open(
+        db_path,
+        output_compression=None if compression == "none" else compression,
+        output_compress_min_size=cfg.get(
+            "output_compress_min_size", OutputDB.COMPRESS_MIN_SIZE),
+        output_dir=cfg.get("output_dir"),
+        output_external_min_size=cfg.get(
+            "output_external_min_size", OutputDB.EXTERNAL_MIN_SIZE),
+    )
 
     job_dir = cfg["job_dir"]
     log.info(f"opening jobs dir {job_dir}")
@@ -170,6 +179,10 @@ def serve(cfg, host="127.0.0.1", port=DEFAULT_PORT, debug=False):
                 # Shut down Apsis and all its bits.
                 await apsis.shut_down()
 
+                # Commit pending writes.
+                log.info("closing state file")
+                db.close()
+
             finally:
                 # Then tell the asyncio event loop to stop.
                 log.info("stopping event loop")
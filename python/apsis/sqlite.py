@@ -2,14 +2,25 @@
 Persistent state stored in a sqlite file.
 """
 
+import asyncio
+from   collections import OrderedDict
+from   concurrent.futures import ThreadPoolExecutor
+import functools
+import itertools
 import logging
 import ora
 from   pathlib import Path
 import sqlalchemy as sa
+import sqlite3
+import sys
+import threading
+import time
 import ujson
 
-from   .jobs import jso_to_job, job_to_jso
-from   .lib import itr
+from   .jobs import jso_to_job, job_to_jso, is_scheduled
+from   .lib import compress, itr
+from   .lib.blob import BlobStore
+from   .lib.py import iterize
 from   .runs import Instance, Run
 from   .program import Program, Output, OutputMetadata
 
@@ -35,8 +46,306 @@ def _get_max_run_id_num(engine, table):
     return 0 if max_num is None else max_num
 
 
+def _add_columns(engine, table, *names):
+    """
+    Adds columns `names` of `table` to the database, if missing.
+
+    `METADATA.create_all()` creates missing tables, but doesn't add columns
+    to existing ones.
+
+    :return:
+      True if any columns were added.
+    """
+    with engine.begin() as conn:
+        rows = conn.execute(f"PRAGMA table_info({table.name})")
+        have = { r[1] for r in rows }
+        added = False
+        for name in names:
+            if name not in have:
+                col = table.c[name]
+                log.info(f"adding column: {table.name}.{name}")
+                type = col.type.compile(dialect=engine.dialect)
+                conn.execute(f"ALTER TABLE {table.name} ADD COLUMN {name} {type}")
+                added = True
+    return added
+
+
+def _create_indexes(engine, table):
+    """
+    Creates indexes of `table` in the database, if missing.
+
+    `METADATA.create_all()` doesn't add indexes to existing tables.
+    """
+    with engine.begin() as conn:
+        for index in table.indexes:
+            cols = ", ".join( c.name for c in index.columns )
+            conn.execute(
+                f"CREATE INDEX IF NOT EXISTS {index.name} "
+                f"ON {table.name} ({cols})"
+            )
+
+
+def _get_indexes(engine, table):
+    """
+    Returns the names of indexes of `table` in the database.
+    """
+    return { r[1] for r in engine.execute(f"PRAGMA index_list({table.name})") }
+
+
 METADATA = sa.MetaData()
 
+#-------------------------------------------------------------------------------
+
+class Writer:
+    """
+    Writes to the database in batched transactions from a dedicated thread.
+
+    A write is an `(key, sql, params)` op.  Ops are queued and executed in
+    order by a writer thread, which commits all ops pending when it wakes in
+    one transaction, so many writes share one fsync.  A pending op is replaced
+    by a later op with the same key, unless the key is none.
+
+    Since ops are executed in order and each batch is one transaction, the
+    database always contains a prefix of the ops written.  Ops passed to one
+    `write()` call are always committed together.  Use `flush()` to wait
+    until ops are committed, for example before reading.
+
+    The params of an op may instead be a function, which the writer thread
+    calls, before the transaction, to obtain the params.  Use this to move
+    slow work, such as file I/O, out of the caller.
+
+    For a memory database, which can't be shared with another thread, ops are
+    executed and committed inline instead.
+    """
+
+    def __init__(self, path, connection):
+        """
+        :param path:
+          Path to the database file, or none for a memory database.
+        :param connection:
+          DB-API connection for inline writes, if `path` is none.
+        """
+        self.__connection = connection
+
+        # Pending ops, by key.
+        self.__pending = OrderedDict()
+        self.__keys = itertools.count()
+        # Sequence numbers of the last write, and of the last committed write.
+        self.__seq = 0
+        self.__done = 0
+        self.__closed = False
+        # Exception raised by the writer thread.
+        self.__error = None
+        self.__cond = threading.Condition()
+
+        # Metrics.
+        self.__num_writes = 0
+        self.__num_coalesced = 0
+        self.__num_batches = 0
+        self.__max_batch = 0
+        self.__commit_time = 0
+
+        if path is None:
+            self.__thread = None
+        else:
+            self.__thread = threading.Thread(
+                target=self.__run, args=(str(path), ),
+                name="sqlite writer", daemon=True)
+            self.__thread.start()
+
+
+    def get_stats(self):
+        with self.__cond:
+            return {
+                "write_behind"  : self.__thread is not None,
+                "num_pending"   : len(self.__pending),
+                "num_writes"    : self.__num_writes,
+                "num_coalesced" : self.__num_coalesced,
+                "num_batches"   : self.__num_batches,
+                "max_batch"     : self.__max_batch,
+                "commit_time"   : self.__commit_time,
+            }
+
+
+    def __check(self):
+        if self.__error is not None:
+            raise RuntimeError("DB writer failed") from self.__error
+        if self.__closed:
+            raise RuntimeError("DB writer closed")
+
+
+    def write(self, *ops):
+        """
+        Queues `ops` for writing, in one transaction.
+        """
+        ops = [ o for o in ops if o is not None ]
+        self.__num_writes += len(ops)
+
+        if self.__thread is None:
+            # Write inline.
+            for _, sql, params in ops:
+                if callable(params):
+                    params = params()
+                self.__connection.execute(sql, params)
+            self.__connection.commit()
+            self.__num_batches += 1
+            return
+
+        with self.__cond:
+            self.__check()
+            pending = self.__pending
+            for key, sql, params in ops:
+                if key is None:
+                    key = next(self.__keys)
+                elif key in pending:
+                    self.__num_coalesced += 1
+                # Replace in place, to keep the earlier position.
+                pending[key] = sql, params
+            self.__seq += 1
+            self.__cond.notify_all()
+
+
+    def flush(self):
+        """
+        Waits until all ops written so far are committed.
+        """
+        if self.__thread is None:
+            return
+        with self.__cond:
+            seq = self.__seq
+            while self.__done < seq:
+                if self.__error is not None:
+                    self.__check()
+                self.__cond.wait()
+
+
+    def close(self):
+        """
+        Commits pending ops and stops the writer thread.
+        """
+        if self.__thread is None or self.__closed:
+            return
+        self.flush()
+        with self.__cond:
+            self.__closed = True
+            self.__cond.notify_all()
+        self.__thread.join()
+
+
+    def __run(self, path):
+        conn = sqlite3.connect(path, isolation_level=None)
+        # In WAL mode, readers don't block the writer, nor it them.
+        conn.execute("PRAGMA journal_mode=WAL")
+
+        while True:
+            with self.__cond:
+                while len(self.__pending) == 0 and not self.__closed:
+                    self.__cond.wait()
+                if len(self.__pending) == 0:
+                    break
+                batch = self.__pending
+                self.__pending = OrderedDict()
+                seq = self.__seq
+
+            start = time.perf_counter()
+            try:
+                # Prepare deferred params before the transaction.
+                batch = [
+                    (sql, params() if callable(params) else params)
+                    for sql, params in batch.values()
+                ]
+                conn.execute("BEGIN")
+                for sql, params in batch:
+                    conn.execute(sql, params)
+                conn.execute("COMMIT")
+            except Exception as exc:
+                log.critical("DB writer failed", exc_info=True)
+                with self.__cond:
+                    self.__error = exc
+                    self.__cond.notify_all()
+                break
+            elapsed = time.perf_counter() - start
+
+            with self.__cond:
+                self.__done = seq
+                self.__num_batches += 1
+                self.__max_batch = max(self.__max_batch, len(batch))
+                self.__commit_time += elapsed
+                self.__cond.notify_all()
+
+        conn.close()
+
+
+
+class Reader:
+    """
+    Runs DB reads in a small pool of threads, so that they don't block the
+    event loop.  Each thread keeps its own connection.
+
+    Before each read, the reader thread waits for the writer to commit writes
+    so far, so the read sees them.  Sync reads don't wait, and see only
+    committed writes.
+
+    For a memory database, which can't be shared with another thread, reads
+    are run inline instead.
+    """
+
+    def __init__(self, num_threads, writer):
+        """
+        :param num_threads:
+          Number of reader threads, or none to read inline.
+        :param writer:
+          The writer to flush before reading.
+        """
+        self.__writer = writer
+        self.__executor = (
+            None if num_threads is None
+            else ThreadPoolExecutor(
+                num_threads, thread_name_prefix="sqlite reader")
+        )
+
+        # Metrics.
+        self.__num_reads = 0
+        self.__read_time = 0
+
+
+    def get_stats(self):
+        return {
+            "num_reads"     : self.__num_reads,
+            "read_time"     : self.__read_time,
+        }
+
+
+    def __call(self, fn, args, kw_args):
+        start = time.perf_counter()
+        try:
+            self.__writer.flush()
+            return fn(*args, **kw_args)
+        finally:
+            self.__num_reads += 1
+            self.__read_time += time.perf_counter() - start
+
+
+    async def read(self, fn, *args, **kw_args):
+        """
+        Calls `fn(*args, **kw_args)` in a reader thread, and returns its
+        result.
+        """
+        if self.__executor is None:
+            return self.__call(fn, args, kw_args)
+        else:
+            return await asyncio.get_event_loop().run_in_executor(
+                self.__executor,
+                functools.partial(self.__call, fn, args, kw_args)
+            )
+
+
+    def close(self):
+        if self.__executor is not None:
+            self.__executor.shutdown()
+
+
+
 #-------------------------------------------------------------------------------
 
 TBL_CLOCK = sa.Table(
@@ -48,32 +357,67 @@ TBL_CLOCK = sa.Table(
 class ClockDB:
     """
     Stores the most recent application time.
+
+    The time is kept in memory.  Setting it doesn't write it; it is written
+    along with the next run write, in the same transaction, or by `flush()`.
     """
 
-    # We use a DB-API connection and SQL statements because it's faster than
-    # the SQLAlchemy ORM.
+    # We use SQL statements because it's faster than the SQLAlchemy ORM.
 
-    def __init__(self, engine):
-        self.__connection = engine.connect().connection
+    def __init__(self, engine, writer):
+        """
+        :param writer:
+          Writer, shared with `RunDB`.
+        """
+        self.__writer = writer
 
-        (length, ), = self.__connection.execute("SELECT COUNT(*) FROM clock")
-        if length == 0:
+        rows = list(engine.execute("SELECT time FROM clock"))
+        if len(rows) == 0:
             time = ora.now() - ora.UNIX_EPOCH
-            self.__connection.execute("INSERT INTO clock VALUES (?)", (time, ))
-            self.__connection.commit()
+            writer.write((None, "INSERT INTO clock VALUES (?)", (time, )))
+            writer.flush()
         else:
-            assert length == 1
+            (time, ), = rows
+
+        # The current time, and whether it has been set since it was written.
+        self.__time = time
+        self.__dirty = False
 
 
     def get_time(self):
-        (time, ), = self.__connection.execute("SELECT time FROM clock")
-        return time + ora.UNIX_EPOCH
+        return self.__time + ora.UNIX_EPOCH
 
 
     def set_time(self, time):
-        time -= ora.UNIX_EPOCH
-        self.__connection.execute("UPDATE clock SET time = ?", (time, ))
-        self.__connection.commit()
+        self.__time = time - ora.UNIX_EPOCH
+        self.__dirty = True
+
+
+    @property
+    def dirty(self):
+        """
+        True if the time has been set since it was last written.
+        """
+        return self.__dirty
+
+
+    def write(self, *ops):
+        """
+        Writes `ops`, along with the time if it has been set, in one
+        transaction.
+        """
+        if self.__dirty:
+            ops += (("clock", "UPDATE clock SET time = ?", (self.__time, )), )
+            self.__dirty = False
+        if len(ops) > 0:
+            self.__writer.write(*ops)
+
+
+    def flush(self):
+        """
+        Writes the time, if it has been set.
+        """
+        self.write()
 
 
 
@@ -83,62 +427,161 @@ TBL_JOBS = sa.Table(
     "jobs", METADATA,
     sa.Column("job_id"        , sa.String()       , nullable=False),
     sa.Column("job"           , sa.String()       , nullable=False),
+    sa.Column("ad_hoc"        , sa.Boolean()      , nullable=True),
+    # Time the job was created.
+    sa.Column("timestamp"     , sa.Float()        , nullable=True),
+    # True if the job has any enabled schedules.
+    sa.Column("scheduled"     , sa.Boolean()      , nullable=True),
+    sa.Index("idx_jobs_job_id", "job_id"),
+    sa.Index("idx_jobs_scheduled", "scheduled"),
 )
 
 class JobDB:
 
-    def __init__(self, engine):
+    # Ad hoc jobs accumulate without bound, so we keep only the most recently
+    # used deserialized jobs in memory.
+
+    CACHE_SIZE = 4096
+
+    def __init__(self, engine, reader):
         self.__engine = engine
+        self.__reader = reader
+        # LRU cache of deserialized jobs, by job ID.
+        self.__cache = OrderedDict()
+
+
+    def __cache_job(self, job):
+        cache = self.__cache
+        cache[job.job_id] = job
+        cache.move_to_end(job.job_id)
+        while len(cache) > self.CACHE_SIZE:
+            cache.popitem(last=False)
 
 
     def insert(self, job):
         # FIXME: Check that the job ID doesn't exist already
         with self.__engine.begin() as conn:
             conn.execute(TBL_JOBS.insert().values(
-                job_id  =job.job_id,
-                job     =ujson.dumps(job_to_jso(job)),
+                job_id      =job.job_id,
+                job         =ujson.dumps(job_to_jso(job)),
+                ad_hoc      =job.ad_hoc,
+                timestamp   =dump_time(ora.now()),
+                scheduled   =is_scheduled(job),
             ))
+        self.__cache_job(job)
 
 
-    def get(self, job_id):
+    def __get_cached(self, job_id):
+        job = self.__cache.get(job_id)
+        if job is not None:
+            self.__cache.move_to_end(job_id)
+        return job
+
+
+    def __load(self, job_id):
         with self.__engine.begin() as conn:
-            query = sa.select([TBL_JOBS]).where(TBL_JOBS.c.job_id == job_id)
+            query = (
+                sa.select([TBL_JOBS.c.job])
+                .where(TBL_JOBS.c.job_id == job_id)
+            )
             rows = list(conn.execute(query))
             assert len(rows) <= 1
 
             if len(rows) == 0:
                 raise LookupError(job_id)
             else:
-                (_, job), = rows
+                (job, ), = rows
                 return jso_to_job(ujson.loads(job), job_id)
 
 
-    def query(self, *, ad_hoc=None):
-        query = sa.select([TBL_JOBS])
+    def get(self, job_id):
+        job = self.__get_cached(job_id)
+        if job is None:
+            job = self.__load(job_id)
+            self.__cache_job(job)
+        return job
+
+
+    async def get_async(self, job_id):
+        """
+        Like `get()`, but reads in a reader thread.
+        """
+        job = self.__get_cached(job_id)
+        if job is None:
+            job = await self.__reader.read(self.__load, job_id)
+            self.__cache_job(job)
+        return job
+
+
+    def query(self, *, ad_hoc=None, scheduled=None):
+        """
+        :param ad_hoc:
+          If not none, limits to ad hoc or to non ad hoc jobs.
+        :param scheduled:
+          If not none, limits to jobs with or without enabled schedules.
+        """
+        cols = TBL_JOBS.c
+        where = []
+        # Rows from before these columns were added have nulls; check these
+        # after loading.
+        if ad_hoc is not None:
+            where.append(sa.or_(cols.ad_hoc == ad_hoc, cols.ad_hoc == None))
+        if scheduled is not None:
+            where.append(
+                sa.or_(cols.scheduled == scheduled, cols.scheduled == None))
+        query = sa.select([cols.job_id, cols.job]).where(sa.and_(*where))
+
         with self.__engine.begin() as conn:
             for job_id, job in conn.execute(query):
-                # FIXME: Filter ad hoc jobs in the query.
                 try:
-                    job = jso_to_job(ujson.loads(job), job_id)
-                except Exception as exc:
-                    logging.error(f"failed to load job from DB: {exc}")
-                    continue
-                if ad_hoc is None or job.ad_hoc == ad_hoc:
+                    # Don't deserialize jobs we have cached.
+                    job = self.__cache[job_id]
+                except KeyError:
+                    try:
+                        job = jso_to_job(ujson.loads(job), job_id)
+                    except Exception as exc:
+                        logging.error(f"failed to load job from DB: {exc}")
+                        continue
+                if (
+                        (ad_hoc is None or job.ad_hoc == ad_hoc)
+                    and (scheduled is None or is_scheduled(job) == scheduled)
+                ):
                     yield job
 
 
 
+def _fill_job_columns(engine):
+    """
+    Fills in the `ad_hoc` and `scheduled` columns of existing job rows.
+    """
+    cols = TBL_JOBS.c
+    with engine.begin() as conn:
+        rows = list(conn.execute(
+            sa.select([cols.job_id, cols.job]).where(cols.ad_hoc == None)))
+        for job_id, job in rows:
+            try:
+                job = jso_to_job(ujson.loads(job), job_id)
+            except Exception as exc:
+                log.error(f"failed to load job from DB: {exc}")
+                continue
+            conn.execute(
+                TBL_JOBS.update()
+                .where(cols.job_id == job_id)
+                .values(ad_hoc=job.ad_hoc, scheduled=is_scheduled(job))
+            )
+    log.info(f"filled columns for {len(rows)} jobs")
+
+
 #-------------------------------------------------------------------------------
 
 # FIXME: For now, we store times and meta as JSON.  To make these searchable,
 # we'll need to break them out into tables.
 
-# FIXME: Split out args into a separate table?
 # FIXME: Split out instances into a separate table?
 
-# FIXME: Store int enumerals for state?
 # FIMXE: Use a TIME column for 'time'?
 
+# We store the state as its `Run.STATE` value.
 TBL_RUNS = sa.Table(
     "runs", METADATA,
     sa.Column("rowid"       , sa.Integer()      , primary_key=True),
@@ -146,26 +589,90 @@ TBL_RUNS = sa.Table(
     sa.Column("timestamp"   , sa.Float()        , nullable=False),
     sa.Column("job_id"      , sa.String()       , nullable=False),
     sa.Column("args"        , sa.String()       , nullable=False),
-    sa.Column("state"       , sa.String()       , nullable=False),
+    sa.Column("state"       , sa.Integer()      , nullable=False),
     sa.Column("program"     , sa.String()       , nullable=True),
     sa.Column("times"       , sa.String()       , nullable=False),
     sa.Column("meta"        , sa.String()       , nullable=False),
     sa.Column("message"     , sa.String()       , nullable=True),
     sa.Column("run_state"   , sa.String()       , nullable=True),
     sa.Column("rerun"       , sa.String()       , nullable=True),
-    sa.Column("expected"    , sa.Boolean()      , nullable=True),
+    sa.Index("idx_runs_job_id_timestamp", "job_id", "timestamp"),
+    sa.Index("idx_runs_timestamp", "timestamp"),
+    sa.Index("idx_runs_state", "state"),
+    sa.Index("idx_runs_rerun", "rerun"),
+)
+
+# Args are also stored in `runs.args`, as JSON, from which runs are loaded.
+# This table is for querying runs by arg.
+TBL_RUN_ARGS = sa.Table(
+    "run_args", METADATA,
+    sa.Column("run_id"      , sa.String()       , nullable=False),
+    sa.Column("name"        , sa.String()       , nullable=False),
+    sa.Column("value"       , sa.String()       , nullable=False),
+    sa.PrimaryKeyConstraint("run_id", "name"),
+    sa.Index("idx_run_args_name_value", "name", "value"),
 )
 
 
+def _rebuild_runs(engine):
+    """
+    Rebuilds the runs table, if it has the old schema with string states.
+
+    SQLite can't change column types, so we copy the rows to a new table, and
+    fill the run args table from them.
+
+    :return:
+      True if the table was rebuilt.
+    """
+    with engine.begin() as conn:
+        types = { r[1]: r[2] for r in conn.execute("PRAGMA table_info(runs)") }
+        if types["state"] == "INTEGER":
+            return False
+
+        log.info("rebuilding runs table")
+        conn.execute("ALTER TABLE runs RENAME TO runs_old")
+        TBL_RUNS.create(conn)
+        state = " ".join(
+            f"WHEN '{s.name}' THEN {s.value}" for s in Run.STATE )
+        conn.execute(f"""
+            INSERT INTO runs (
+                rowid, run_id, timestamp, job_id, args, state, program,
+                times, meta, message, run_state, rerun
+            )
+            SELECT
+                rowid, run_id, timestamp, job_id, args, CASE state {state} END,
+                program, times, meta, message, run_state, rerun
+            FROM runs_old
+        """)
+        conn.execute("DROP TABLE runs_old")
+
+        log.info("filling run args table")
+        conn.execute("DELETE FROM run_args")
+        conn.execute("""
+            INSERT INTO run_args (run_id, name, value)
+            SELECT runs.run_id, args.key, CAST(args.value AS TEXT)
+            FROM runs, json_each(runs.args) AS args
+        """)
+    return True
+
+
 class RunDB:
 
     # For runs in the database (either inserted into or loaded from), we stash
     # the sqlite rowid in the Run._rowid attribute.
 
-    def __init__(self, engine):
+    def __init__(self, engine, reader, writer, clock_db):
+        """
+        :param writer:
+          Writer for runs.
+        :param clock_db:
+          Clock DB on the same writer.  Any pending clock time is written in
+          the same transaction as each run write.
+        """
         self.__engine = engine
-        self.__connection = engine.raw_connection()
-        # FIXME: Do we need to clean this up?
+        self.__reader = reader
+        self.__writer = writer
+        self.__clock_db = clock_db
 
 
     @staticmethod
@@ -176,13 +683,14 @@ class RunDB:
         cursor = conn.execute(query)
         for (
                 rowid, run_id, timestamp, job_id, args, state, program, times,
-                meta, message, run_state, rerun, _
+                meta, message, run_state, rerun
         ) in cursor:
             if program is not None:
                 program     = Program.from_jso(ujson.loads(program))
 
             times           = ujson.loads(times)
-            times           = { n: ora.Time(t) for n, t in times.items() }
+            times           = {
+                sys.intern(n): ora.Time(t) for n, t in times.items() }
 
             args            = ujson.loads(args)
             inst            = Instance(job_id, args)
@@ -190,10 +698,11 @@ class RunDB:
 
             run.run_id      = run_id
             run.timestamp   = load_time(timestamp)
-            run.state       = Run.STATE[state]
+            run.state       = Run.STATE(state)
             run.program     = program
             run.times       = times
-            run.meta        = ujson.loads(meta)
+            run.meta        = {
+                sys.intern(k): v for k, v in ujson.loads(meta).items() }
             run.message     = message
             run.run_state   = ujson.loads(run_state)
             run._rowid      = rowid
@@ -219,7 +728,7 @@ class RunDB:
             dump_time(run.timestamp),
             run.inst.job_id,
             ujson.dumps(run.inst.args),
-            run.state.name,
+            run.state.value,
             program,
             ujson.dumps(times),
             ujson.dumps(run.meta),
@@ -229,80 +738,152 @@ class RunDB:
             rowid,
         )
 
+        # Replace the row, if the run is already in the table.  Updates to
+        # the same run pending in the writer are coalesced.
+        ops = [(("runs", rowid), """
+            INSERT OR REPLACE INTO runs (
+                run_id,
+                timestamp,
+                job_id,
+                args,
+                state,
+                program,
+                times,
+                meta,
+                message,
+                run_state,
+                rerun,
+                rowid
+            )
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, values)]
+
         try:
-            # Get the rowid; if it's missing, this run isn't in the table.
             run._rowid
-
         except AttributeError:
-            # This run isn't in the database yet.
-            # FIXME: sqlite doesn't accepted "FALSE" until version 3.23.0.
-            self.__connection.connection.execute("""
-                INSERT INTO runs (
-                    run_id, 
-                    timestamp, 
-                    job_id, 
-                    args, 
-                    state, 
-                    program, 
-                    times, 
-                    meta, 
-                    message, 
-                    run_state, 
-                    rerun, 
-                    rowid,
-                    expected
-                ) 
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 0)
-            """, values)
-            self.__connection.connection.commit()
-            run._rowid = values[-1]
+            # This run isn't in the database yet; add its args too.
+            ops.extend(
+                (
+                    ("run_args", rowid, n),
+                    "INSERT OR REPLACE INTO run_args VALUES (?, ?, ?)",
+                    (run.run_id, n, v)
+                )
+                for n, v in run.inst.args.items()
+            )
 
-        else:
-            # Update the existing row.
-            self.__connection.connection.execute("""
-                UPDATE runs SET
-                    run_id      = ?, 
-                    timestamp   = ?, 
-                    job_id      = ?, 
-                    args        = ?, 
-                    state       = ?, 
-                    program     = ?, 
-                    times       = ?, 
-                    meta        = ?, 
-                    message     = ?, 
-                    run_state   = ?, 
-                    rerun       = ?
-                WHERE rowid = ?
-            """, values)
-            self.__connection.connection.commit()
+        self.__clock_db.write(*ops)
+        run._rowid = rowid
 
 
     def get(self, run_id):
+        """
+        :raise KeyError:
+          No run with `run_id`.
+        """
+        # Run IDs map to rowids; see upsert().
+        try:
+            rowid = int(run_id[1 :])
+        except ValueError:
+            raise KeyError(run_id) from None
         with self.__engine.begin() as conn:
-            run, = self.__query_runs(conn, TBL_RUNS.c.run_id == run_id)
-        return run
+            runs = list(self.__query_runs(conn, TBL_RUNS.c.rowid == rowid))
+        if len(runs) != 1 or runs[0].run_id != run_id:
+            raise KeyError(run_id)
+        return runs[0]
 
 
-    def query(self, *, job_id=None, since=None, min_timestamp=None):
+    def query(self, *, job_id=None, state=None, rerun=None, args=None,
+              since=None, min_timestamp=None):
         """
+        :param state:
+          If not none, limits to runs in the specified state(s).
+        :param args:
+          If not none, limits to runs with these args.  Runs may include other
+          args not given.
         :param min_timestamp:
           If not none, limits to runs with timestamp not less than this.
         """
-        log.debug(f"query job_id={job_id} since={since}")
+        log.debug(f"query job_id={job_id} rerun={rerun} since={since}")
+        where = self.__where(job_id, state, rerun, args, since, min_timestamp)
+
+        with self.__engine.begin() as conn:
+            # FIMXE: Return only the last record for each run_id?
+            runs = list(self.__query_runs(conn, sa.and_(*where)))
+
+        log.debug(f"query returned {len(runs)} runs")
+        return runs
+
+
+    @staticmethod
+    def __where(job_id, state, rerun, args, since, min_timestamp):
+        """
+        Returns where clauses on runs for query args.
+        """
         where = []
         if job_id is not None:
             where.append(TBL_RUNS.c.job_id == job_id)
+        if state is not None:
+            where.append(
+                TBL_RUNS.c.state.in_([ s.value for s in iterize(state) ]))
+        if rerun is not None:
+            where.append(TBL_RUNS.c.rerun == rerun)
+        for name, value in ({} if args is None else args).items():
+            cols = TBL_RUN_ARGS.c
+            where.append(sa.exists().where(
+                  (cols.run_id == TBL_RUNS.c.run_id)
+                & (cols.name == name)
+                & (cols.value == str(value))
+            ))
         if since is not None:
             where.append(TBL_RUNS.c.rowid >= int(since))
         if min_timestamp is not None:
             where.append(TBL_RUNS.c.timestamp >= dump_time(min_timestamp))
+        return where
+
+
+    def exists(self, *, job_id, args, state=None, min_timestamp=None):
+        """
+        Returns true if there is a run of `job_id` with exactly `args`.
+
+        Stops at the first matching run, rather than loading runs.
+
+        :param state:
+          If not none, limits to runs in the specified state(s).
+        :param min_timestamp:
+          If not none, limits to runs with timestamp not less than this.
+        """
+        where = self.__where(job_id, state, None, args, None, min_timestamp)
+        # No args other than `args`.
+        cols = TBL_RUN_ARGS.c
+        other = cols.run_id == TBL_RUNS.c.run_id
+        if len(args) > 0:
+            other = other & cols.name.notin_(list(args))
+        where.append(~sa.exists().where(other))
+        sel = sa.select([TBL_RUNS.c.rowid]).where(sa.and_(*where)).limit(1)
 
         with self.__engine.begin() as conn:
-            # FIMXE: Return only the last record for each run_id?
-            runs = list(self.__query_runs(conn, sa.and_(*where)))
+            return conn.execute(sel).first() is not None
 
-        log.debug(f"query returned {len(runs)} runs")
-        return runs
+
+    async def get_async(self, run_id):
+        """
+        Like `get()`, but reads in a reader thread.
+        """
+        return await self.__reader.read(self.get, run_id)
+
+
+    async def query_async(self, **kw_args):
+        """
+        Like `query()`, but reads in a reader thread.
+        """
+        return await self.__reader.read(self.query, **kw_args)
+
+
+    async def exists_async(self, **kw_args):
+        """
+        Like `exists()`, but reads in a reader thread.
+        """
+        return await self.__reader.read(self.exists, **kw_args)
 
 
     def get_max_run_id_num(self):
@@ -322,11 +903,23 @@ class RunHistoryDB:
         sa.Index("idx_run_id", "run_id"),
     )
 
-    def __init__(self, engine):
+    def __init__(self, engine, reader, writer):
         self.__engine = engine
+        self.__reader = reader
+        self.__writer = writer
         self.__cache = {}
 
 
+    @staticmethod
+    def __insert(values):
+        return (
+            None,
+            "INSERT INTO run_history (run_id, timestamp, message) "
+            "VALUES (?, ?, ?)",
+            (values["run_id"], values["timestamp"], values["message"])
+        )
+
+
     def cache(self, run_id: str, timestamp: ora.Time, message: str):
         values = {
             "run_id"    : run_id,
@@ -342,8 +935,7 @@ class RunHistoryDB:
             "timestamp" : dump_time(timestamp),
             "message"   : str(message),
         }
-        with self.__engine.begin() as conn:
-            conn.execute(self.TABLE.insert().values(**values))
+        self.__writer.write(self.__insert(values))
 
 
     def flush(self, run_id):
@@ -354,27 +946,38 @@ class RunHistoryDB:
         if len(cache) > 0:
             for item in cache:
                 item["timestamp"] = dump_time(item["timestamp"])
-            with self.__engine.begin() as conn:
-                conn.execute(self.TABLE.insert().values(cache))
+            self.__writer.write(*( self.__insert(i) for i in cache ))
 
 
-    def query(self, *, run_id: str):
-        log.debug(f"query run history run_id={run_id}")
+    def __load(self, run_id):
         where = self.TABLE.c.run_id == run_id
-
-        # Respond with cached values.
-        yield from self.__cache.get(run_id, ())
-
-        # Now query the database.
         with self.__engine.begin() as conn:
             rows = list(conn.execute(sa.select([self.TABLE]).where(where)))
-
-        for run_id, timestamp, message in rows:
-            yield {
+        return [
+            {
                 "run_id"    : run_id,
                 "timestamp" : load_time(timestamp),
                 "message"   : message,
             }
+            for run_id, timestamp, message in rows
+        ]
+
+
+    def query(self, *, run_id: str):
+        log.debug(f"query run history run_id={run_id}")
+        # Respond with cached values.
+        yield from self.__cache.get(run_id, ())
+        # Now query the database.
+        yield from self.__load(run_id)
+
+
+    async def query_async(self, *, run_id: str):
+        """
+        Like `query()`, but reads in a reader thread, and returns a list.
+        """
+        log.debug(f"query run history run_id={run_id}")
+        cached = list(self.__cache.get(run_id, ()))
+        return cached + await self.__reader.read(self.__load, run_id)
 
 
     def get_max_run_id_num(self):
@@ -388,8 +991,25 @@ class OutputDB:
     """
     We store even large outputs in the SQLite database, which should generally
     be efficient.  See https://www.sqlite.org/intern-v-extern-blob.html.
+
+    Outputs at least `compress_min_size` bytes long are compressed, unless
+    already compressed.  The length is always the uncompressed length.
+    Compression happens in the writer thread, not in `add()`.
+
+    If a blob store is given, outputs whose stored data is at least
+    `external_min_size` bytes are stored there instead, and the row holds the
+    blob key instead of the data.
     """
 
+    # Default compression for new outputs.
+    COMPRESSION = "zlib"
+
+    # Default min output length to compress.
+    COMPRESS_MIN_SIZE = 4096
+
+    # Default min stored data length to store in the blob store.
+    EXTERNAL_MIN_SIZE = 16 * 1024 * 1024
+
     TABLE = sa.Table(
         "output", METADATA,
         sa.Column("run_id"      , sa.String()   , nullable=False),
@@ -399,25 +1019,99 @@ class OutputDB:
         sa.Column("length"      , sa.Integer()  , nullable=False),
         sa.Column("compression" , sa.String()   , nullable=True),
         sa.Column("data"        , sa.BINARY()   , nullable=False),
+        # Key in the blob store, if the data is stored there; `data` is empty.
+        sa.Column("blob"        , sa.String()   , nullable=True),
         sa.PrimaryKeyConstraint("run_id", "output_id")
     )
 
-    def __init__(self, engine):
+    def __init__(self, engine, reader, writer, *, compression=COMPRESSION,
+                 compress_min_size=COMPRESS_MIN_SIZE, blob_store=None,
+                 external_min_size=EXTERNAL_MIN_SIZE):
+        """
+        :param compression:
+          Compression name for new outputs, or `None` to not compress.
+        :param blob_store:
+          Blob store for large outputs, or `None` to store all in the DB.
+        """
+        if compression is not None:
+            # Make sure it exists.
+            compress.get(compression)
         self.__engine = engine
+        self.__reader = reader
+        self.__writer = writer
+        self.__compression = compression
+        self.__compress_min_size = int(compress_min_size)
+        self.__blob_store = blob_store
+        self.__external_min_size = int(external_min_size)
+
+
+    @property
+    def blob_store(self):
+        return self.__blob_store
+
+
+    def __prepare(self, run_id, output_id, output):
+        """
+        Compresses and stores output data, and returns the row values.
+        """
+        data = output.data
+        compression = output.compression
+        if (
+                compression is None
+            and self.__compression is not None
+            and len(data) >= self.__compress_min_size
+        ):
+            compressed = compress.compress(self.__compression, data)
+            # Only keep the compressed data if it's smaller.
+            if len(compressed) < len(data):
+                data, compression = compressed, self.__compression
+
+        if (
+                self.__blob_store is not None
+            and len(data) >= self.__external_min_size
+        ):
+            # Store the data externally.  The blob is durable before the row
+            # that refers to it is written.
+            try:
+                blob = self.__blob_store.put(data)
+            except OSError:
+                log.error(
+                    f"failed to store output {output_id} for {run_id} "
+                    "in blob store; storing in DB", exc_info=True)
+                blob = None
+            else:
+                data = b""
+        else:
+            blob = None
+
+        return (
+            run_id,
+            output_id,
+            output.metadata.name,
+            output.metadata.content_type,
+            output.metadata.length,
+            compression,
+            data,
+            blob,
+        )
 
 
     def add(self, run_id: str, output_id: str, output: Output):
-        values = {
-            "run_id"        : run_id,
-            "output_id"     : output_id,
-            "name"          : output.metadata.name,
-            "content_type"  : output.metadata.content_type,
-            "length"        : output.metadata.length,
-            "compression"   : output.compression,
-            "data"          : output.data,
-        }
-        with self.__engine.begin() as conn:
-            conn.execute(self.TABLE.insert().values(**values))
+        # Compress and write to the blob store in the writer thread, which
+        # then inserts the row.
+        self.__writer.write((None, """
+            INSERT INTO output (
+                run_id,
+                output_id,
+                name,
+                content_type,
+                length,
+                compression,
+                data,
+                blob
+            )
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, functools.partial(self.__prepare, run_id, output_id, output)))
 
 
     def get_metadata(self, run_id) -> OutputMetadata:
@@ -437,57 +1131,177 @@ class OutputDB:
         }
 
 
-    def get_data(self, run_id, output_id) -> bytes:
+    def get_compressed(self, run_id, output_id):
+        """
+        Returns output data as stored.
+
+        :return:
+          The compression name or `None`, and the data.  Data in the blob
+          store is returned as a read-only memory map of the blob file.
+        """
         cols = self.TABLE.c
         query = (
-            sa.select([cols.compression, cols.data])
+            sa.select([cols.compression, cols.data, cols.blob])
             .where((cols.run_id == run_id) & ((cols.output_id == output_id)))
         )
         rows = list(self.__engine.execute(query))
         if len(rows) == 0:
             raise LookupError(f"no output {output_id} for {run_id}")
-        else:
-            (compression, data), = rows
-            if compression is None:
-                return data
-            else:
-                raise NotImplementedError(f"compression: {compression}")
+
+        (compression, data, blob), = rows
+        if blob is not None:
+            if self.__blob_store is None:
+                raise LookupError(
+                    f"output {output_id} for {run_id} is in blob store, "
+                    "which is not configured")
+            data = self.__blob_store.get(blob)
+        return compression, data
+
+
+    def get_data(self, run_id, output_id) -> bytes:
+        return compress.decompress(*self.get_compressed(run_id, output_id))
+
+
+    async def get_metadata_async(self, run_id):
+        """
+        Like `get_metadata()`, but reads in a reader thread.
+        """
+        return await self.__reader.read(self.get_metadata, run_id)
+
+
+    async def get_compressed_async(self, run_id, output_id):
+        """
+        Like `get_compressed()`, but reads in a reader thread.
+        """
+        return await self.__reader.read(
+            self.get_compressed, run_id, output_id)
+
+
+    async def get_data_async(self, run_id, output_id):
+        """
+        Like `get_data()`, but reads in a reader thread.
+        """
+        return await self.__reader.read(self.get_data, run_id, output_id)
 
 
 
 #-------------------------------------------------------------------------------
 
+def _check_schema(engine):
+    """
+    :raise RuntimeError:
+      The state file has an old schema, and needs to be migrated.
+    """
+    rows = engine.execute("PRAGMA table_info(runs)")
+    if { r[1]: r[2] for r in rows }.get("state") != "INTEGER":
+        raise RuntimeError("old runs table; migrate the state file")
+    rows = engine.execute(f"PRAGMA table_info({OutputDB.TABLE.name})")
+    if "blob" not in { r[1] for r in rows }:
+        raise RuntimeError("old output table; migrate the state file")
+    if not { i.name for i in TBL_JOBS.indexes } <= _get_indexes(engine, TBL_JOBS):
+        raise RuntimeError("missing jobs indexes; migrate the state file")
+
+
 class SqliteDB:
     """
     A SQLite3 file containing persistent state.
+
+    The `*_async()` methods of the component DBs read in reader threads, so
+    they don't block the event loop.
     """
 
-    def __init__(self, engine):
+    # Number of reader threads.
+    READ_THREADS = 4
+
+    def __init__(self, engine, *, write_behind=True,
+                 output_compression=OutputDB.COMPRESSION,
+                 output_compress_min_size=OutputDB.COMPRESS_MIN_SIZE,
+                 output_dir=None,
+                 output_external_min_size=OutputDB.EXTERNAL_MIN_SIZE):
         """
-        :param path:
-          Path to SQLite file.  If `None`, use a memory DB (for testing).
+        :param write_behind:
+          If true, read and write runs, run history, and output in separate
+          threads.  A memory DB is always read and written inline.
+        :param output_compression:
+          Compression name for new outputs, or `None` to not compress.
+        :param output_compress_min_size:
+          Min length of output to compress.
+        :param output_dir:
+          Directory for the blob store for large outputs, or `None` to store
+          all outputs in the DB.
+        :param output_external_min_size:
+          Min length of stored output data to store in the blob store.
         """
-        self.clock_db       = ClockDB(engine)
-        self.job_db         = JobDB(engine)
-        self.run_db         = RunDB(engine)
-        self.run_history_db = RunHistoryDB(engine)
-        self.output_db      = OutputDB(engine)
+        # Runs, run history, output, and the clock share a writer, so that
+        # they are written in order, and the clock time can be written in the
+        # same transaction as run changes.
+        path = engine.url.database or None
+        if path is None or not write_behind:
+            writer = Writer(None, engine.raw_connection())
+            reader = Reader(None, writer)
+        else:
+            writer = Writer(path, None)
+            reader = Reader(self.READ_THREADS, writer)
+        self.__reader       = reader
+        self.__writer       = writer
+        self.clock_db       = ClockDB(engine, writer)
+        self.job_db         = JobDB(engine, reader)
+        self.run_db         = RunDB(engine, reader, writer, self.clock_db)
+        self.run_history_db = RunHistoryDB(engine, reader, writer)
+        self.output_db      = OutputDB(
+            engine, reader, writer,
+            compression         =output_compression,
+            compress_min_size   =output_compress_min_size,
+            blob_store          =(
+                None if output_dir is None else BlobStore(output_dir)),
+            external_min_size   =output_external_min_size,
+        )
         self._engine        = engine
 
 
+    def get_stats(self):
+        return {
+            **self.__reader.get_stats(),
+            **self.__writer.get_stats(),
+        }
+
+
+    def flush(self):
+        """
+        Waits until all writes so far are committed.
+        """
+        self.__writer.flush()
+
+
+    def close(self):
+        """
+        Commits pending writes, and stops reading and writing.
+        """
+        self.__reader.close()
+        self.__writer.close()
+
+
     @classmethod
     def __get_engine(cls, path):
-        url = "sqlite://" if path is None else f"sqlite:///{path}"
-        return sa.create_engine(url)
+        if path is None:
+            return sa.create_engine("sqlite://")
+        else:
+            # Keep one connection per thread, for the reader threads.
+            return sa.create_engine(
+                f"sqlite:///{path}",
+                poolclass=sa.pool.SingletonThreadPool,
+                pool_size=cls.READ_THREADS + 1,
+            )
 
 
     @classmethod
-    def create(cls, path):
+    def create(cls, path, **kw_args):
         """
         Creates a new database.
 
         :param path:
-          The database path, which must not already exist.
+          The database path, which must not already exist.  If `None`, use a
+          memory DB (for testing).
         :return:
           The new database.
         """
@@ -498,7 +1312,7 @@ class SqliteDB:
         
         engine  = cls.__get_engine(path)
         METADATA.create_all(engine)
-        return cls(engine)
+        return cls(engine, **kw_args)
 
 
     @classmethod
@@ -514,6 +1328,11 @@ class SqliteDB:
         engine = cls.__get_engine(path)
         METADATA.create_all(engine)
 
+        # Add and fill columns for ad hoc job filtering.
+        if _add_columns(engine, TBL_JOBS, "ad_hoc", "timestamp", "scheduled"):
+            _fill_job_columns(engine)
+        _create_indexes(engine, TBL_JOBS)
+
         # Clean up expected runs; these used to be persisted.
         try:
             engine.execute("DELETE FROM runs WHERE expected")
@@ -521,9 +1340,15 @@ class SqliteDB:
             # Column may not exist.
             pass
 
+        # Store states as ints, add indexes, and fill the run args table.
+        _rebuild_runs(engine)
+
+        # Add the column for outputs in the blob store.
+        _add_columns(engine, OutputDB.TABLE, "blob")
+
 
     @classmethod
-    def open(cls, path):
+    def open(cls, path, **kw_args):
         if path is not None:
             path = Path(path).absolute()
             if not path.exists():
@@ -531,7 +1356,8 @@ class SqliteDB:
 
         engine  = cls.__get_engine(path)
         # FIXME: Check that tables exist.
-        return cls(engine)
+        _check_schema(engine)
+        return cls(engine, **kw_args)
 
 
     def get_max_run_id_num(self):
@@ -560,7 +1386,7 @@ def check(db):
         ok = False
 
     engine = db._engine
-    run_tables = (RunHistoryDB.TABLE, OutputDB.TABLE)
+    run_tables = (TBL_RUN_ARGS, RunHistoryDB.TABLE, OutputDB.TABLE)
 
     # Check run tables for valid run ID (referential integrity).
     for tbl in run_tables:
@@ -578,16 +1404,40 @@ def check(db):
         if len(run_ids) > 0:
             error(f"unknown run IDs in {tbl}: {itr.join_truncated(8, run_ids)}")
 
+    # Check outputs in the blob store.
+    blob_store = db.output_db.blob_store
+    keys = {
+        k for (k, ) in engine.execute(
+            "SELECT DISTINCT blob FROM output WHERE blob IS NOT NULL")
+    }
+    if blob_store is None:
+        if len(keys) > 0:
+            error(f"{len(keys)} outputs in blob store, which is not configured")
+    else:
+        bad = [ k for k in sorted(keys) if not blob_store.check(k) ]
+        if len(bad) > 0:
+            error(f"missing or corrupt blobs: {itr.join_truncated(8, bad)}")
+        orphans = sorted(set(blob_store.keys()) - keys)
+        if len(orphans) > 0:
+            # Not an error; possibly left by an interrupted write.
+            logging.warning(
+                f"unreferenced blobs: {itr.join_truncated(8, orphans)}")
+
 
 def archive_runs(db, archive_db, time, *, delete=False):
     """
     Moves runs from `db` to `archive_db` that are older than `time`.
+
+    Outputs in the blob store are copied to the archive's blob store, if it
+    has one, or else stored in the archive DB itself.
     """
     in_eng = db._engine
     arc_eng = archive_db._engine
+    in_blobs = db.output_db.blob_store
+    arc_blobs = archive_db.output_db.blob_store
 
     # Tables other than "runs" that need to be archived.
-    run_tables = (RunHistoryDB.TABLE, OutputDB.TABLE)
+    run_tables = (TBL_RUN_ARGS, RunHistoryDB.TABLE, OutputDB.TABLE)
 
     # Selection for runs in the runs table itself.
     sel = TBL_RUNS.c.timestamp < dump_time(time)
@@ -601,14 +1451,47 @@ def archive_runs(db, archive_db, time, *, delete=False):
             sa.and_(table.c.run_id == TBL_RUNS.c.run_id, sel)
         )
 
+    def copy_blob(row):
+        """
+        Copies an output row's blob to the archive.
+        """
+        if row["blob"] is None:
+            return row
+        row = dict(row)
+        data = in_blobs.get(row["blob"])
+        try:
+            if arc_blobs is None:
+                row["data"], row["blob"] = data[:], None
+            else:
+                arc_blobs.put(data)
+        finally:
+            if not isinstance(data, bytes):
+                data.close()
+        return row
+
     def copy(sel, tbl, chunk_size=16384):
         """
         Copies rows from `sel` to `tbl`.
         """
         for chunk in itr.chunks(in_eng.execute(sel), chunk_size):
+            if tbl is OutputDB.TABLE:
+                chunk = [ copy_blob(r) for r in chunk ]
             with arc_eng.begin() as tx:
                 tx.execute(sa.insert(tbl), chunk)
 
+    # Blobs of outputs of these runs.
+    blobs = {
+        b for (b, ) in in_eng.execute(
+            sa.select([OutputDB.TABLE.c.blob])
+            .select_from(joined(OutputDB.TABLE))
+            .where(OutputDB.TABLE.c.blob != None)
+        )
+    }
+    if len(blobs) > 0 and in_blobs is None:
+        raise RuntimeError(
+            "DB has outputs in blob store, which is not configured; "
+            "pass --output-dir")
+
     # Copy rows corresponding to these runs in other tables.
     for table in run_tables:
         logging.info(f"copying {table}")
@@ -628,6 +1511,16 @@ def archive_runs(db, archive_db, time, *, delete=False):
             logging.info("deleting runs")
             tx.execute(TBL_RUNS.delete().where(sel))
 
+        # Remove blobs of archived outputs, unless other outputs share them.
+        if len(blobs) > 0:
+            logging.info("removing blobs")
+            blobs -= {
+                b for (b, ) in in_eng.execute(
+                    "SELECT DISTINCT blob FROM output WHERE blob IS NOT NULL")
+            }
+            for blob in blobs:
+                in_blobs.remove(blob)
+
         # Verify.
         for table in run_tables:
             logging.info(f"verifying {table}")
@@ -644,3 +1537,47 @@ def archive_runs(db, archive_db, time, *, delete=False):
         logging.info("vacuuming")
         in_eng.execute("VACUUM")
 
+
+
+def compress_outputs(db, compression=OutputDB.COMPRESSION, *,
+                     min_size=OutputDB.COMPRESS_MIN_SIZE, batch_size=1024):
+    """
+    Compresses uncompressed outputs in `db`, in batches.
+
+    Each batch is committed separately, so this may be interrupted and run
+    again.  Outputs that don't get smaller are left uncompressed.  The DB file
+    doesn't shrink until it is vacuumed.  Outputs in the blob store are left
+    as they are.
+
+    :return:
+      The number of outputs compressed, and the total bytes saved.
+    """
+    compressor = compress.get(compression)
+    engine = db._engine
+    num = saved = 0
+    rowid = -1
+
+    while True:
+        with engine.begin() as conn:
+            rows = list(conn.execute(
+                "SELECT rowid, data FROM output "
+                "WHERE compression IS NULL AND blob IS NULL "
+                "AND LENGTH(data) >= ? "
+                "AND rowid > ? ORDER BY rowid LIMIT ?",
+                (min_size, rowid, batch_size)
+            ))
+            if len(rows) == 0:
+                break
+            for rowid, data in rows:
+                compressed = compressor.compress(data)
+                if len(compressed) < len(data):
+                    conn.execute(
+                        "UPDATE output SET compression = ?, data = ? "
+                        "WHERE rowid = ?",
+                        (compression, compressed, rowid)
+                    )
+                    num += 1
+                    saved += len(data) - len(compressed)
+        log.info(f"compressed {num} outputs, saved {saved} bytes")
+
+    return num, saved
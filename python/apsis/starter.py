@@ -0,0 +1,302 @@
+import asyncio
+from   collections import Counter
+import heapq
+import itertools
+import logging
+from   ora import now
+
+from   .lib.stats import Histogram
+from   .runs import get_priority, get_weight
+
+log = logging.getLogger(__name__)
+
+#-------------------------------------------------------------------------------
+
+class Limit:
+    """
+    Bounds on concurrent and per-second starts.
+    """
+
+    def __init__(self, max_concurrent=None, max_rate=None):
+        """
+        :param max_concurrent:
+          Max number of starts in progress at once, or `None` for no limit.
+        :param max_rate:
+          Max starts per second, or `None` for no limit.  Up to one second's
+          worth of starts may occur in a burst.
+        """
+        self.max_concurrent = (
+            None if max_concurrent is None else int(max_concurrent))
+        self.max_rate = None if max_rate is None else float(max_rate)
+        assert self.max_concurrent is None or self.max_concurrent > 0
+        assert self.max_rate is None or self.max_rate > 0
+
+        self.running = 0
+        # Token bucket for rate limiting.
+        self.__tokens = None if self.max_rate is None else max(1, self.max_rate)
+        self.__time = now()
+
+
+    @classmethod
+    def from_jso(cls, jso):
+        return cls(jso.get("max_concurrent"), jso.get("max_rate"))
+
+
+    @property
+    def unlimited(self):
+        return self.max_concurrent is None and self.max_rate is None
+
+
+    def __refill(self, time):
+        if self.max_rate is not None:
+            self.__tokens = min(
+                max(1, self.max_rate),
+                self.__tokens + (time - self.__time) * self.max_rate
+            )
+        self.__time = time
+
+
+    def wait_time(self, time):
+        """
+        Returns how long until a start is allowed, or `None` if it is
+        blocked by concurrency.
+        """
+        if self.max_concurrent is not None \
+           and self.running >= self.max_concurrent:
+            return None
+        self.__refill(time)
+        if self.max_rate is None or self.__tokens >= 1:
+            return 0
+        else:
+            return (1 - self.__tokens) / self.max_rate
+
+
+    def acquire(self):
+        self.running += 1
+        if self.max_rate is not None:
+            self.__tokens -= 1
+
+
+    def release(self):
+        self.running -= 1
+
+
+
+class Starter:
+    """
+    Starts runs, subject to global and per-host group limits on concurrent
+    and per-second starts.
+
+    Runs that cannot be started immediately are queued, and started as limits
+    allow.  Higher priority runs start first.  Among runs of the same priority,
+    each job gets a share of starts in proportion to its weight, as in weighted
+    fair queuing: a job's queued run is tagged with a virtual finish time
+    1 / weight later than the job's previous queued run, or than the current
+    virtual time, and runs start in order of tag.
+    """
+
+    def __init__(self, start, cfg={}):
+        """
+        :param start:
+          Async function that starts a run.
+        :param cfg:
+          The "start_limit" configuration.
+        """
+        self.__start = start
+        self.__limit = Limit.from_jso(cfg)
+        self.__group_limits = {
+            str(n): Limit.from_jso(c)
+            for n, c in cfg.get("host_groups", {}).items()
+        }
+        self.__unlimited = (
+                self.__limit.unlimited
+            and all( l.unlimited for l in self.__group_limits.values() )
+        )
+
+        # Queued runs by group, each a heap of
+        # (-priority, tag, seq, run, queue time).
+        self.__queues = {}
+        self.__seq = itertools.count()
+        # Virtual time, and the tag of each job's last queued run.
+        self.__vtime = 0
+        self.__tags = {}
+        # Number of queued runs by priority.
+        self.__num_by_priority = Counter()
+        # Set when a run is queued or a start completes.
+        self.__wake = asyncio.Event()
+
+        # Metrics.
+        self.__num_started = 0
+        # How late runs start, relative to schedule time.
+        self.__late = Histogram()
+        # How long runs wait in the queue.
+        self.__queue_wait = Histogram()
+
+
+    def get_stats(self):
+        return {
+            "num_queued"    : sum( len(q) for q in self.__queues.values() ),
+            "num_queued_by_group": {
+                str(g): len(q) for g, q in self.__queues.items() if len(q) > 0
+            },
+            "num_queued_by_priority": {
+                str(p): n
+                for p, n in sorted(self.__num_by_priority.items())
+                if n > 0
+            },
+            "num_starting"  : self.__limit.running,
+            "num_started"   : self.__num_started,
+            "late"          : self.__late.to_jso(),
+            "queue_wait"    : self.__queue_wait.to_jso(),
+        }
+
+
+    @staticmethod
+    def __get_group(run):
+        """
+        Returns the host or host group name `run`'s program runs on.
+        """
+        return getattr(run.program, "host", None)
+
+
+    def __acquire(self, group_limit):
+        self.__limit.acquire()
+        if group_limit is not None:
+            group_limit.acquire()
+
+
+    async def __do_start(self, run, group_limit):
+        """
+        Starts `run`, updating metrics, then releases limits.
+        """
+        time = now()
+        sched_time = run.times.get("schedule")
+        if sched_time is not None:
+            self.__late.add(max(0, time - sched_time))
+        self.__num_started += 1
+
+        try:
+            await self.__start(run)
+        finally:
+            self.__limit.release()
+            if group_limit is not None:
+                group_limit.release()
+            self.__wake.set()
+
+
+    async def start(self, run):
+        """
+        Starts `run`, or queues it to start when limits allow.
+        """
+        if self.__unlimited:
+            self.__acquire(None)
+            await self.__do_start(run, None)
+            return
+
+        group = self.__get_group(run)
+        try:
+            queue = self.__queues[group]
+        except KeyError:
+            queue = self.__queues[group] = []
+
+        job_id = run.inst.job_id
+        tag = self.__tags[job_id] = (
+            max(self.__vtime, self.__tags.get(job_id, 0)) + 1 / get_weight(run))
+        priority = get_priority(run)
+        self.__num_by_priority[priority] += 1
+        heapq.heappush(
+            queue, (-priority, tag, next(self.__seq), run, now()))
+        self.__wake.set()
+
+
+    def __dispatch(self):
+        """
+        Starts queued runs, as limits allow.
+
+        :return:
+          Time to wait before retrying, or `None` to wait for a wakeup.
+        """
+        wait = None
+        while True:
+            time = now()
+            global_wait = self.__limit.wait_time(time)
+            if global_wait is None:
+                # At global concurrency limit.
+                return None
+            if global_wait > 0:
+                return global_wait
+
+            # Find the earliest queued run whose group allows a start.
+            best = None
+            for group, queue in self.__queues.items():
+                if len(queue) == 0:
+                    continue
+                group_limit = self.__group_limits.get(group)
+                if group_limit is not None:
+                    group_wait = group_limit.wait_time(time)
+                    if group_wait is None:
+                        continue
+                    if group_wait > 0:
+                        wait = group_wait if wait is None else min(wait, group_wait)
+                        continue
+                if best is None or queue[0][: 3] < best[0][0][: 3]:
+                    best = queue, group_limit
+            if best is None:
+                return wait
+
+            queue, group_limit = best
+            neg_priority, tag, _, run, queue_time = heapq.heappop(queue)
+            self.__vtime = max(self.__vtime, tag)
+            job_id = run.inst.job_id
+            if self.__tags.get(job_id) == tag:
+                # This was the job's last queued run.
+                del self.__tags[job_id]
+            self.__num_by_priority[-neg_priority] -= 1
+            self.__queue_wait.add(time - queue_time)
+            if run.state != run.STATE.waiting:
+                # Something else happened to the run while it was queued.
+                log.info(f"not starting queued run: {run.run_id}")
+                continue
+
+            # Acquire now, so the next dispatch sees the limits.
+            self.__acquire(group_limit)
+            asyncio.ensure_future(self.__start_queued(run, group_limit))
+
+
+    async def __start_queued(self, run, group_limit):
+        try:
+            await self.__do_start(run, group_limit)
+        except Exception:
+            log.error(f"failed to start run: {run.run_id}", exc_info=True)
+
+
+    async def loop(self):
+        """
+        Starts queued runs as limits allow.
+        """
+        if self.__unlimited:
+            return
+
+        try:
+            while True:
+                self.__wake.clear()
+                wait = self.__dispatch()
+                if wait is None:
+                    await self.__wake.wait()
+                else:
+                    try:
+                        await asyncio.wait_for(self.__wake.wait(), wait)
+                    except asyncio.TimeoutError:
+                        pass
+
+        except asyncio.CancelledError:
+            # Let this through.
+            raise
+
+        except Exception:
+            # FIXME: Do this in Apsis.
+            log.critical("starter loop failed", exc_info=True)
+            raise SystemExit(1)
+
+
+
@@ -1,42 +1,153 @@
 import asyncio
+from   collections import Counter
+import itertools
 import logging
+from   ora import now
+
+from   .runs import get_priority, get_weight
 
 log = logging.getLogger(__name__)
 
 #-------------------------------------------------------------------------------
 
+def _get_key(job_id, args):
+    """
+    Returns the index key for runs of `job_id` with `args`, or for all runs
+    of `job_id` if `args` is none.
+    """
+    return job_id, None if args is None else frozenset(args.items())
+
+
+def _fair_order(entries):
+    """
+    Orders waiting entries for starting.
+
+    Orders by priority, then takes jobs in turn in proportion to their
+    weights, as the starter does, so that one job's many runs don't hold up
+    other jobs' runs.  Each job's runs remain in seq order.
+
+    :param entries:
+      Waiting entries, in seq order.
+    """
+    tags = Counter()
+    keys = []
+    for entry in entries:
+        seq, run, _ = entry
+        job_id = run.inst.job_id
+        tag = tags[job_id] = tags[job_id] + 1 / get_weight(run)
+        keys.append((-get_priority(run), tag, seq, entry))
+    return [ k[-1] for k in sorted(keys) ]
+
+
+
 class Waiter:
     """
     Holds runs in the waiting state until all conditions are satisfied.
+
+    A waiting run is rechecked when a run its blocking condition watches
+    changes.  All waiting runs are also rechecked periodically, as a
+    safety net.
     """
 
-    # FIXME: Primitive first cut: just store all runs with their blockers,
-    # by run ID, and reevaluate all of them every time.
+    # Interval between checks of all waiting runs.
+    SWEEP_INTERVAL = 60
 
     def __init__(self, run_store, start, run_history):
         self.__run_store = run_store
         self.__start = start
         self.__run_history = run_history
 
-        # Mapping from run ID to (run, conds).  The latter is a list of 
+        # Mapping from run ID to (seq, run, conds).  The latter is a list of
         # conds that have not yet been checked.  The first cond is blocking.
         # Others may not have been checked yet.  The list is mutated as conds
-        # are checked.
+        # are checked.  Seq orders runs by when they started waiting.
         self.__waiting = {}
+        self.__seq = itertools.count()
 
+        # Mapping from `_get_key()` key to IDs of waiting runs whose blocking
+        # cond watches that instance, or all runs of that job.
+        self.__watching = {}
+        # IDs of waiting runs whose blocking cond watches all jobs.
+        self.__watching_all = set()
 
-    def __check(self, run, conds):
+        # Metrics.
+        self.__num_checks = 0
+        self.__num_sweeps = 0
+
+
+    def get_stats(self):
+        return {
+            "num_waiting"   : len(self.__waiting),
+            "num_waiting_by_priority": {
+                str(p): n
+                for p, n in sorted(Counter(
+                    get_priority(r) for _, r, _ in self.__waiting.values()
+                ).items())
+            },
+            "num_watched"   : len(self.__watching),
+            "num_watching_all": len(self.__watching_all),
+            "num_checks"    : self.__num_checks,
+            "num_sweeps"    : self.__num_sweeps,
+        }
+
+
+    def __watch(self, run_id, cond):
+        watch = cond.watch()
+        if watch is None:
+            self.__watching_all.add(run_id)
+        else:
+            for job_id, args in watch:
+                key = _get_key(job_id, args)
+                self.__watching.setdefault(key, set()).add(run_id)
+
+
+    def __unwatch(self, run_id, cond):
+        watch = cond.watch()
+        if watch is None:
+            self.__watching_all.discard(run_id)
+        else:
+            for job_id, args in watch:
+                key = _get_key(job_id, args)
+                run_ids = self.__watching.get(key)
+                if run_ids is not None:
+                    run_ids.discard(run_id)
+                    if len(run_ids) == 0:
+                        del self.__watching[key]
+
+
+    def get_blocked_by(self, inst):
+        """
+        Returns waiting runs whose blocking cond watches runs of `inst`.
         """
-        Checks conditions for a blocker, starting from the front. 
+        run_ids = (
+              self.__watching.get(_get_key(inst.job_id, inst.args), set())
+            | self.__watching.get(_get_key(inst.job_id, None), set())
+        )
+        entries = sorted( self.__waiting[i] for i in run_ids )
+        return [ r for _, r, _ in entries ]
+
+
+    async def __check(self, run, conds, changed=()):
+        """
+        Checks conditions for a blocker, starting from the front.
 
         On return, either `conds` is empty and the run is not blocked, or the
         run is blocked on `conds[0]`.
 
         :param conds:
           A list of conditions; mutated.
+        :param changed:
+          Changed runs that may satisfy the blocking cond.
         """
+        self.__num_checks += 1
+        if (
+                len(conds) > 0
+            and any( conds[0].is_satisfied_by(r) for r in changed )
+        ):
+            # A changed run satisfies the blocker; no need to query.
+            conds.pop(0)
         while len(conds) > 0:
-            if conds[0].check_runs(self.__run_store):
+            if await conds[0].check_runs_async(self.__run_store):
                 # Not blocking.
                 conds.pop(0)
             else:
@@ -44,56 +155,164 @@ class Waiter:
                 break
 
 
+    async def __start_run(self, run):
+        """
+        Starts `run`, which is no longer blocked.
+        """
+        # The run may be queued to start; count it as running meanwhile, so
+        # that it holds its place toward max running conds.
+        self.__run_store.set_starting(run)
+        try:
+            await self.__start(run)
+        except BaseException:
+            self.__run_store.set_starting(run, False)
+            raise
+
+
     async def start(self, run):
         """
         Starts `run`, unless it's blocked; if so, registers it to wait for.
         """
         conds = list(run.conds)
-        self.__check(run, conds)
+        await self.__check(run, conds)
+        if run.state != run.STATE.waiting:
+            # Transitioned elsewhere while checking.
+            log.info(f"run no longer waiting: {run.run_id}")
+            return
 
         if len(conds) == 0:
             # Ready to run.
             log.debug(f"starting: {run}")
-            await self.__start(run)
+            await self.__start_run(run)
 
         else:
             # Blocked by a cond.
             assert run.run_id not in self.__waiting
             self.__run_history.info(run, f"waiting for {conds[0]}")
-            self.__waiting[run.run_id] = (run, conds)
+            self.__waiting[run.run_id] = (next(self.__seq), run, conds)
+            self.__watch(run.run_id, conds[0])
 
 
-    async def __check_all(self):
+    async def __check_runs(self, run_ids):
         """
-        Checks conds on all waiting runs; starts any no longer blocked.
+        Checks conds on waiting runs; starts any no longer blocked.
+
+        :param run_ids:
+          Mapping from IDs of waiting runs to check to changed runs that may
+          satisfy their blocking conds.
         """
-        for run_id, (run, conds) in list(self.__waiting.items()):
+        # Keys of conds found blocking.
+        blocking = set()
+
+        entries = sorted(
+            self.__waiting[i] for i in run_ids if i in self.__waiting)
+        for _, run, conds in _fair_order(entries):
+            run_id = run.run_id
+            if run_id not in self.__waiting:
+                # No longer waiting.
+                continue
+
             last_blocker = conds[0]
-            self.__check(run, conds)
+            key = last_blocker.get_block_key()
+            if key is not None and key in blocking:
+                # An earlier run is still blocked by an equivalent cond.
+                continue
 
+            await self.__check(run, conds, run_ids[run_id])
+            if run.state != run.STATE.waiting:
+                # Transitioned elsewhere while checking.
+                log.info(f"run no longer waiting: {run_id}")
+                del self.__waiting[run_id]
+                self.__unwatch(run_id, last_blocker)
+                continue
+            if len(conds) > 0 and conds[0] is last_blocker:
+                # Still blocked by the same cond.
+                if key is not None:
+                    blocking.add(key)
+                continue
+
+            self.__unwatch(run_id, last_blocker)
             if len(conds) == 0:
                 # No longer blocked; ready to run.
                 self.__run_history.info(run, f"no longer waiting")
-                del self.__waiting[run.run_id]
-                await self.__start(run)
+                del self.__waiting[run_id]
+                await self.__start_run(run)
 
             else:
-                # Still blocked.
-                blocker = conds[0]
-                if blocker is not last_blocker:
-                    # Blocked by a new cond.
-                    self.__run_history.info(run, f"waiting for {blocker}")
+                # Blocked by a new cond.
+                self.__run_history.info(run, f"waiting for {conds[0]}")
+                self.__watch(run_id, conds[0])
+
+
+    def __get_affected(self, runs):
+        """
+        Finds waiting runs that may be unblocked by changes to `runs`.
+
+        :return:
+          Mapping from waiting run ID to the changed runs it watches.
+        """
+        run_ids = {}
+        for run in runs:
+            if run.state is None:
+                # Removed.
+                continue
+            job_id = run.inst.job_id
+            for key in _get_key(job_id, run.inst.args), _get_key(job_id, None):
+                for run_id in self.__watching.get(key, ()):
+                    run_ids.setdefault(run_id, []).append(run)
+
+            entry = self.__waiting.get(run.run_id)
+            if entry is not None and run.state != run.STATE.waiting:
+                # The waiting run itself was transitioned elsewhere.
+                log.info(f"run no longer waiting: {run.run_id}")
+                del self.__waiting[run.run_id]
+                self.__unwatch(run.run_id, entry[2][0])
+
+        if len(runs) > 0:
+            for run_id in self.__watching_all:
+                run_ids.setdefault(run_id, [])
+        return run_ids
 
 
     async def loop(self):
         """
         Waits for waiting runs to become ready.
         """
-        # FIXME
         try:
-            while True:
-                await self.__check_all()
-                await asyncio.sleep(1)
+            with self.__run_store.subscribe() as queue:
+                sweep_time = now() + self.SWEEP_INTERVAL
+                while True:
+                    timeout = sweep_time - now()
+                    if timeout <= 0:
+                        # Safety net: check all waiting runs.
+                        self.__num_sweeps += 1
+                        await self.__check_runs(
+                            { i: () for i in self.__waiting })
+                        sweep_time = now() + self.SWEEP_INTERVAL
+                        continue
+
+                    # Don't use wait_for(), which may swallow cancellation.
+                    get = asyncio.ensure_future(queue.get())
+                    try:
+                        await asyncio.wait((get, ), timeout=timeout)
+                    finally:
+                        get.cancel()
+                    if not get.done() or get.cancelled():
+                        continue
+                    msg = get.result()
+                    if msg is None:
+                        # The run store is shutting down.
+                        break
+                    elif msg is queue.RESYNC:
+                        # We fell behind and missed changes; check all.
+                        log.warning("waiter resyncing")
+                        sweep_time = now()
+                        continue
+
+                    # The queue coalesces pending changes; check waiting runs
+                    # affected by them.
+                    _, runs = msg
+                    await self.__check_runs(self.__get_affected(runs))
 
         except asyncio.CancelledError:
             # Let this through.
@@ -0,0 +1,68 @@
+"""
+Benchmarks generating times from a crontab schedule.
+
+Compares stepping minute by minute and matching fields, as cron does, with
+`CrontabSchedule`, which skips directly to matching dates and times.
+
+    python test/bench/bench_crontab.py [NUM_TIMES]
+
+"""
+
+import itertools
+from   ora import Time
+import sys
+
+from   apsis.lib.timing import Timer
+from   apsis.schedule import CrontabSchedule
+
+#-------------------------------------------------------------------------------
+
+TZ = "America/New_York"
+
+FIELDS = (
+    "*/5 * * * *",
+    "30 9 * * mon-fri",
+    "0 0 1 * *",
+    "0 12 29 2 *",
+)
+
+def scan(sched, start):
+    tz = sched.tz
+    fields = sched.fields
+    time = start
+    while True:
+        date, daytime = time @ tz
+        if fields.match(
+                daytime.minute, daytime.hour, date.day, date.month,
+                date.weekday):
+            yield time
+        time += 60
+
+
+def main(num):
+    start = Time(2020, 1, 1, 0, 0, 0, TZ)
+    for fields in FIELDS:
+        sched = CrontabSchedule(TZ, fields)
+        # The scan is slow for sparse schedules; limit its count.
+        n = num if fields.startswith("*") else max(1, num // 100)
+
+        with Timer() as timer:
+            old = list(itertools.islice(scan(sched, start), n))
+        old_elapsed = timer.elapsed
+
+        with Timer() as timer:
+            new = [ t for t, _ in itertools.islice(sched(start), n) ]
+        new_elapsed = timer.elapsed
+
+        assert new == old
+        print(
+            f"{fields:20s} {n:6d} times: "
+            f"scan {old_elapsed / n * 1e6:10.1f} µs  "
+            f"crontab {new_elapsed / n * 1e6:8.1f} µs"
+        )
+
+
+if __name__ == "__main__":
+    num, = sys.argv[1 :] or (1000, )
+    main(int(num))
+
@@ -0,0 +1,118 @@
+"""
+Benchmarks event loop lag under concurrent DB reads.
+
+Fills a database file with runs, run history, and large outputs.  Then many
+concurrent clients read output and history, as API requests do, while a
+ticker measures how late the event loop wakes it.  Compares reading inline on
+the event loop with reading in reader threads.
+
+    python test/bench/bench_loop_lag.py [NUM_CLIENTS ...]
+
+"""
+
+import asyncio
+from   ora import now
+import sys
+import tempfile
+import time
+
+from   apsis.lib.timing import Timer
+from   apsis.program import Output, OutputMetadata
+from   apsis.runs import Instance, Run
+from   apsis.sqlite import SqliteDB
+
+NUM_RUNS = 1000
+OUTPUT_SIZE = 1024 * 1024
+DURATION = 3
+TICK = 0.001
+
+#-------------------------------------------------------------------------------
+
+def fill(path):
+    db = SqliteDB.create(path)
+    data = bytes(OUTPUT_SIZE)
+    for i in range(NUM_RUNS):
+        run = Run(Instance("job", {"i": str(i)}))
+        run.run_id = f"r{i + 1}"
+        run.timestamp = now()
+        for state in Run.STATE.running, Run.STATE.success:
+            run._transition(now(), state)
+            db.run_db.upsert(run)
+            db.run_history_db.insert(run.run_id, now(), state.name)
+        if i % 10 == 0:
+            output = Output(OutputMetadata("output", len(data)), data)
+            db.output_db.add(run.run_id, "output", output)
+    db.close()
+
+
+async def client(db, use_async, stop):
+    """
+    Reads output and history until `stop`; returns the number of reads.
+    """
+    count = 0
+    i = 0
+    while time.monotonic() < stop:
+        run_id = f"r{i * 10 % NUM_RUNS + 1}"
+        if use_async:
+            await db.output_db.get_data_async(run_id, "output")
+            await db.run_history_db.query_async(run_id=run_id)
+        else:
+            db.output_db.get_data(run_id, "output")
+            list(db.run_history_db.query(run_id=run_id))
+            # Yield, as a handler does between requests.
+            await asyncio.sleep(0)
+        count += 2
+        i += 1
+    return count
+
+
+async def ticker(stop):
+    """
+    Returns how late each tick wakes up.
+    """
+    lags = []
+    while time.monotonic() < stop:
+        start = time.monotonic()
+        await asyncio.sleep(TICK)
+        lags.append(time.monotonic() - start - TICK)
+    return lags
+
+
+async def bench(path, num_clients, use_async):
+    db = SqliteDB.open(path)
+    stop = time.monotonic() + DURATION
+    with Timer() as timer:
+        lags, *counts = await asyncio.gather(
+            ticker(stop),
+            *( client(db, use_async, stop) for _ in range(num_clients) )
+        )
+    db.close()
+    lags.sort()
+    return (
+        sum(counts) / timer.elapsed,
+        lags[len(lags) // 2],
+        lags[int(len(lags) * 0.99)],
+        lags[-1],
+    )
+
+
+def main(nums):
+    with tempfile.TemporaryDirectory() as dir:
+        path = f"{dir}/apsis.db"
+        fill(path)
+        for num in nums:
+            for use_async in False, True:
+                rate, p50, p99, max = asyncio.run(bench(path, num, use_async))
+                name = "threads" if use_async else "inline"
+                print(
+                    f"{num:4d} clients {name:8s}: {rate:7.0f} reads/s  "
+                    f"lag p50 {p50 * 1e3:7.2f} ms  p99 {p99 * 1e3:7.2f} ms  "
+                    f"max {max * 1e3:7.2f} ms"
+                )
+
+
+if __name__ == "__main__":
+    nums = [ int(n) for n in sys.argv[1 :] ] or [1, 16]
+    main(nums)
+
+
@@ -0,0 +1,63 @@
+"""
+Benchmarks persisting run transitions.
+
+Writes transitions of many runs, each with a run history record, as a start
+storm does, to a database file, with inline commits and with the write-behind
+writer.  Times include committing all writes.
+
+    python test/bench/bench_run_db.py [NUM_RUNS ...]
+
+"""
+
+from   ora import now
+import sys
+import tempfile
+
+from   apsis.lib.timing import Timer
+from   apsis.runs import Instance, Run
+from   apsis.sqlite import SqliteDB
+
+STATES = (Run.STATE.waiting, Run.STATE.running, Run.STATE.success)
+
+#-------------------------------------------------------------------------------
+
+def bench(num, write_behind):
+    with tempfile.TemporaryDirectory() as dir:
+        db = SqliteDB.create(f"{dir}/apsis.db", write_behind=write_behind)
+        runs = []
+        for i in range(num):
+            run = Run(Instance(f"job{i % 100}", {"i": str(i)}))
+            run.run_id = f"r{i + 1}"
+            run.timestamp = now()
+            runs.append(run)
+
+        with Timer() as timer:
+            for state in STATES:
+                for run in runs:
+                    run._transition(now(), state)
+                    db.run_db.upsert(run)
+                    db.run_history_db.insert(run.run_id, now(), state.name)
+            db.flush()
+        stats = db.get_stats()
+        db.close()
+
+    return num * len(STATES) / timer.elapsed, stats
+
+
+def main(nums):
+    for num in nums:
+        for write_behind in False, True:
+            rate, stats = bench(num, write_behind)
+            name = "write-behind" if write_behind else "inline"
+            print(
+                f"{num:8d} runs {name:12s}: {rate:9.0f} transitions/s  "
+                f"{stats['num_batches']:6d} commits  "
+                f"{stats['num_coalesced']:6d} coalesced"
+            )
+
+
+if __name__ == "__main__":
+    nums = [ int(n) for n in sys.argv[1 :] ] or [1000, 10000]
+    main(nums)
+
+
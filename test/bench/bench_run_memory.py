@@ -0,0 +1,81 @@
+"""
+Benchmarks memory used by runs.
+
+Measures bytes per run, with tracemalloc, for expected runs as the scheduler
+creates them and for completed runs as loaded from the run DB.  Times include
+creating or loading the runs under tracemalloc, so are inflated.
+
+    python test/bench/bench_run_memory.py [NUM_RUNS ...]
+
+"""
+
+from   ora import now
+import sys
+import tracemalloc
+
+from   apsis.lib.timing import Timer
+from   apsis.runs import Instance, Run, ExpectedRun
+from   apsis.sqlite import SqliteDB
+
+NUM_JOBS = 1000
+
+#-------------------------------------------------------------------------------
+
+def make_expected(num):
+    start = now()
+    runs = []
+    for i in range(num):
+        inst = Instance(f"job{i % NUM_JOBS}", {"date": str(i // NUM_JOBS)})
+        run = ExpectedRun(inst, start + i, labels=("label", ))
+        run.run_id = f"r{i}"
+        run.timestamp = start
+        runs.append(run)
+    return runs
+
+
+def make_completed(num):
+    """
+    Writes completed runs to a run DB, and returns a function that loads them.
+    """
+    db = SqliteDB.create(path=None)
+    start = now()
+    for i in range(num):
+        run = Run(Instance(f"job{i % NUM_JOBS}", {"date": str(i // NUM_JOBS)}))
+        run.run_id = run.rerun = f"r{i + 1}"
+        run.timestamp = start
+        for state in (Run.STATE.scheduled, Run.STATE.waiting,
+                      Run.STATE.running, Run.STATE.success):
+            run._transition(start, state)
+        run.meta["labels"] = ["label"]
+        db.run_db.upsert(run)
+    return lambda num: db.run_db.query()
+
+
+def bench(make, num):
+    tracemalloc.start()
+    with Timer() as timer:
+        runs = make(num)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert len(runs) == num
+    return size / num, timer.elapsed / num
+
+
+def main(nums):
+    for num in nums:
+        for name, make in (
+                ("expected" , make_expected),
+                ("completed", make_completed(num)),
+        ):
+            size, elapsed = bench(make, num)
+            print(
+                f"{num:8d} {name:10s} runs: {size:7.1f} bytes/run  "
+                f"{elapsed * 1e6:6.2f} µs/run"
+            )
+
+
+if __name__ == "__main__":
+    nums = [ int(n) for n in sys.argv[1 :] ] or [1000000]
+    main(nums)
+
+
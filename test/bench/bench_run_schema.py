@@ -0,0 +1,117 @@
+"""
+Benchmarks run DB queries, before and after migrating the runs schema.
+
+Fills a state file with runs in the old schema, with string states and no
+indexes, and times typical queries.  Then migrates it, and times the same
+queries against the indexed schema and run args table.
+
+    python test/bench/bench_run_schema.py [NUM_RUNS]
+
+"""
+
+import random
+import sqlite3
+import sys
+import tempfile
+import ujson
+
+from   apsis.lib.timing import Timer
+from   apsis.runs import Run
+from   apsis.sqlite import SqliteDB
+
+NUM_JOBS = 10000
+STATES = ("success", ) * 8 + ("failure", "error", "running", "waiting")
+CHUNK = 100000
+
+OLD_RUNS = """
+    CREATE TABLE runs (
+        rowid INTEGER NOT NULL PRIMARY KEY, run_id VARCHAR NOT NULL,
+        timestamp FLOAT NOT NULL, job_id VARCHAR NOT NULL,
+        args VARCHAR NOT NULL, state VARCHAR NOT NULL, program VARCHAR,
+        times VARCHAR NOT NULL, meta VARCHAR NOT NULL, message VARCHAR,
+        run_state VARCHAR, rerun VARCHAR, expected BOOLEAN
+    )
+"""
+
+#-------------------------------------------------------------------------------
+
+def fill(path, num):
+    SqliteDB.create(path).close()
+    rnd = random.Random(0)
+    with sqlite3.connect(path) as conn:
+        conn.execute("DROP TABLE runs")
+        conn.execute(OLD_RUNS)
+        for start in range(0, num, CHUNK):
+            rows = []
+            for i in range(start, min(start + CHUNK, num)):
+                args = {"date": str(i // NUM_JOBS), "n": str(i % 7)}
+                rows.append((
+                    i + 1, f"r{i + 1}", 1.5e9 + i, f"job{i % NUM_JOBS}",
+                    ujson.dumps(args), rnd.choice(STATES), None, "{}", "{}",
+                    None, "null", f"r{i + 1}", False,
+                ))
+            conn.executemany(
+                "INSERT INTO runs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows)
+
+
+def time_queries(path, queries):
+    with sqlite3.connect(path) as conn:
+        for name, sql in queries.items():
+            with Timer() as timer:
+                count = len(list(conn.execute(sql)))
+            print(f"  {name:16s} {timer.elapsed * 1e3:10.3f} ms  {count:7d} rows")
+
+
+def main(num):
+    with tempfile.TemporaryDirectory() as dir:
+        path = f"{dir}/apsis.db"
+        with Timer() as timer:
+            fill(path, num)
+        print(f"{num} runs: fill {timer.elapsed:.1f} s")
+
+        t = 1.5e9 + num - 1000
+        print("old schema:")
+        time_queries(path, {
+            "job_id"        : "SELECT rowid FROM runs WHERE job_id = 'job17'",
+            "state"         : "SELECT rowid FROM runs WHERE state = 'error'",
+            "rerun"         : "SELECT rowid FROM runs WHERE rerun = 'r17'",
+            "job_id+time"   : "SELECT rowid FROM runs "
+                              f"WHERE job_id = 'job17' AND timestamp >= {t}",
+            "time"          : f"SELECT rowid FROM runs WHERE timestamp >= {t}",
+            "arg"           : "SELECT rowid FROM runs "
+                              "WHERE json_extract(args, '$.date') = '17'",
+        })
+
+        with Timer() as timer:
+            SqliteDB.migrate(path)
+        print(f"migrate {timer.elapsed:.1f} s")
+
+        error = Run.STATE.error.value
+        print("new schema:")
+        time_queries(path, {
+            "job_id"        : "SELECT rowid FROM runs WHERE job_id = 'job17'",
+            "state"         : f"SELECT rowid FROM runs WHERE state = {error}",
+            "rerun"         : "SELECT rowid FROM runs WHERE rerun = 'r17'",
+            "job_id+time"   : "SELECT rowid FROM runs "
+                              f"WHERE job_id = 'job17' AND timestamp >= {t}",
+            "time"          : f"SELECT rowid FROM runs WHERE timestamp >= {t}",
+            "arg"           : "SELECT run_id FROM run_args "
+                              "WHERE name = 'date' AND value = '17'",
+        })
+
+        db = SqliteDB.open(path)
+        with Timer() as timer:
+            runs = db.run_db.query(job_id="job17", args={"n": "3"})
+        print(
+            f"  {'RunDB.query':16s} {timer.elapsed * 1e3:10.3f} ms  "
+            f"{len(runs):7d} runs"
+        )
+        db.close()
+
+
+if __name__ == "__main__":
+    num, = [ int(n) for n in sys.argv[1 :] ] or [1000000]
+    main(num)
+
+
@@ -0,0 +1,100 @@
+"""
+Benchmarks run store queries.
+
+Fills a run store mostly with expected runs, plus some full runs in various
+states, then times queries the API, waiter, and scheduler make, against a
+scan of all runs.
+
+    python test/bench/bench_run_store.py [NUM_RUNS ...]
+
+"""
+
+from   ora import now
+import random
+import sys
+
+from   apsis.lib.timing import Timer
+from   apsis.runs import Instance, Run, RunStore, ExpectedRun
+from   apsis.sqlite import SqliteDB
+
+NUM_JOBS = 1000
+NUM_FULL = 10000
+
+#-------------------------------------------------------------------------------
+
+def fill(num):
+    rnd = random.Random(0)
+    run_store = RunStore(SqliteDB.create(path=None), min_timestamp=None)
+    start = now()
+
+    with Timer() as timer:
+        for i in range(num - NUM_FULL):
+            inst = Instance(f"job{i % NUM_JOBS}", {"i": str(i)})
+            run_store.add_expected(ExpectedRun(inst, start + i))
+
+        states = [
+            [Run.STATE.scheduled],
+            [Run.STATE.running],
+            [Run.STATE.running, Run.STATE.success],
+            [Run.STATE.running, Run.STATE.failure],
+        ]
+        for i in range(NUM_FULL):
+            run = Run(Instance(f"job{i % NUM_JOBS}", {"i": str(i)}))
+            run_store.add(run)
+            for state in rnd.choice(states):
+                run._transition(now(), state)
+                run_store.update(run, now())
+    print(f"{num:8d} runs: fill {timer.elapsed:6.1f} s")
+
+    return run_store
+
+
+def time_query(run_store, **kw_args):
+    """
+    Returns time per query, and number of results.
+    """
+    with Timer() as timer:
+        for _ in range(10):
+            _, runs = run_store.query(**kw_args)
+    return timer.elapsed / 10, len(runs)
+
+
+def time_scan(run_store):
+    """
+    Returns time to scan all runs, as an unindexed query does.
+    """
+    _, runs = run_store.query(run_ids=None)
+    with Timer() as timer:
+        [ r for r in runs if r.inst.job_id == "job17" ]
+    return timer.elapsed
+
+
+def main(nums):
+    for num in nums:
+        run_store = fill(num)
+        print(f"{'':8s}       scan {time_scan(run_store) * 1e3:9.3f} ms")
+        _, (run, *_) = run_store.query(state=Run.STATE.failure)
+        queries = {
+            "job_id"        : dict(job_id="job17"),
+            "state"         : dict(state=Run.STATE.running),
+            "job_id+state"  : dict(job_id="job17", state=Run.STATE.running),
+            "rerun"         : dict(rerun=run.rerun),
+            "since"         : dict(since=now() - 1),
+            "latest"        : dict(reruns=False),
+            "job_id latest" : dict(job_id="job17", reruns=False),
+            "dependency"    : dict(
+                job_id="job17", args={"i": "17"}, state=Run.STATE.success),
+        }
+        for name, kw_args in queries.items():
+            elapsed, count = time_query(run_store, **kw_args)
+            print(
+                f"{'':8s}       {name:14s} {elapsed * 1e3:9.3f} ms  "
+                f"{count:7d} runs"
+            )
+
+
+if __name__ == "__main__":
+    nums = [ int(n) for n in sys.argv[1 :] ] or [100000, 1000000]
+    main(nums)
+
+
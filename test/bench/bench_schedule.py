@@ -0,0 +1,96 @@
+"""
+Benchmarks generating schedule times over a window.
+
+Compares consuming a schedule's generator with `itertools.takewhile`, as the
+scheduler used to, with the batch `Schedule.times_between()`.
+
+Also compares daily schedule generation from the shared daily tables with
+walking the calendar and converting each time individually.
+
+    python test/bench/bench_schedule.py [DAYS]
+
+"""
+
+import itertools
+import ora
+from   ora import Time, UTC
+import sys
+
+from   apsis.lib.timing import Timer
+from   apsis.schedule import DailySchedule, IntervalSchedule
+
+#-------------------------------------------------------------------------------
+
+SCHEDULES = {
+    "interval 10 s": IntervalSchedule(10, {}),
+    "interval 1 min": IntervalSchedule(60, {}),
+    "daily 4x Mon-Fri": DailySchedule(
+        "America/New_York", ora.get_calendar("Mon-Fri"),
+        ["9:00:00", "12:00:00", "15:00:00", "18:00:00"], {}),
+}
+
+REPEAT = 5
+
+def best(fn):
+    """
+    Returns the result of `fn()` and its best elapsed time over repeats.
+    """
+    elapsed = []
+    for _ in range(REPEAT):
+        with Timer() as timer:
+            result = fn()
+        elapsed.append(timer.elapsed)
+    return result, min(elapsed)
+
+
+def walk_daily(sched, start):
+    """
+    Generates daily schedule times by walking the calendar.
+    """
+    date = sched.calendar.after((start @ sched.tz).date - sched.date_shift)
+    while True:
+        for daytime in sched.daytimes:
+            time = (date + sched.date_shift, daytime) @ sched.tz
+            if start <= time:
+                yield time
+        date = sched.calendar.after(date + 1)
+
+
+def bench_daily(days):
+    start = Time(2020, 1, 1, 0, 0, 0, UTC)
+    stop = start + days * 86400
+    sched = SCHEDULES["daily 4x Mon-Fri"]
+    # Look up the next time every minute, as the scheduler does.
+    starts = [ start + m * 60 for m in range(days * 1440) ]
+
+    old, old_elapsed = best(lambda: [ next(walk_daily(sched, t)) for t in starts ])
+    new, new_elapsed = best(lambda: [ next(sched(t))[0] for t in starts ])
+    assert new == old
+    print(
+        f"{'daily next time':20s} {len(new):8d} times: "
+        f"calendar  {old_elapsed * 1e3:8.2f} ms  "
+        f"table {new_elapsed * 1e3:8.2f} ms"
+    )
+
+
+def main(days):
+    start = Time(2020, 1, 1, 0, 0, 0, UTC)
+    stop = start + days * 86400
+    for name, sched in SCHEDULES.items():
+        old, old_elapsed = best(
+            lambda: list(
+                itertools.takewhile(lambda t: t[0] < stop, sched(start))))
+        new, new_elapsed = best(lambda: sched.times_between(start, stop))
+        assert new == old
+        print(
+            f"{name:20s} {len(new):8d} times: "
+            f"generator {old_elapsed * 1e3:8.2f} ms  "
+            f"batch {new_elapsed * 1e3:8.2f} ms"
+        )
+    bench_daily(days)
+
+
+if __name__ == "__main__":
+    days, = sys.argv[1 :] or (7, )
+    main(int(days))
+
@@ -0,0 +1,69 @@
+"""
+Benchmarks scheduled run queues.
+
+Compares the heap and timing wheel queues for inserting runs, unscheduling
+them, and popping ready runs as the start loop does.
+
+    python test/bench/bench_scheduled.py [NUM_RUNS ...]
+
+"""
+
+from   ora import now
+import random
+import sys
+
+from   apsis.lib.timing import Timer
+from   apsis.runs import Instance, Run
+from   apsis.scheduled import QUEUES
+
+#-------------------------------------------------------------------------------
+
+def bench(queue_type, num):
+    rnd = random.Random(0)
+    start = now()
+    runs = [ Run(Instance("job", {"i": str(i)})) for i in range(num) ]
+    for i, run in enumerate(runs):
+        run.run_id = f"r{i}"
+    # Runs spread over a day.
+    times = [ start + rnd.uniform(0, 86400) for _ in range(num) ]
+    cancel = rnd.sample(runs, num // 2)
+
+    queue = queue_type(1)
+
+    with Timer() as timer:
+        for time, run in zip(times, runs):
+            queue.push(time, run)
+    insert = timer.elapsed
+
+    with Timer() as timer:
+        for run in cancel:
+            queue.remove(run)
+    remove = timer.elapsed
+
+    # Pop ready runs once a second, for a day.
+    count = 0
+    with Timer() as timer:
+        for s in range(86400):
+            count += len(queue.pop(start + s))
+    pop = timer.elapsed
+    assert count == num - len(cancel)
+
+    return insert, remove, pop
+
+
+def main(nums):
+    for num in nums:
+        for name, queue_type in QUEUES.items():
+            insert, remove, pop = bench(queue_type, num)
+            print(
+                f"{num:8d} runs {name:6s}: "
+                f"insert {insert / num * 1e6:6.2f} µs  "
+                f"remove {remove / (num // 2) * 1e6:6.2f} µs  "
+                f"pop {pop:6.3f} s/day"
+            )
+
+
+if __name__ == "__main__":
+    nums = [ int(n) for n in sys.argv[1 :] ] or [10000, 100000, 500000]
+    main(nums)
+
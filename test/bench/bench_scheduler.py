@@ -0,0 +1,89 @@
+"""
+Benchmarks advancing the scheduler horizon.
+
+Builds many daily jobs, then advances the scheduler minute by minute, as the
+scheduler loop does.  The cost of each advance should scale with the number of
+runs produced, not with the number of jobs defined.
+
+    python test/bench/bench_scheduler.py [NUM_JOBS ...]
+
+"""
+
+import asyncio
+import ora
+from   ora import Daytime, UTC
+import random
+import sys
+
+from   apsis.jobs import Job, JobsDir
+from   apsis.lib.timing import Timer
+from   apsis.program import ShellCommandProgram
+from   apsis.schedule import DailySchedule
+from   apsis.scheduler import Scheduler, get_runs_to_schedule
+
+#-------------------------------------------------------------------------------
+
+MINUTES = 60
+
+def make_jobs(num):
+    calendar = ora.get_calendar("all")
+    program = ShellCommandProgram("true")
+    jobs = {}
+    for i in range(num):
+        daytime = Daytime(random.randrange(24), random.randrange(60))
+        schedule = DailySchedule(UTC, calendar, [daytime], {})
+        job_id = f"job{i}"
+        jobs[job_id] = Job(job_id, ["date"], [schedule], program)
+    return JobsDir(None, jobs)
+
+
+def full_scan(jobs, start, stop):
+    """
+    Advances by walking all jobs, as the scheduler did previously.
+    """
+    return sum(
+        1
+        for job in jobs.get_jobs()
+        for _ in get_runs_to_schedule(job, start, stop)
+    )
+
+
+async def main(num_jobs):
+    jobs = make_jobs(num_jobs)
+    start = ora.now()
+
+    count = 0
+    def expect(run):
+        nonlocal count
+        count += 1
+
+    async def schedule(time, run):
+        pass
+
+    with Timer() as timer:
+        scheduler = Scheduler({}, jobs, expect, schedule, start)
+    print(f"{num_jobs:7d} jobs: build {timer.elapsed:.3f} s")
+
+    with Timer() as timer:
+        for m in range(MINUTES):
+            await scheduler.schedule(start + 60 * (m + 1))
+    heap = timer.elapsed
+
+    with Timer() as timer:
+        scan = sum(
+            full_scan(jobs, start + 60 * m, start + 60 * (m + 1))
+            for m in range(MINUTES)
+        )
+    assert scan == count
+
+    print(
+        f"{num_jobs:7d} jobs: {count:5d} runs in {MINUTES} advances: "
+        f"{heap / MINUTES * 1e3:8.3f} ms/advance "
+        f"(full scan {timer.elapsed / MINUTES * 1e3:8.3f} ms/advance)"
+    )
+
+
+if __name__ == "__main__":
+    for num_jobs in [ int(a) for a in sys.argv[1 :] ] or [1000, 10000, 50000]:
+        asyncio.run(main(num_jobs))
+
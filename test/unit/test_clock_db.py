@@ -0,0 +1,86 @@
+import asyncio
+import ora
+import sqlite3
+
+from   apsis.runs import Instance, Run
+from   apsis.scheduled import ScheduledRuns
+from   apsis.sqlite import SqliteDB
+
+#-------------------------------------------------------------------------------
+
+def _read_clock(path):
+    with sqlite3.connect(path) as conn:
+        (time, ), = conn.execute("SELECT time FROM clock")
+    return time + ora.UNIX_EPOCH
+
+
+def _run(run_id):
+    run = Run(Instance("job", {}))
+    run.run_id = run_id
+    run.timestamp = ora.now()
+    return run
+
+
+def test_write_with_run(tmp_path):
+    path = tmp_path / "apsis.db"
+    db = SqliteDB.create(path)
+    time0 = _read_clock(path)
+
+    # Setting the time doesn't write it.
+    time1 = time0 + 100
+    db.clock_db.set_time(time1)
+    assert db.clock_db.get_time() == time1
+    assert db.clock_db.dirty
+    assert _read_clock(path) == time0
+
+    # Writing a run writes the time too.
+    db.run_db.upsert(_run("r1"))
+    assert not db.clock_db.dirty
+    db.flush()
+    assert _read_clock(path) == time1
+
+    time2 = time1 + 100
+    db.clock_db.set_time(time2)
+    db.clock_db.flush()
+    db.flush()
+    assert _read_clock(path) == time2
+    assert SqliteDB.open(path).clock_db.get_time() == time2
+
+
+def test_scheduled_loop(tmp_path):
+    path = tmp_path / "apsis.db"
+    db = SqliteDB.create(path)
+    time0 = _read_clock(path)
+    started = []
+
+    async def start(run):
+        started.append(run)
+        db.run_db.upsert(run)
+
+    scheduled = ScheduledRuns(db.clock_db, start, clock_interval=3600)
+
+    async def go():
+        task = asyncio.ensure_future(scheduled.loop())
+        await asyncio.sleep(0.1)
+        # Idle; the clock isn't written.
+        assert _read_clock(path) == time0
+
+        # Starting a run writes the clock.
+        run = _run("r1")
+        time = ora.now()
+        scheduled.schedule_at(time, run)
+        await asyncio.sleep(1.1)
+        assert started == [run]
+        db.flush()
+        assert _read_clock(path) >= time
+
+        task.cancel()
+        await asyncio.sleep(0)
+
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(go())
+
+    # The clock is written on shut down.
+    db.flush()
+    assert _read_clock(path) == db.clock_db.get_time()
+
@@ -0,0 +1,152 @@
+import itertools
+import ora
+from   ora import Time
+import pytest
+
+from   apsis.crontab import parse_crontab
+from   apsis.schedule import CrontabSchedule, Fields, Schedule
+
+#-------------------------------------------------------------------------------
+
+def scan(sched, start, stop):
+    """
+    Finds scheduled times by checking every minute, as cron does.  A local
+    time that occurs twice matches only the first time.
+    """
+    tz = sched.tz
+    fields = sched.fields
+    time = start
+    seen = set()
+    while time < stop:
+        date, daytime = time @ tz
+        local = date, daytime
+        if fields.match(
+                daytime.minute, daytime.hour, date.day, date.month,
+                date.weekday) and local not in seen:
+            seen.add(local)
+            yield time
+        time += 60
+
+
+def times(sched, start, stop):
+    return [
+        t for t, _ in itertools.takewhile(lambda s: s[0] < stop, sched(start))
+    ]
+
+
+def test_fields():
+    f = Fields("*/15", "9-17", "*", "jan,jul", "mon-fri")
+    assert f.minutes == (0, 15, 30, 45)
+    assert f.hours == tuple(range(9, 18))
+    assert f.months == (1, 7)
+    assert f.weekdays == (1, 2, 3, 4, 5)
+
+    # Both 0 and 7 are Sunday.
+    assert Fields(weekday="7").weekdays == (0, )
+    assert Fields(weekday="5-7").weekdays == (0, 5, 6)
+
+
+def test_fields_range():
+    for fields in (
+            "60 * * * *",
+            "* 0-24 * * *",
+            "* * 0 * *",
+            "* * * 13 *",
+            "* * * * 8",
+            "* * * 5-2 *",
+            "*/0 * * * *",
+    ):
+        with pytest.raises(ValueError):
+            Fields.from_str(fields)
+
+
+def test_day_weekday():
+    # Both restricted: either matches.
+    f = Fields("0", "0", "13", "*", "fri")
+    assert f.match(0, 0, 13, 6, ora.Wed)
+    assert f.match(0, 0, 14, 6, ora.Fri)
+    assert not f.match(0, 0, 14, 6, ora.Thu)
+
+    # Only one restricted: only that one counts.
+    f = Fields("0", "0", "*", "*", "fri")
+    assert f.match(0, 0, 14, 6, ora.Fri)
+    assert not f.match(0, 0, 13, 6, ora.Wed)
+    f = Fields("0", "0", "13", "*", "*")
+    assert f.match(0, 0, 13, 6, ora.Wed)
+    assert not f.match(0, 0, 14, 6, ora.Fri)
+
+
+def test_match_scan():
+    z = "America/New_York"
+    # Spans both DST transitions in 2019.
+    start = Time(2019, 3, 1, 0, 0, 0, z)
+    stop = Time(2019, 11, 15, 0, 0, 0, z)
+    for fields in (
+            "30 2 * * *",
+            "*/20 1-3 * * *",
+            "0 12 1,15 * fri",
+            "15 9 * 3,11 1-5",
+            "0 0 31 * *",
+            "45 23 * * 0",
+    ):
+        sched = CrontabSchedule(z, fields)
+        assert times(sched, start, stop) == list(scan(sched, start, stop)), fields
+        assert [ t for t, _ in sched.times_between(start, stop) ] \
+            == times(sched, start, stop), fields
+
+
+def test_dst():
+    z = "America/New_York"
+    sched = CrontabSchedule(z, "30 1,2 * * *")
+
+    # 02:30 doesn't exist on 2019-03-10.
+    ts = times(sched, Time(2019, 3, 10, 0, 0, 0, z), Time(2019, 3, 11, 0, 0, 0, z))
+    assert ts == [Time(2019, 3, 10, 1, 30, 0, z)]
+
+    # 01:30 occurs twice on 2019-11-03; only the first is scheduled.
+    ts = times(sched, Time(2019, 11, 3, 0, 0, 0, z), Time(2019, 11, 4, 0, 0, 0, z))
+    assert ts == [
+        ora.from_local((ora.Date(2019, 11, 3), ora.Daytime(1, 30, 0)), z),
+        Time(2019, 11, 3, 2, 30, 0, z),
+    ]
+    assert ts[1] - ts[0] == 7200
+
+
+def test_args():
+    sched = CrontabSchedule("UTC", "0 12 * * *", {"foo": "bar"})
+    time, args = next(sched(Time(2019, 6, 1, 13, 0, 0, "UTC")))
+    assert time == Time(2019, 6, 2, 12, 0, 0, "UTC")
+    assert args["date"] == "2019-06-02"
+    assert args["time"] == time
+    assert args["foo"] == "bar"
+
+
+def test_never():
+    sched = CrontabSchedule("UTC", "0 0 30 2 *")
+    assert list(sched(Time(2019, 1, 1, 0, 0, 0, "UTC"))) == []
+    # Only dates up to the stop time are searched.
+    start = Time(2019, 1, 1, 0, 0, 0, "UTC")
+    assert sched.times_between(start, start + 86400) == []
+    dates = sched.fields.dates(ora.Date(2019, 1, 1), ora.Date(2019, 3, 1))
+    assert list(dates) == []
+
+
+def test_jso():
+    sched = CrontabSchedule("America/New_York", "*/5 9-16 * * mon-fri", {"x": "1"})
+    jso = sched.to_jso()
+    assert jso["type"] == "crontab"
+    assert jso["fields"] == "*/5 9-16 * * mon-fri"
+    assert Schedule.from_jso(jso) == sched
+
+
+def test_parse_crontab():
+    env, jobs = parse_crontab("test", [
+        "# comment",
+        "SHELL=/bin/bash",
+        "0 4 * * * /usr/bin/backup",
+        "*/5 * * * * echo hello",
+    ])
+    assert env == {"SHELL": "/bin/bash"}
+    assert [ j.job_id for j in jobs ] == ["test-0", "test-1"]
+    assert isinstance(jobs[0].schedules[0], CrontabSchedule)
+
@@ -0,0 +1,81 @@
+import pytest
+import sqlite3
+import ujson
+
+from   apsis.jobs import Job, job_to_jso
+from   apsis.program import ShellCommandProgram
+from   apsis.schedule import IntervalSchedule
+from   apsis.sqlite import SqliteDB
+
+#-------------------------------------------------------------------------------
+
+def _job(job_id, schedules=()):
+    return Job(
+        job_id, ["time"], schedules, ShellCommandProgram("true"), ad_hoc=True)
+
+
+def test_query():
+    db = SqliteDB.create(path=None).job_db
+    db.insert(_job("adhoc-a"))
+    db.insert(_job("adhoc-b", [IntervalSchedule(60, {})]))
+    db.insert(_job("adhoc-c", [IntervalSchedule(60, {}, enabled=False)]))
+
+    ids = lambda **kw_args: sorted( j.job_id for j in db.query(**kw_args) )
+    assert ids() == ["adhoc-a", "adhoc-b", "adhoc-c"]
+    assert ids(ad_hoc=True) == ["adhoc-a", "adhoc-b", "adhoc-c"]
+    assert ids(ad_hoc=False) == []
+    assert ids(scheduled=True) == ["adhoc-b"]
+    assert ids(scheduled=False) == ["adhoc-a", "adhoc-c"]
+
+
+def test_cache():
+    db = SqliteDB.create(path=None).job_db
+    db.CACHE_SIZE = 2
+    jobs = [ _job(f"adhoc-{i}") for i in range(4) ]
+    for job in jobs:
+        db.insert(job)
+
+    # Recently added jobs are cached.
+    assert db.get("adhoc-3") is jobs[3]
+    assert db.get("adhoc-2") is jobs[2]
+    # Evicted jobs are loaded from the database.
+    job = db.get("adhoc-0")
+    assert job is not jobs[0]
+    assert job.job_id == "adhoc-0"
+    assert db.get("adhoc-0") is job
+
+
+def test_migrate(tmp_path):
+    path = tmp_path / "apsis.db"
+    job = _job("adhoc-old", [IntervalSchedule(60, {})])
+    with sqlite3.connect(path) as conn:
+        conn.execute("CREATE TABLE jobs (job_id VARCHAR NOT NULL, job VARCHAR NOT NULL)")
+        conn.execute(
+            "INSERT INTO jobs VALUES (?, ?)",
+            (job.job_id, ujson.dumps(job_to_jso(job)))
+        )
+
+    SqliteDB.migrate(path)
+    with sqlite3.connect(path) as conn:
+        indexes = { r[1] for r in conn.execute("PRAGMA index_list(jobs)") }
+    assert {"idx_jobs_job_id", "idx_jobs_scheduled"} <= indexes
+
+    db = SqliteDB.open(path).job_db
+    jobs = list(db.query(ad_hoc=True, scheduled=True))
+    assert [ j.job_id for j in jobs ] == ["adhoc-old"]
+
+    with sqlite3.connect(path) as conn:
+        (ad_hoc, scheduled), = conn.execute("SELECT ad_hoc, scheduled FROM jobs")
+    assert ad_hoc == 1 and scheduled == 1
+
+
+def test_migrate_indexes(tmp_path):
+    path = tmp_path / "apsis.db"
+    SqliteDB.create(path).close()
+    with sqlite3.connect(path) as conn:
+        conn.execute("DROP INDEX idx_jobs_scheduled")
+
+    with pytest.raises(RuntimeError):
+        SqliteDB.open(path)
+    SqliteDB.migrate(path)
+    SqliteDB.open(path).close()
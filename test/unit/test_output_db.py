@@ -1,6 +1,11 @@
+import mmap
+from   ora import now
 import pytest
+import threading
 
-from   apsis.sqlite import SqliteDB
+from   apsis.lib import compress
+from   apsis.runs import Instance, Run
+from   apsis.sqlite import SqliteDB, archive_runs, check, compress_outputs
 from   apsis.program import OutputMetadata, Output
 
 #-------------------------------------------------------------------------------
@@ -23,5 +28,198 @@ def test0():
 
     assert db.get_data("r42", "output") == data
 
-    
 
+def test_compression():
+    db = SqliteDB.create(path=None)
+    output_db = db.output_db
+
+    small = b"hello, world"
+    large = b"The quick brown fox jumped over the lazy dogs.\n" * 10000
+    for output_id, data in ("small", small), ("large", large):
+        output_db.add(
+            "r1", output_id, Output(OutputMetadata(output_id, len(data)), data))
+
+    # Small output isn't compressed.
+    assert output_db.get_compressed("r1", "small") == (None, small)
+    compression, compressed = output_db.get_compressed("r1", "large")
+    assert compression == "zlib"
+    assert len(compressed) < len(large) // 10
+
+    assert output_db.get_data("r1", "small") == small
+    assert output_db.get_data("r1", "large") == large
+    assert output_db.get_metadata("r1")["large"].length == len(large)
+
+    # Decompress in chunks.
+    chunks = list(compress.decompress_chunks(compression, compressed, 4096))
+    assert all( len(c) <= 4096 for c in chunks )
+    assert b"".join(chunks) == large
+
+
+def test_compression_writer(tmp_path, monkeypatch):
+    """
+    Checks that outputs are compressed in the writer thread.
+    """
+    threads = []
+    compress_ = compress.compress
+
+    def compress_fn(name, data):
+        threads.append(threading.current_thread())
+        return compress_(name, data)
+
+    monkeypatch.setattr(compress, "compress", compress_fn)
+    db = SqliteDB.create(tmp_path / "apsis.db")
+    data = b"The quick brown fox jumped over the lazy dogs.\n" * 1000
+    db.output_db.add(
+        "r1", "output", Output(OutputMetadata("output", len(data)), data))
+    db.flush()
+    assert len(threads) == 1
+    assert threads[0] is not threading.current_thread()
+    assert db.output_db.get_compressed("r1", "output")[0] == "zlib"
+    assert db.output_db.get_data("r1", "output") == data
+    db.close()
+
+
+def test_compression_registry():
+    class Reverse:
+        def compress(self, data):
+            return data[: : -1][: -1]
+
+        def decompress_chunks(self, data, chunk_size):
+            yield (data + b"x")[: : -1]
+
+    compress.register("reverse", Reverse())
+    try:
+        db = SqliteDB.create(path=None, output_compression="reverse")
+        data = b"x" * 5000
+        db.output_db.add(
+            "r1", "output", Output(OutputMetadata("output", len(data)), data))
+        assert db.output_db.get_compressed("r1", "output")[0] == "reverse"
+        assert db.output_db.get_data("r1", "output") == data
+    finally:
+        del compress.COMPRESSIONS["reverse"]
+
+    with pytest.raises(LookupError):
+        SqliteDB.create(path=None, output_compression="reverse")
+
+
+def test_compress_outputs(tmp_path):
+    path = tmp_path / "apsis.db"
+    db = SqliteDB.create(path, output_compression=None)
+    data = [ str(i).encode() * 10000 for i in range(10) ] + [b"short"]
+    for i, d in enumerate(data):
+        db.output_db.add(
+            f"r{i}", "output", Output(OutputMetadata("output", len(d)), d))
+    db.close()
+
+    db = SqliteDB.open(path)
+    assert db.output_db.get_compressed("r0", "output")[0] is None
+    num, saved = compress_outputs(db, batch_size=3)
+    assert num == 10
+    assert saved > 0
+    for i, d in enumerate(data):
+        compression, _ = db.output_db.get_compressed(f"r{i}", "output")
+        assert compression == (None if d == b"short" else "zlib")
+        assert db.output_db.get_data(f"r{i}", "output") == d
+
+    # Nothing left to compress.
+    assert compress_outputs(db) == (0, 0)
+
+
+def _add_run(db, run_id):
+    run = Run(Instance("job", {}))
+    run.run_id = run.rerun = run_id
+    run._transition(now(), Run.STATE.running)
+    db.run_db.upsert(run)
+
+
+def test_blob_store(tmp_path):
+    db = SqliteDB.create(
+        tmp_path / "apsis.db", output_compression=None,
+        output_dir=tmp_path / "output", output_external_min_size=1024)
+    output_db = db.output_db
+    small = b"hello, world"
+    large = bytes(range(256)) * 64
+    for run_id, data in ("r1", small), ("r2", large), ("r3", large):
+        _add_run(db, run_id)
+        output_db.add(
+            run_id, "output", Output(OutputMetadata("output", len(data)), data))
+    db.close()
+
+    db = SqliteDB.open(tmp_path / "apsis.db", output_dir=tmp_path / "output")
+    output_db = db.output_db
+    assert output_db.get_compressed("r1", "output") == (None, small)
+    # Large outputs are read from the blob store, memory-mapped.
+    compression, data = output_db.get_compressed("r2", "output")
+    assert compression is None
+    assert isinstance(data, mmap.mmap)
+    assert data[:] == large
+    data.close()
+    assert output_db.get_data("r3", "output") == large
+    # Identical outputs share one blob.
+    assert len(list(output_db.blob_store.keys())) == 1
+    check(db)
+    db.close()
+
+    # Without the blob store, large outputs can't be read.
+    db = SqliteDB.open(tmp_path / "apsis.db")
+    assert db.output_db.get_data("r1", "output") == small
+    with pytest.raises(LookupError):
+        db.output_db.get_data("r2", "output")
+
+
+def test_blob_store_writer(tmp_path, monkeypatch):
+    """
+    Checks that blobs are stored in the writer thread, and that output is
+    stored in the DB if that fails.
+    """
+    db = SqliteDB.create(
+        tmp_path / "apsis.db", output_compression=None,
+        output_dir=tmp_path / "output", output_external_min_size=1024)
+    blob_store = db.output_db.blob_store
+    threads = []
+
+    def put(data):
+        threads.append(threading.current_thread())
+        raise OSError("disk full")
+
+    monkeypatch.setattr(blob_store, "put", put)
+    data = b"x" * 2048
+    db.output_db.add("r1", "output", Output(OutputMetadata("output", 2048), data))
+    db.flush()
+    assert len(threads) == 1
+    assert threads[0] is not threading.current_thread()
+    assert db.output_db.get_compressed("r1", "output") == (None, data)
+    db.close()
+
+
+def test_archive_blobs(tmp_path):
+    db = SqliteDB.create(
+        tmp_path / "apsis.db", output_compression=None,
+        output_dir=tmp_path / "output", output_external_min_size=1024)
+    data = [ str(i).encode() * 2000 for i in range(3) ]
+    for i, d in enumerate(data):
+        _add_run(db, f"r{i}")
+        db.output_db.add(
+            f"r{i}", "output", Output(OutputMetadata("output", len(d)), d))
+    db.flush()
+    blob_store = db.output_db.blob_store
+    assert len(list(blob_store.keys())) == 3
+
+    # Without the blob store, archiving fails before copying anything.
+    db.close()
+    db_no_blobs = SqliteDB.open(tmp_path / "apsis.db")
+    archive_db = SqliteDB.create(tmp_path / "archive0.db")
+    with pytest.raises(RuntimeError):
+        archive_runs(db_no_blobs, archive_db, now(), delete=True)
+    assert archive_db.run_db.query() == []
+    db_no_blobs.close()
+
+    db = SqliteDB.open(tmp_path / "apsis.db", output_dir=tmp_path / "output")
+    # Archive to a DB without a blob store; outputs are stored inline.
+    archive_db = SqliteDB.create(tmp_path / "archive.db")
+    archive_runs(db, archive_db, now(), delete=True)
+    for i, d in enumerate(data):
+        assert archive_db.output_db.get_compressed(f"r{i}", "output") \
+            == (None, d)
+    # Archived blobs are removed.
+    assert list(blob_store.keys()) == []
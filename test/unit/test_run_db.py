@@ -0,0 +1,178 @@
+import asyncio
+import ora
+import pytest
+import sqlite3
+
+from   apsis.program import OutputMetadata, Output
+from   apsis.runs import Instance, Run
+from   apsis.sqlite import SqliteDB
+
+#-------------------------------------------------------------------------------
+
+def _run(run_id):
+    run = Run(Instance("job", {"i": run_id}))
+    run.run_id = run_id
+    run.timestamp = ora.now()
+    return run
+
+
+def test_write_behind(tmp_path):
+    path = tmp_path / "apsis.db"
+    db = SqliteDB.create(path)
+    runs = [ _run(f"r{i}") for i in range(1, 101) ]
+    for state in Run.STATE.waiting, Run.STATE.running, Run.STATE.success:
+        for run in runs:
+            run._transition(ora.now(), state)
+            db.run_db.upsert(run)
+            db.run_history_db.insert(run.run_id, ora.now(), state.name)
+
+    data = b"hello, world"
+    db.output_db.add("r1", "output", Output(OutputMetadata("out", 12), data))
+    # Sync reads don't wait for the writer; they see committed writes.
+    db.flush()
+    assert db.output_db.get_data("r1", "output") == data
+    history = list(db.run_history_db.query(run_id="r7"))
+    assert [ h["message"] for h in history ] \
+        == ["waiting", "running", "success"]
+
+    db.close()
+    stats = db.get_stats()
+    assert stats["write_behind"]
+    assert stats["num_pending"] == 0
+    # Runs, history, each run's one arg, output, and the clock.
+    assert stats["num_writes"] == 100 * 3 * 2 + 100 + 1 + 1
+
+    with sqlite3.connect(path) as conn:
+        (mode, ), = conn.execute("PRAGMA journal_mode")
+    assert mode == "wal"
+
+    db = SqliteDB.open(path)
+    loaded = db.run_db.query()
+    assert len(loaded) == 100
+    assert all( r.state == Run.STATE.success for r in loaded )
+    assert db.get_max_run_id_num() == 100
+
+
+def test_inline():
+    db = SqliteDB.create(path=None)
+    num_batches = db.get_stats()["num_batches"]
+    run = _run("r1")
+    run._transition(ora.now(), Run.STATE.running)
+    db.run_db.upsert(run)
+    run._transition(ora.now(), Run.STATE.success)
+    db.run_db.upsert(run)
+    stats = db.get_stats()
+    assert not stats["write_behind"]
+    # Each write is committed separately.
+    assert stats["num_batches"] - num_batches == 2
+    run, = db.run_db.query()
+    assert run.state == Run.STATE.success
+
+
+@pytest.mark.parametrize("memory", [False, True])
+def test_read_async(tmp_path, memory):
+    db = SqliteDB.create(None if memory else tmp_path / "apsis.db")
+    run = _run("r1")
+    for state in Run.STATE.running, Run.STATE.success:
+        run._transition(ora.now(), state)
+        db.run_db.upsert(run)
+    db.run_history_db.insert("r1", ora.now(), "done")
+    data = b"hello, world"
+    db.output_db.add("r1", "output", Output(OutputMetadata("out", 12), data))
+
+    async def go():
+        loaded = await db.run_db.get_async("r1")
+        assert loaded.state == Run.STATE.success
+        with pytest.raises(KeyError):
+            await db.run_db.get_async("r2")
+        runs = await db.run_db.query_async(job_id="job")
+        assert [ r.run_id for r in runs ] == ["r1"]
+        history = await db.run_history_db.query_async(run_id="r1")
+        assert [ h["message"] for h in history ] == ["done"]
+        meta = await db.output_db.get_metadata_async("r1")
+        assert list(meta) == ["output"]
+        assert await db.output_db.get_data_async("r1", "output") == data
+
+    asyncio.new_event_loop().run_until_complete(go())
+    assert db.get_stats()["num_reads"] == 6
+    db.close()
+
+
+def test_query_args(tmp_path):
+    db = SqliteDB.create(tmp_path / "apsis.db")
+    for i in range(10):
+        run = Run(Instance("job", {"i": str(i), "j": str(i % 2)}))
+        run.run_id = f"r{i + 1}"
+        run.timestamp = ora.now()
+        run._transition(ora.now(), Run.STATE.running)
+        if i % 3 == 0:
+            run._transition(ora.now(), Run.STATE.success)
+        db.run_db.upsert(run)
+    db.flush()
+
+    def query(**kw_args):
+        return sorted( r.inst.args["i"] for r in db.run_db.query(**kw_args) )
+
+    assert query(args={"j": "1"}) == ["1", "3", "5", "7", "9"]
+    assert query(args={"i": "4", "j": "0"}) == ["4"]
+    assert query(args={"i": "4", "j": "1"}) == []
+    assert query(state=Run.STATE.success) == ["0", "3", "6", "9"]
+    assert query(job_id="job", state=Run.STATE.success, args={"j": "0"}) \
+        == ["0", "6"]
+
+    # Exists matches args exactly.
+    exists = db.run_db.exists
+    assert exists(job_id="job", args={"i": "3", "j": "1"})
+    assert exists(
+        job_id="job", args={"i": "3", "j": "1"}, state=Run.STATE.success)
+    assert not exists(
+        job_id="job", args={"i": "4", "j": "0"}, state=Run.STATE.success)
+    assert not exists(job_id="job", args={"i": "3"})
+    assert not exists(job_id="job", args={})
+    assert not exists(job_id="other", args={"i": "3", "j": "1"})
+
+
+def test_migrate(tmp_path):
+    # Make a state file with the old runs table.
+    path = tmp_path / "apsis.db"
+    SqliteDB.create(path).close()
+    with sqlite3.connect(path) as conn:
+        conn.execute("DROP TABLE runs")
+        conn.execute("""
+            CREATE TABLE runs (
+                rowid INTEGER NOT NULL PRIMARY KEY, run_id VARCHAR NOT NULL,
+                timestamp FLOAT NOT NULL, job_id VARCHAR NOT NULL,
+                args VARCHAR NOT NULL, state VARCHAR NOT NULL,
+                program VARCHAR, times VARCHAR NOT NULL, meta VARCHAR NOT NULL,
+                message VARCHAR, run_state VARCHAR, rerun VARCHAR,
+                expected BOOLEAN
+            )
+        """)
+        for i, state in enumerate(("success", "failure", "scheduled")):
+            conn.execute(
+                "INSERT INTO runs VALUES (?, ?, ?, ?, ?, ?, NULL, '{}', '{}', "
+                "NULL, 'null', ?, ?)",
+                (i + 1, f"r{i + 1}", 0, "job", f'{{"i": "{i}"}}', state,
+                 f"r{i + 1}", i == 2)
+            )
+
+    with pytest.raises(RuntimeError):
+        SqliteDB.open(path)
+
+    SqliteDB.migrate(path)
+    with sqlite3.connect(path) as conn:
+        indexes = { r[1] for r in conn.execute("PRAGMA index_list(runs)") }
+    assert "idx_runs_job_id_timestamp" in indexes
+    assert "idx_runs_state" in indexes
+    assert "idx_runs_rerun" in indexes
+
+    db = SqliteDB.open(path)
+    # The expected run is gone.
+    runs = { r.run_id: r for r in db.run_db.query() }
+    assert runs.keys() == {"r1", "r2"}
+    assert runs["r1"].state == Run.STATE.success
+    assert runs["r2"].state == Run.STATE.failure
+    run, = db.run_db.query(args={"i": "1"})
+    assert run.run_id == "r2"
+
+
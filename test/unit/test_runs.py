@@ -1,4 +1,13 @@
-from   apsis.runs import Instance
+import asyncio
+import itertools
+from   ora import now
+import pytest
+import random
+import time
+
+from   apsis.lib.py import iterize
+from   apsis.runs import Instance, Run, RunStore, ExpectedRun
+from   apsis.sqlite import SqliteDB
 
 #-------------------------------------------------------------------------------
 
@@ -8,3 +17,218 @@ def test_instance_args_sort():
     assert tuple(i.args.values()) == ("17", "0", "42")
 
 
+def test_instance_shared():
+    i0 = Instance("test_job_id", {"foo": 42, "bar": "17"})
+    i1 = Instance("".join(["test_", "job_id"]), {"bar": 17, "foo": "42"})
+    assert i0 == i1
+    assert hash(i0) == hash(i1)
+    # Job IDs and args are interned.
+    assert i0.job_id is i1.job_id
+    assert all( a is b for a, b in zip(i0.args.values(), i1.args.values()) )
+
+    run = Run(i0)
+    assert not hasattr(run, "__dict__")
+    with pytest.raises(AttributeError):
+        run.foo = 42
+
+
+def test_run_store_query():
+    """
+    Checks indexed queries against a scan of all runs.
+    """
+    rnd = random.Random(0)
+    run_store = RunStore(SqliteDB.create(path=None), min_timestamp=None)
+    start = now()
+    for i in range(50):
+        inst = Instance(f"job{i % 3}", {"i": str(i % 7)})
+        run_store.add_expected(ExpectedRun(inst, start + i))
+    for i in range(50):
+        run = Run(Instance(f"job{i % 3}", {"i": str(i % 7)}))
+        run_store.add(run)
+        for state in rnd.choice([
+                [Run.STATE.scheduled],
+                [Run.STATE.waiting, Run.STATE.running],
+                [Run.STATE.running, Run.STATE.success],
+        ]):
+            run._transition(now(), state)
+            run_store.update(run, now())
+    # Rerun some failed runs.
+    for i in range(10):
+        run = Run(Instance(f"job{i % 3}", {"i": "rerun"}))
+        run_store.add(run)
+        for j in range(i % 3):
+            run._transition(now(), Run.STATE.running)
+            run_store.update(run, now())
+            run._transition(now(), Run.STATE.failure)
+            run_store.update(run, now())
+            run = Run(run.inst, rerun=run.rerun)
+            run_store.add(run)
+        run._transition(now(), Run.STATE.running)
+        run_store.update(run, now())
+
+    # Promote and remove some expected runs.
+    _, expected = run_store.query(job_id="job1", state=Run.STATE.scheduled)
+    for run in expected[: 5]:
+        if run.expected:
+            run_store.remove(run.run_id)
+    _, expected = run_store.query(job_id="job2", state=Run.STATE.scheduled)
+    for run in expected[: 5]:
+        if isinstance(run, ExpectedRun):
+            run = run_store.promote(run)
+            run._transition(now(), Run.STATE.scheduled)
+            run_store.update(run, now())
+
+    _, all_runs = run_store.query()
+    latest = {}
+    for run in all_runs:
+        group = latest.setdefault(run.rerun, run)
+        if max(run.times.values()) > max(group.times.values()):
+            latest[run.rerun] = run
+    assert len(latest) < len(all_runs)
+
+    mid = sorted( r.timestamp for r in all_runs )[len(all_runs) // 2]
+    rerun_group = next( r for r in all_runs if r.run_id != r.rerun ).rerun
+    for job_id, state, rerun, since, reruns in itertools.product(
+            [None, "job0", "job2", "job9"],
+            [None, Run.STATE.scheduled, Run.STATE.running,
+             (Run.STATE.failure, Run.STATE.running)],
+            [None, all_runs[60].rerun, rerun_group],
+            [None, mid],
+            [True, False],
+    ):
+        _, runs = run_store.query(
+            job_id=job_id, state=state, rerun=rerun, since=since,
+            reruns=reruns)
+        states = None if state is None else set(iterize(state))
+        expected = [
+            r for r in all_runs
+            if (reruns or latest[r.rerun] is r)
+            and (job_id is None or r.inst.job_id == job_id)
+            and (states is None or r.state in states)
+            and (rerun is None or r.rerun == rerun)
+            and (since is None or r.timestamp >= since)
+        ]
+        assert sorted( r.run_id for r in runs ) \
+            == sorted( r.run_id for r in expected )
+
+
+def test_run_store_evict(monkeypatch):
+    monkeypatch.setattr(RunStore, "EVICT_INTERVAL", 0)
+    run_store = RunStore(
+        SqliteDB.create(path=None), min_timestamp=None, max_age=0.05,
+        cache_size=2)
+
+    def add(job_id, states):
+        run = Run(Instance(job_id, {}))
+        run_store.add(run)
+        for state in states:
+            run._transition(now(), state)
+            run_store.update(run, now())
+        return run
+
+    done = [
+        add("job", [Run.STATE.running, Run.STATE.success]) for _ in range(4) ]
+    running = add("job", [Run.STATE.running])
+    time.sleep(0.1)
+    # An update triggers eviction.
+    other = add("other", [Run.STATE.running, Run.STATE.failure])
+
+    stats = run_store.get_stats()
+    assert stats["num_evicted"] == 4
+    assert stats["num_runs"] == 2
+
+    # Unnarrowed queries include only runs in memory.
+    _, runs = run_store.query()
+    assert { r.run_id for r in runs } == {running.run_id, other.run_id}
+    _, runs = run_store.query(state=Run.STATE.running)
+    assert [ r.run_id for r in runs ] == [running.run_id]
+
+    # Sync reads don't fetch evicted runs.
+    with pytest.raises(KeyError):
+        run_store.get(done[0].run_id)
+    _, runs = run_store.query(job_id="job")
+    assert [ r.run_id for r in runs ] == [running.run_id]
+
+    # Async reads fetch evicted runs on demand.
+    async def go():
+        _, run = await run_store.get_async(done[0].run_id)
+        assert run.run_id == done[0].run_id
+        assert run.state == Run.STATE.success
+        _, again = await run_store.get_async(done[0].run_id)
+        assert again is run
+        # Once cached, sync reads return it too.
+        _, again = run_store.get(done[0].run_id)
+        assert again is run
+
+        _, runs = await run_store.query_async(job_id="job")
+        assert { r.run_id for r in runs } \
+            == { r.run_id for r in done } | {running.run_id}
+        _, runs = await run_store.query_async(
+            run_ids=[done[1].run_id, other.run_id])
+        assert [ r.run_id for r in runs ] == [done[1].run_id, other.run_id]
+        _, runs = await run_store.query_async(
+            rerun=done[2].rerun, state=Run.STATE.success)
+        assert [ r.run_id for r in runs ] == [done[2].run_id]
+
+        stats = run_store.get_stats()
+        assert stats["num_cached"] == 2
+        assert stats["num_cache_hits"] >= 1
+        with pytest.raises(KeyError):
+            await run_store.get_async("r999")
+
+    asyncio.new_event_loop().run_until_complete(go())
+
+
+
+
+def test_live_coalesce():
+    run_store = RunStore(SqliteDB.create(path=None), min_timestamp=None)
+    runs = [ Run(Instance("job", {"i": str(i)})) for i in range(3) ]
+    for run in runs:
+        run_store.add(run)
+
+    async def go():
+        with run_store.subscribe() as queue:
+            # Many changes to a few runs.
+            for _ in range(10):
+                for run in runs:
+                    run_store.update(run, now())
+            assert len(queue) == 3
+            when, changed = await queue.get()
+            assert changed == runs
+            assert len(queue) == 0
+
+            asyncio.get_event_loop().call_later(
+                0.01, run_store.update, runs[1], now())
+            _, changed = await queue.get()
+            assert changed == [runs[1]]
+
+            await run_store.shut_down()
+            assert await queue.get() is None
+
+    asyncio.new_event_loop().run_until_complete(go())
+    assert run_store.get_stats()["num_subscribers"] == 0
+
+
+def test_live_resync():
+    run_store = RunStore(SqliteDB.create(path=None), min_timestamp=None)
+
+    async def go():
+        with run_store.subscribe(max_size=10) as queue, \
+             run_store.subscribe() as other:
+            runs = [ Run(Instance("job", {"i": str(i)})) for i in range(20) ]
+            for run in runs:
+                run_store.add(run)
+            # The slow subscriber is told to resync, once.
+            assert await queue.get() is queue.RESYNC
+            assert len(queue) == 0
+            # Later changes are delivered as usual.
+            run_store.update(runs[0], now())
+            _, changed = await queue.get()
+            assert changed == [runs[0]]
+            # The other subscriber is unaffected.
+            _, changed = await other.get()
+            assert len(changed) == 20
+
+    asyncio.new_event_loop().run_until_complete(go())
+    assert run_store.get_stats()["num_resyncs"] == 1
@@ -1,7 +1,9 @@
+import itertools
 import ora
 from   ora import Date, Time, Daytime, UTC
 
-from   apsis.schedule import DailySchedule, IntervalSchedule
+from   apsis.schedule import DailySchedule, ExplicitSchedule, IntervalSchedule
+from   apsis.schedule import Schedule
 
 #-------------------------------------------------------------------------------
 
@@ -157,3 +159,135 @@ def test_interval_schedule_eq():
     assert s0 != s5
 
 
+
+
+def _check_times_between(sched, start, stop):
+    times = list(itertools.takewhile(lambda t: t[0] < stop, sched(start)))
+    assert sched.times_between(start, stop) == times
+    return times
+
+
+def test_interval_times_between():
+    sched = IntervalSchedule(600, {"foo": "bar"}, phase=120)
+    date = Date(2019, 11, 13)
+    start = (date, Daytime(7, 33)) @ UTC
+    times = _check_times_between(sched, start, start + 3600)
+    assert [ t for t, _ in times ] == [
+        (date, Daytime(h, m)) @ UTC
+        for h, m in ((7, 42), (7, 52), (8, 2), (8, 12), (8, 22), (8, 32))
+    ]
+
+    # Start and stop on schedule times.
+    start = (date, Daytime(7, 42)) @ UTC
+    times = _check_times_between(sched, start, start + 1200)
+    assert len(times) == 2
+
+    assert sched.times_between(start, start) == []
+    assert sched.times_between(start + 1, start + 600) == []
+
+
+def test_daily_times_between():
+    z = "America/New_York"
+    sched = DailySchedule(
+        z,
+        ora.get_calendar("Mon,Wed-Fri"),
+        ["9:30:00", "16:00:00"],
+        {"foo": "bar"},
+        date_shift=-1,
+    )
+    start = Time(2019, 1, 10, 12, 0, 0, z)
+    for stop in (
+            start,
+            Time(2019, 1, 10, 16, 0, 0, z),
+            Time(2019, 1, 10, 16, 0, 1, z),
+            Time(2019, 1, 13, 16, 0, 0, z),
+            # Across a DST transition.
+            Time(2019, 3, 31, 0, 0, 0, z),
+    ):
+        _check_times_between(sched, start, stop)
+
+    times = sched.times_between(start, Time(2019, 1, 14, 0, 0, 0, z))
+    assert [ t for t, _ in times ] == [
+        Time(2019, 1, 10, 16, 0, 0, z),
+        Time(2019, 1, 13,  9, 30, 0, z),
+        Time(2019, 1, 13, 16, 0, 0, z),
+    ]
+    assert times[1][1]["date"] == "2019-01-14"
+
+
+def test_explicit_times_between():
+    times = [ Time(2019, 1, d, 12, 0, 0, UTC) for d in (1, 3, 5, 7) ]
+    sched = ExplicitSchedule(times)
+    _check_times_between(sched, times[0], times[3])
+    assert [ t for t, _ in sched.times_between(times[0], times[3]) ] == times[: 3]
+    assert [ t for t, _ in sched.times_between(times[0] + 1, times[3] + 1) ] \
+        == times[1 :]
+
+
+
+def _daily_reference(sched, start, stop):
+    """
+    Computes daily schedule times directly from the calendar.
+    """
+    date = (start @ sched.tz).date - sched.date_shift - 1
+    times = []
+    while True:
+        date = sched.calendar.after(date + 1)
+        for daytime in sched.daytimes:
+            time = (date + sched.date_shift, daytime) @ sched.tz
+            if stop <= time:
+                return times
+            if start <= time:
+                times.append(time)
+
+
+def test_daily_table():
+    z = "Asia/Tokyo"
+    sched = DailySchedule(
+        z, ora.get_calendar("Tue,Thu"), ["8:00:00", "23:15:00"], {},
+        date_shift=1)
+    start = Time(2020, 1, 1, 0, 0, 0, z)
+
+    # Spans several table windows, and moves backward.
+    for a, b in ((0, 30), (0, 3000), (2900, 4000), (10, 20), (-400, -300)):
+        t0 = start + a * 86400
+        t1 = start + b * 86400
+        times = [ t for t, _ in sched.times_between(t0, t1) ]
+        assert times == _daily_reference(sched, t0, t1)
+
+
+def test_daily_table_shared():
+    jso = {
+        "type": "daily", "tz": "UTC", "calendar": "Mon-Fri",
+        "daytime": "9:30:00",
+    }
+    s0 = Schedule.from_jso({**jso, "args": {"x": "1"}})
+    s1 = Schedule.from_jso({**jso, "args": {"x": "2"}})
+    s2 = DailySchedule(UTC, s0.calendar, ["9:30:00"], {}, date_shift=1)
+    assert s0._DailySchedule__table is s1._DailySchedule__table
+    assert s0._DailySchedule__table is not s2._DailySchedule__table
+
+    # Distinct calendars with the same name and range don't share a table.
+    rng = (Date(2020, 1, 1), Date(2021, 1, 1))
+    c0 = ora.make_weekday_calendar(rng, [ora.Mon])
+    c1 = ora.make_weekday_calendar(rng, [ora.Tue])
+    c0.name = c1.name = "cal"
+    assert repr(c0) == repr(c1)
+    s3 = DailySchedule(UTC, c0, ["9:30:00"], {})
+    s4 = DailySchedule(UTC, c1, ["9:30:00"], {})
+    assert s3._DailySchedule__table is not s4._DailySchedule__table
+
+    start = Time(2020, 1, 1, 0, 0, 0, UTC)
+    (t0, a0), = s0.times_between(start, start + 86400)
+    (t1, a1), = s1.times_between(start, start + 86400)
+    assert t0 == t1
+    assert a0["x"] == "1"
+    assert a1["x"] == "2"
+
+
+def test_daily_calendar_end():
+    cal = ora.make_weekday_calendar((Date(2020, 1, 1), Date(2020, 2, 1)), [ora.Mon])
+    sched = DailySchedule(UTC, cal, ["12:00:00"], {})
+    times = [ t for t, _ in sched(Time(2020, 1, 1, 0, 0, 0, UTC)) ]
+    assert [ (t @ UTC).date for t in times ] == [
+        Date(2020, 1, d) for d in (6, 13, 20, 27) ]
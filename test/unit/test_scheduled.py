@@ -0,0 +1,190 @@
+import asyncio
+from   ora import now
+import pytest
+import random
+
+from   apsis.runs import Instance, Run
+from   apsis.scheduled import ScheduledRuns, HeapQueue, WheelQueue
+from   apsis.sqlite import SqliteDB
+
+#-------------------------------------------------------------------------------
+
+def _scheduled(queue="heap"):
+    started = []
+
+    async def start(run):
+        started.append(run)
+
+    clock_db = SqliteDB.create(path=None).clock_db
+    return ScheduledRuns(clock_db, start, queue=queue), started
+
+
+def _runs(num):
+    runs = [ Run(Instance("job", {"i": str(i)})) for i in range(num) ]
+    for i, run in enumerate(runs):
+        run.run_id = f"r{i}"
+    return runs
+
+
+def test_compact():
+    scheduled, _ = _scheduled()
+    time = now() + 3600
+    runs = _runs(1000)
+    for i, run in enumerate(runs):
+        scheduled.schedule_at(time + i, run)
+    assert len(scheduled) == 1000
+
+    # Repeatedly unschedule and reschedule, as reloading jobs does.
+    for _ in range(10):
+        for run in runs:
+            assert scheduled.unschedule(run)
+        runs = _runs(1000)
+        for i, run in enumerate(runs):
+            scheduled.schedule_at(time + i, run)
+
+        stats = scheduled.get_stats()
+        assert stats["num_scheduled"] == 1000
+        assert stats["heap_size"] == 1000 + stats["num_dead"]
+        assert stats["num_dead"] <= 1000
+
+    assert scheduled.get_stats()["num_compact"] > 0
+    other = Run(Instance("job", {}))
+    other.run_id = "other"
+    assert not scheduled.unschedule(other)
+
+
+@pytest.mark.parametrize("queue", ["heap", "wheel"])
+def test_start_after_unschedule(queue):
+    scheduled, started = _scheduled(queue)
+    time = now() - 1
+    runs = _runs(200)
+    for run in runs:
+        scheduled.schedule_at(time, run)
+    for run in runs[: 150]:
+        scheduled.unschedule(run)
+
+    async def go():
+        task = asyncio.ensure_future(scheduled.loop())
+        await asyncio.sleep(0.1)
+        task.cancel()
+
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(go())
+    assert sorted( r.inst.args["i"] for r in started ) \
+        == sorted( r.inst.args["i"] for r in runs[150 :] )
+    assert len(scheduled) == 0
+    assert scheduled.get_stats()["queue"] == queue
+
+
+@pytest.mark.parametrize("queue_type", [HeapQueue, WheelQueue])
+def test_queue(queue_type):
+    """
+    Checks a queue against a simple reference, over several days.
+    """
+    rnd = random.Random(42)
+    start = now()
+    queue = queue_type(1)
+    expected = {}
+
+    runs = _runs(2000)
+    for run in runs:
+        # Times from the recent past to a few days out.
+        time = start + rnd.uniform(-10, 3 * 86400)
+        queue.push(time, run)
+        expected[run] = time
+    for run in rnd.sample(runs, 500):
+        assert queue.remove(run)
+        assert not queue.remove(run)
+        del expected[run]
+    assert len(queue) == len(expected)
+
+    # Pop in irregular steps, up to a few seconds at a time, then in large
+    # jumps.
+    time = start
+    steps = [ rnd.uniform(0, 5) for _ in range(1000) ] \
+          + [ rnd.uniform(0, 20000) for _ in range(100) ]
+    for step in steps:
+        time += step
+        ready = queue.pop(time)
+        assert len(ready) == len(set( r for _, r in ready ))
+        for sched_time, run in ready:
+            assert expected.pop(run) == sched_time <= time
+        assert all( t > time for t in expected.values() )
+        assert len(queue) == len(expected)
+
+        # The queue wakes up at or before the next schedule time.
+        wake_time = queue.wake_time(time + 1)
+        next_time = min(expected.values(), default=None)
+        if next_time is not None and next_time < time + 1:
+            assert wake_time is not None
+        if wake_time is not None:
+            assert wake_time < time + 1
+            assert next_time is not None and wake_time <= next_time
+
+    assert len(expected) == 0
+
+
+@pytest.mark.parametrize("queue", ["heap", "wheel"])
+def test_rearm(queue):
+    """
+    Checks that a run scheduled while the loop sleeps starts promptly.
+    """
+    scheduled, started = _scheduled(queue)
+    run, = _runs(1)
+    start_times = []
+
+    async def go():
+        task = asyncio.ensure_future(scheduled.loop())
+        # Let the loop go to sleep.
+        await asyncio.sleep(0.1)
+        sched_time = now() + 0.2
+        scheduled.schedule_at(sched_time, run)
+        while len(started) == 0:
+            await asyncio.sleep(0.001)
+        start_times.append(now() - sched_time)
+        task.cancel()
+
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(go())
+    assert started == [run]
+    assert 0 <= start_times[0] < 0.05
+
+    stats = scheduled.get_stats()
+    assert stats["num_rearm"] >= 1
+    assert stats["late"]["count"] == 1
+    # The loop doesn't poll while idle.
+    assert stats["num_wakeups"] < 5
+
+
+def test_start_batch():
+    """
+    Checks that many ready runs start in bounded batches.
+    """
+    in_flight = [0, 0]
+
+    async def start(run):
+        in_flight[0] += 1
+        in_flight[1] = max(in_flight)
+        await asyncio.sleep(0.001)
+        in_flight[0] -= 1
+        started.append(run)
+
+    started = []
+    clock_db = SqliteDB.create(path=None).clock_db
+    scheduled = ScheduledRuns(clock_db, start)
+    time = now() - 1
+    runs = _runs(1000)
+    for run in runs:
+        scheduled.schedule_at(time, run)
+
+    async def go():
+        task = asyncio.ensure_future(scheduled.loop())
+        while len(started) < len(runs):
+            await asyncio.sleep(0.01)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.new_event_loop().run_until_complete(go())
+    assert sorted(started, key=lambda r: r.run_id) \
+        == sorted(runs, key=lambda r: r.run_id)
+    assert in_flight[1] == ScheduledRuns.START_BATCH
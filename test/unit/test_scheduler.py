@@ -0,0 +1,105 @@
+import asyncio
+import ora
+from   ora import Time, UTC
+
+from   apsis.jobs import Job, JobsDir
+from   apsis.program import ShellCommandProgram
+from   apsis.runs import ExpectedRun, Instance
+from   apsis.schedule import DailySchedule, IntervalSchedule
+from   apsis.scheduler import Scheduler, get_next_time
+
+#-------------------------------------------------------------------------------
+
+def _make_jobs():
+    calendar = ora.get_calendar("all")
+    program = ShellCommandProgram("true")
+    return JobsDir(None, {
+        "daily": Job(
+            "daily", ["date"],
+            [DailySchedule(UTC, calendar, ["12:00:00"], {})], program),
+        "interval": Job(
+            "interval", ["time"], [IntervalSchedule(3600, {})], program),
+        "disabled": Job(
+            "disabled", ["time"],
+            [IntervalSchedule(60, {}, enabled=False)], program),
+        "none": Job("none", [], [], program),
+    })
+
+
+def test_get_next_time():
+    jobs = _make_jobs()
+    start = Time(2020, 3, 1, 10, 30, 0, UTC)
+    assert get_next_time(jobs.get_job("daily"), start) == Time(2020, 3, 1, 12, 0, 0, UTC)
+    assert get_next_time(jobs.get_job("interval"), start) == Time(2020, 3, 1, 11, 0, 0, UTC)
+    assert get_next_time(jobs.get_job("disabled"), start) is None
+    assert get_next_time(jobs.get_job("none"), start) is None
+
+
+def test_schedule_incremental():
+    jobs = _make_jobs()
+    start = Time(2020, 3, 1, 10, 30, 0, UTC)
+    scheduled = []
+
+    def expect(run):
+        scheduled.append((run.time, run.inst.job_id))
+
+    async def schedule(time, run):
+        assert False
+
+    async def advance(hours):
+        await scheduler.schedule(start + hours * 3600)
+
+    scheduler = Scheduler({}, jobs, expect, schedule, start)
+    loop = asyncio.new_event_loop()
+
+    loop.run_until_complete(advance(1))
+    assert scheduled == [(Time(2020, 3, 1, 11, 0, 0, UTC), "interval")]
+
+    loop.run_until_complete(advance(2))
+    assert scheduled[1 :] == [
+        (Time(2020, 3, 1, 12, 0, 0, UTC), "daily"),
+        (Time(2020, 3, 1, 12, 0, 0, UTC), "interval"),
+    ]
+
+    # Advancing to the same time schedules nothing new.
+    loop.run_until_complete(advance(2))
+    assert len(scheduled) == 3
+
+    loop.run_until_complete(advance(26))
+    assert sum( 1 for _, j in scheduled if j == "daily" ) == 2
+    assert sum( 1 for _, j in scheduled if j == "interval" ) == 26
+    assert scheduler.get_scheduler_time() == start + 26 * 3600
+
+
+
+def test_promote():
+    jobs = _make_jobs()
+    start = Time(2020, 3, 1, 10, 30, 0, UTC)
+    expected = []
+    promoted = []
+
+    async def schedule(time, run):
+        assert time == run.time
+        promoted.append(run)
+
+    scheduler = Scheduler({}, jobs, expected.append, schedule, start)
+    loop = asyncio.new_event_loop()
+
+    loop.run_until_complete(scheduler.schedule(start + 4 * 3600))
+    assert len(expected) == 5
+    assert len(promoted) == 0
+
+    # Promote runs before 12:30.
+    loop.run_until_complete(scheduler.promote(start + 2 * 3600))
+    assert sorted( (r.time, r.inst.job_id) for r in promoted ) == [
+        (Time(2020, 3, 1, 11, 0, 0, UTC), "interval"),
+        (Time(2020, 3, 1, 12, 0, 0, UTC), "daily"),
+        (Time(2020, 3, 1, 12, 0, 0, UTC), "interval"),
+    ]
+
+    # An expected run before the promote time is promoted immediately.
+    time = Time(2020, 3, 1, 12, 15, 0, UTC)
+    run = ExpectedRun(Instance("interval", {}), time)
+    loop.run_until_complete(scheduler.expect(time, run))
+    assert expected[-1] is run
+    assert promoted[-1] is run
@@ -0,0 +1,167 @@
+import asyncio
+from   ora import now
+
+from   apsis.program import AgentShellProgram
+from   apsis.runs import Instance, Run
+from   apsis.starter import Starter
+
+#-------------------------------------------------------------------------------
+
+def _runs(num, host=None, job_id="job", priority=None):
+    runs = []
+    for i in range(num):
+        run = Run(Instance(job_id, {"i": str(i)}))
+        run.run_id = f"r{host}{job_id}{i}"
+        if priority is not None:
+            run.meta["priority"] = priority
+        run.program = AgentShellProgram("true", host=host)
+        run.times = {"schedule": now()}
+        run.state = Run.STATE.waiting
+        runs.append(run)
+    return runs
+
+
+def _run_starter(cfg, runs, duration=0.05):
+    started = []
+    running = {}
+    max_running = {}
+
+    async def start(run):
+        host = run.program.host
+        for key in (host, "total"):
+            running[key] = running.get(key, 0) + 1
+            max_running[key] = max(max_running.get(key, 0), running[key])
+        await asyncio.sleep(duration)
+        for key in (host, "total"):
+            running[key] -= 1
+        started.append(run)
+
+    async def go():
+        starter = Starter(start, cfg)
+        task = asyncio.ensure_future(starter.loop())
+        await asyncio.gather(*( starter.start(r) for r in runs ))
+        while len(started) < len(runs):
+            await asyncio.sleep(0.01)
+        task.cancel()
+        return starter.get_stats()
+
+    loop = asyncio.new_event_loop()
+    stats = loop.run_until_complete(go())
+    return started, max_running, stats
+
+
+def test_unlimited():
+    runs = _runs(20)
+    started, max_running, stats = _run_starter({}, runs)
+    assert sorted( r.run_id for r in started ) == sorted( r.run_id for r in runs )
+    assert max_running[None] == 20
+    assert stats["num_started"] == 20
+    assert stats["late"]["count"] == 20
+
+
+def test_max_concurrent():
+    runs = _runs(20) + _runs(20, "grp")
+    cfg = {
+        "max_concurrent": "6",
+        "host_groups": {"grp": {"max_concurrent": "2"}},
+    }
+    started, max_running, stats = _run_starter(cfg, runs)
+    assert len(started) == 40
+    assert max_running["grp"] <= 2
+    assert max_running["total"] == 6
+    assert stats["num_queued"] == 0
+    assert stats["num_starting"] == 0
+    assert stats["queue_wait"]["count"] == 40
+
+
+def test_max_rate():
+    runs = _runs(30)
+    start = now()
+    started, _, _ = _run_starter({"max_rate": "100"}, runs, duration=0)
+    # 100 in a burst, then 100 per second.
+    assert len(started) == 30
+    assert now() - start < 0.5
+
+    runs = _runs(15, "grp")
+    start = now()
+    started, _, _ = _run_starter(
+        {"host_groups": {"grp": {"max_rate": "10"}}}, runs, duration=0)
+    # A burst of 10, then 5 more at 10 per second.
+    assert len(started) == 15
+    assert 0.4 < now() - start < 1.0
+
+
+def test_skip_not_waiting():
+    runs = _runs(4)
+    runs[1].state = Run.STATE.error
+    started = []
+
+    async def start(run):
+        started.append(run)
+
+    async def go():
+        starter = Starter(start, {"max_concurrent": "1"})
+        task = asyncio.ensure_future(starter.loop())
+        for run in runs:
+            await starter.start(run)
+        await asyncio.sleep(0.1)
+        task.cancel()
+
+    asyncio.new_event_loop().run_until_complete(go())
+    assert [ r.run_id for r in started ] == [ runs[i].run_id for i in (0, 2, 3) ]
+
+
+def test_priority_fair():
+    big = _runs(20, job_id="big")
+    small = _runs(3, job_id="small")
+    urgent = _runs(2, job_id="urgent", priority=5)
+    started = []
+
+    async def start(run):
+        started.append(run)
+
+    async def go():
+        starter = Starter(start, {"max_concurrent": "1"})
+        task = asyncio.ensure_future(starter.loop())
+        for run in big + small + urgent:
+            await starter.start(run)
+        stats = starter.get_stats()
+        assert stats["num_queued_by_priority"] == {"0": 23, "5": 2}
+        await asyncio.sleep(0.1)
+        task.cancel()
+        return starter.get_stats()
+
+    stats = asyncio.new_event_loop().run_until_complete(go())
+    # Higher priority first, then jobs take turns.
+    assert started[: 8] == urgent + [
+        big[0], small[0], big[1], small[1], big[2], small[2]]
+    assert started[8 :] == big[3 :]
+    assert stats["num_queued_by_priority"] == {}
+
+
+def test_weight():
+    heavy = _runs(10, job_id="heavy")
+    for run in heavy:
+        run.meta["weight"] = 2
+    light = _runs(10, job_id="light")
+    started = []
+
+    async def start(run):
+        started.append(run)
+
+    async def go():
+        starter = Starter(start, {"max_concurrent": "1"})
+        task = asyncio.ensure_future(starter.loop())
+        for run in heavy + light:
+            await starter.start(run)
+        await asyncio.sleep(0.1)
+        task.cancel()
+
+    asyncio.new_event_loop().run_until_complete(go())
+    # The heavy job gets two starts for each of the light job's.
+    assert started[: 9] == [
+        heavy[0], heavy[1], light[0],
+        heavy[2], heavy[3], light[1],
+        heavy[4], heavy[5], light[2],
+    ]
+    assert started[15 :] == light[5 :]
@@ -0,0 +1,383 @@
+import asyncio
+from   ora import now
+import time
+
+from   apsis.cond.dependency import Dependency
+from   apsis.cond.max_running import MaxRunning
+from   apsis.history import RunHistory
+from   apsis.runs import Instance, Run, RunStore
+from   apsis.sqlite import SqliteDB
+from   apsis.starter import Starter
+from   apsis.waiter import Waiter
+
+#-------------------------------------------------------------------------------
+
+def _setup(transition=False):
+    db = SqliteDB.create(path=None)
+    run_store = RunStore(db, min_timestamp=None)
+    started = []
+
+    async def start(run):
+        started.append(run)
+        if transition:
+            run._transition(now(), Run.STATE.running)
+            run_store.update(run, now())
+
+    waiter = Waiter(run_store, start, RunHistory(db.run_history_db))
+    return run_store, waiter, started
+
+
+def _add(run_store, job_id, args, state, conds=()):
+    run = Run(Instance(job_id, args))
+    run.conds = list(conds)
+    run_store.add(run)
+    run._transition(now(), state)
+    run_store.update(run, now())
+    return run
+
+
+def test_dependency_wakeup():
+    """
+    Checks that a waiting run is started when its dependency succeeds, and
+    only affected runs are rechecked.
+    """
+    run_store, waiter, started = _setup()
+    dep = _add(run_store, "dep", {"i": "0"}, Run.STATE.scheduled)
+    run = _add(
+        run_store, "job", {"i": "0"}, Run.STATE.waiting,
+        [Dependency("dep", {"i": "0"})]
+    )
+    others = [
+        _add(
+            run_store, "job", {"i": str(i)}, Run.STATE.waiting,
+            [Dependency("other", {"i": str(i)})]
+        )
+        for i in range(100)
+    ]
+
+    async def go():
+        task = asyncio.ensure_future(waiter.loop())
+        await waiter.start(run)
+        for other in others:
+            await waiter.start(other)
+        await asyncio.sleep(0.01)
+        assert started == []
+        num_checks = waiter.get_stats()["num_checks"]
+
+        # Unrelated transitions don't recheck anything.
+        _add(run_store, "unrelated", {}, Run.STATE.scheduled)
+        await asyncio.sleep(0.01)
+        assert waiter.get_stats()["num_checks"] == num_checks
+
+        dep._transition(now(), Run.STATE.waiting)
+        run_store.update(dep, now())
+        dep._transition(now(), Run.STATE.running)
+        run_store.update(dep, now())
+        dep._transition(now(), Run.STATE.success)
+        run_store.update(dep, now())
+        await asyncio.sleep(0.01)
+        task.cancel()
+        await task
+
+    asyncio.new_event_loop().run_until_complete(go())
+    assert started == [run]
+    stats = waiter.get_stats()
+    assert stats["num_waiting"] == 100
+    assert stats["num_sweeps"] == 0
+    # Only the one run waiting on "dep" was rechecked.
+    assert stats["num_checks"] <= 101 + 4
+
+
+def test_sweep():
+    """
+    Checks that the periodic sweep catches changes without notification.
+    """
+    run_store, waiter, started = _setup()
+    waiter.SWEEP_INTERVAL = 0.05
+    run = _add(
+        run_store, "job", {}, Run.STATE.waiting, [Dependency("dep", {})])
+
+    async def go():
+        await waiter.start(run)
+        # The dependency succeeds before the waiter subscribes, so it is not
+        # notified.
+        _add(run_store, "dep", {}, Run.STATE.running)
+        _, (dep, ) = run_store.query(job_id="dep")
+        dep._transition(now(), Run.STATE.success)
+        run_store.update(dep, now())
+
+        task = asyncio.ensure_future(waiter.loop())
+        await asyncio.sleep(0.2)
+        task.cancel()
+        await task
+
+    asyncio.new_event_loop().run_until_complete(go())
+    assert started == [run]
+    assert waiter.get_stats()["num_sweeps"] >= 1
+
+
+def test_blocked_by():
+    run_store, waiter, started = _setup()
+    dep0 = _add(run_store, "dep", {"i": "0"}, Run.STATE.waiting)
+    dep1 = _add(run_store, "dep", {"i": "1"}, Run.STATE.waiting)
+    runs = [
+        _add(
+            run_store, "job", {"i": str(i)}, Run.STATE.waiting,
+            [Dependency("dep", {"i": str(i % 2)})]
+        )
+        for i in range(6)
+    ]
+
+    async def go():
+        for run in runs:
+            await waiter.start(run)
+        assert waiter.get_blocked_by(dep0.inst) == runs[0 :: 2]
+        assert waiter.get_blocked_by(dep1.inst) == runs[1 :: 2]
+
+        task = asyncio.ensure_future(waiter.loop())
+        await asyncio.sleep(0)
+        for state in Run.STATE.running, Run.STATE.success:
+            dep1._transition(now(), state)
+            run_store.update(dep1, now())
+        await asyncio.sleep(0.01)
+        task.cancel()
+        await task
+
+    asyncio.new_event_loop().run_until_complete(go())
+    # Dependents of dep1 started, in the order they started waiting.
+    assert started == runs[1 :: 2]
+    assert waiter.get_blocked_by(dep0.inst) == runs[0 :: 2]
+    assert waiter.get_blocked_by(dep1.inst) == []
+
+
+def test_count_running():
+    run_store, _, _ = _setup()
+    for i in range(6):
+        _add(run_store, "job", {"i": str(i % 3), "j": "x"}, Run.STATE.running)
+    _add(run_store, "job", {"i": "0", "j": "x"}, Run.STATE.waiting)
+    _add(run_store, "other", {}, Run.STATE.running)
+
+    assert run_store.count_running("job") == 6
+    assert run_store.count_running("job", {"i": "0", "j": "x"}) == 2
+    assert run_store.count_running("job", {"i": "0"}) == 2
+    assert run_store.count_running("job", {"j": "x"}) == 6
+    assert run_store.count_running("job", {"i": "3"}) == 0
+    assert run_store.count_running("other", {}) == 1
+    assert run_store.count_running("missing") == 0
+
+    _, (run, *_) = run_store.query(job_id="job", state=Run.STATE.running)
+    run._transition(now(), Run.STATE.success)
+    run_store.update(run, now())
+    assert run_store.count_running("job") == 5
+
+
+def test_max_running_fan_out():
+    """
+    Checks that when a slot frees, only the next waiting run is started, and
+    later runs are not rechecked.
+    """
+    run_store, waiter, started = _setup(transition=True)
+    runs = [
+        _add(
+            run_store, "fan", {}, Run.STATE.waiting,
+            [MaxRunning("10", "fan", {})]
+        )
+        for _ in range(1000)
+    ]
+
+    async def go():
+        task = asyncio.ensure_future(waiter.loop())
+        for run in runs:
+            await waiter.start(run)
+        assert started == runs[: 10]
+        await asyncio.sleep(0.01)
+
+        for i in range(20):
+            num_checks = waiter.get_stats()["num_checks"]
+            run = started[i]
+            run._transition(now(), Run.STATE.success)
+            run_store.update(run, now())
+            await asyncio.sleep(0.001)
+            # The next run started; the one after it was checked and is still
+            # blocked; the rest were skipped.
+            assert started == runs[: 11 + i]
+            assert waiter.get_stats()["num_checks"] - num_checks <= 3
+
+        task.cancel()
+        await task
+
+    asyncio.new_event_loop().run_until_complete(go())
+    assert run_store.count_running("fan") == 10
+    assert waiter.get_stats()["num_waiting"] == 1000 - 30
+
+
+def test_priority_fair():
+    """
+    Checks that runs unblocked together start by priority, with jobs taking
+    turns.
+    """
+    run_store, waiter, started = _setup()
+    dep = _add(run_store, "dep", {}, Run.STATE.waiting)
+    cond = lambda: [Dependency("dep", {})]
+    big = [
+        _add(run_store, "big", {"i": str(i)}, Run.STATE.waiting, cond())
+        for i in range(5)
+    ]
+    small = [
+        _add(run_store, "small", {"i": str(i)}, Run.STATE.waiting, cond())
+        for i in range(2)
+    ]
+    urgent = _add(run_store, "urgent", {}, Run.STATE.waiting, cond())
+    urgent.meta["priority"] = 1
+
+    async def go():
+        for run in big + small + [urgent]:
+            await waiter.start(run)
+        assert waiter.get_stats()["num_waiting_by_priority"] \
+            == {"0": 7, "1": 1}
+
+        task = asyncio.ensure_future(waiter.loop())
+        await asyncio.sleep(0)
+        for state in Run.STATE.running, Run.STATE.success:
+            dep._transition(now(), state)
+            run_store.update(dep, now())
+        await asyncio.sleep(0.01)
+        task.cancel()
+        await task
+
+    asyncio.new_event_loop().run_until_complete(go())
+    assert started == [urgent, big[0], small[0], big[1], small[1]] + big[2 :]
+
+
+def test_weight():
+    """
+    Checks that runs unblocked together start in proportion to job weights.
+    """
+    run_store, waiter, started = _setup()
+    dep = _add(run_store, "dep", {}, Run.STATE.waiting)
+    cond = lambda: [Dependency("dep", {})]
+    heavy = [
+        _add(run_store, "heavy", {"i": str(i)}, Run.STATE.waiting, cond())
+        for i in range(4)
+    ]
+    for run in heavy:
+        run.meta["weight"] = 2
+    light = [
+        _add(run_store, "light", {"i": str(i)}, Run.STATE.waiting, cond())
+        for i in range(4)
+    ]
+
+    async def go():
+        for run in light + heavy:
+            await waiter.start(run)
+        task = asyncio.ensure_future(waiter.loop())
+        await asyncio.sleep(0)
+        for state in Run.STATE.running, Run.STATE.success:
+            dep._transition(now(), state)
+            run_store.update(dep, now())
+        await asyncio.sleep(0.01)
+        task.cancel()
+        await task
+
+    asyncio.new_event_loop().run_until_complete(go())
+    assert started == [
+        heavy[0], light[0], heavy[1], heavy[2], light[1], heavy[3],
+    ] + light[2 :]
+
+
+def test_max_running_start_limit():
+    """
+    Checks that runs queued to start by the starter count toward max running
+    conds.
+    """
+    run_store, _, _ = _setup()
+    started = []
+
+    async def start(run):
+        started.append(run)
+        run._transition(now(), Run.STATE.running)
+        run_store.update(run, now())
+
+    starter = Starter(start, {"max_rate": 1000})
+    db = SqliteDB.create(path=None)
+    waiter = Waiter(run_store, starter.start, RunHistory(db.run_history_db))
+    runs = [
+        _add(
+            run_store, "job", {}, Run.STATE.waiting,
+            [MaxRunning("2", "job", {})]
+        )
+        for _ in range(50)
+    ]
+
+    async def go():
+        tasks = [
+            asyncio.ensure_future(starter.loop()),
+            asyncio.ensure_future(waiter.loop()),
+        ]
+        for run in runs:
+            await waiter.start(run)
+        # Runs queued to start count as running.
+        assert run_store.count_running("job") == 2
+        await asyncio.sleep(0.05)
+        assert started == runs[: 2]
+
+        # When a run completes, only one more starts.
+        run = runs[0]
+        run._transition(now(), Run.STATE.success)
+        run_store.update(run, now())
+        await asyncio.sleep(0.05)
+        assert started == runs[: 3]
+        assert run_store.count_running("job") == 2
+
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    asyncio.new_event_loop().run_until_complete(go())
+
+
+def test_dependency_evicted(monkeypatch):
+    """
+    Checks that a dependency is satisfied by an evicted run.
+    """
+    monkeypatch.setattr(RunStore, "EVICT_INTERVAL", 0)
+    db = SqliteDB.create(path=None)
+    run_store = RunStore(db, min_timestamp=None, max_age=0.05)
+    started = []
+
+    async def start(run):
+        started.append(run)
+
+    waiter = Waiter(run_store, start, RunHistory(db.run_history_db))
+    dep = _add(run_store, "dep", {"i": "0"}, Run.STATE.running)
+    dep._transition(now(), Run.STATE.success)
+    run_store.update(dep, now())
+    time.sleep(0.1)
+    # An update triggers eviction.
+    _add(run_store, "other", {}, Run.STATE.running)
+    assert run_store.get_stats()["num_evicted"] == 1
+    _, runs = run_store.query(job_id="dep")
+    assert runs == []
+
+    run = _add(
+        run_store, "job", {"i": "0"}, Run.STATE.waiting,
+        [Dependency("dep", {"i": "0"})]
+    )
+    blocked = [
+        _add(
+            run_store, "job", {"i": "1"}, Run.STATE.waiting,
+            [Dependency("dep", {"i": "1"})]
+        )
+        for _ in range(2)
+    ]
+
+    async def go():
+        await waiter.start(run)
+        for b in blocked:
+            await waiter.start(b)
+
+    asyncio.new_event_loop().run_until_complete(go())
+    assert started == [run]
+    assert waiter.get_stats()["num_waiting"] == 2
+    # The miss for the blocked runs' dependency is remembered.
+    assert run_store.get_stats()["num_exists_checks"] == 2